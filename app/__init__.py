@@ -1,9 +1,12 @@
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_session import Session
+from .cache import cache
 from .config import Config
+from .hashing import hasher
+from .history import history
 from .models import db
+from . import database, sessions
 
 def create_app():
     app = Flask(__name__)
@@ -19,9 +22,21 @@ def create_app():
         )
 
     # Initialize extensions
-    db.init_app(app)
+    # Database engines: pooling, post-fork reset and the read replica bind
+    database.init_app(app)
     Migrate(app, db)
+    cache.init_app(app)
+    hasher.init_app(app)
+    history.init_app(app)
     
+    # Async engine for the ASGI read path
+    from . import async_db
+    async_db.init_app(app)
+
+    # Per-request timing, SQL counts, Server-Timing and /metrics
+    from . import metrics
+    metrics.init_app(app)
+
     # Configure CORS
     CORS(
         app,
@@ -30,7 +45,39 @@ def create_app():
     )
     
     # Configure sessions
-    Session(app)
+    sessions.init_app(app)
+
+    # Product search index maintenance commands
+    from . import search
+    search.init_app(app)
+
+    # Admin dashboard counter maintenance commands
+    from . import analytics
+    analytics.init_app(app)
+
+    # EXPLAIN-based check that hot queries stay on their indexes
+    from . import query_plans
+    query_plans.init_app(app)
+
+    # Synthetic data generator for load and scale testing
+    from . import datagen
+    datagen.init_app(app)
+
+    # Autocomplete prefix index
+    from . import suggest
+    suggest.init_app(app)
+
+    # Similar products and per-user recommendations
+    from . import recommend
+    recommend.init_app(app)
+
+    # Memory-mapped catalog snapshot for the ratio sorts
+    from . import snapshot
+    snapshot.init_app(app)
+
+    # Server-Sent Events broker
+    from . import push
+    push.init_app(app)
 
     # Register blueprints
     from .routes import main as main_blueprint
@@ -0,0 +1,187 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import case, delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from .database import upsert
+from .models import db, AnalyticsCounter, Category, Product, Retailer, User
+
+# Dashboard totals come from analytics_counters, which is adjusted in the same
+# transaction as every ORM insert/update/delete of the counted models, so
+# reading them is a handful of primary-key lookups no matter how big the
+# tables get. Writes that bypass the ORM must call increment() themselves,
+# and `flask analytics-recount` rebuilds everything from COUNT queries.
+
+
+def user_role(is_admin, is_retailer):
+    if is_admin:
+        return 'admin'
+    if is_retailer:
+        return 'retailer'
+    return 'shopper'
+
+
+def _old_value(obj, attr):
+    history = inspect(obj).attrs[attr].load_history()
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+def contributions(kind, values):
+    if kind is User:
+        return ['users', f"users.{user_role(values['is_admin'], values['is_retailer'])}"]
+    if kind is Retailer:
+        return ['retailers', 'retailers.approved' if values['approved'] else 'retailers.pending']
+    if kind is Product:
+        return [
+            'products',
+            f"products.category.{values['category_id']}",
+            f"products.retailer.{values['retailer_id']}",
+        ]
+    return []
+
+
+COUNTED_ATTRS = {
+    User: ('is_admin', 'is_retailer'),
+    Retailer: ('approved',),
+    Product: ('category_id', 'retailer_id'),
+}
+
+
+def _current(obj):
+    return {attr: getattr(obj, attr) for attr in COUNTED_ATTRS[type(obj)]}
+
+
+def _previous(obj):
+    return {attr: _old_value(obj, attr) for attr in COUNTED_ATTRS[type(obj)]}
+
+
+@event.listens_for(Session, 'before_flush')
+def _snapshot_deletes(sess, flush_context, instances):
+    # Deleted rows are read while they still exist
+    snapshots = sess.info.setdefault('counted_deletes', [])
+    for obj in sess.deleted:
+        if type(obj) in COUNTED_ATTRS:
+            snapshots.append((type(obj), _previous(obj)))
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_changes(sess, flush_context):
+    # Runs after the INSERTs so defaults and foreign keys are populated, but
+    # before new/dirty/deleted are reset.
+    deltas = Counter()
+    for obj in sess.new:
+        if type(obj) in COUNTED_ATTRS:
+            deltas.update(contributions(type(obj), _current(obj)))
+    for kind, values in sess.info.pop('counted_deletes', []):
+        deltas.subtract(contributions(kind, values))
+    for obj in sess.dirty:
+        if type(obj) in COUNTED_ATTRS and obj not in sess.deleted:
+            before, after = _previous(obj), _current(obj)
+            if before != after:
+                deltas.subtract(contributions(type(obj), before))
+                deltas.update(contributions(type(obj), after))
+
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas:
+        increment(sess.connection(), deltas)
+
+
+def increment(connection, deltas):
+    # Upserts: per-category and per-retailer counters are created by their
+    # first write, which concurrent transactions may make at the same time
+    for name, delta in sorted(deltas.items()):
+        statement = upsert(connection, AnalyticsCounter).values(name=name, value=delta)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[AnalyticsCounter.name],
+            set_={'value': AnalyticsCounter.value + delta},
+        ))
+
+
+def counters(*names):
+    rows = db.session.execute(
+        select(AnalyticsCounter.name, AnalyticsCounter.value).where(AnalyticsCounter.name.in_(names))
+    ).all()
+    values = dict.fromkeys(names, 0)
+    values.update(rows)
+    return values
+
+
+def users_by_role():
+    role = case(
+        (User.is_admin == True, 'admin'),  # noqa: E712
+        (User.is_retailer == True, 'retailer'),  # noqa: E712
+        else_='shopper'
+    ).label('role')
+    return dict(db.session.execute(select(role, func.count()).group_by(role)).all())
+
+
+def retailers_by_status():
+    status = case((Retailer.approved == True, 'approved'), else_='pending').label('status')  # noqa: E712
+    counts = {'pending': 0, 'approved': 0}
+    counts.update(db.session.execute(select(status, func.count()).group_by(status)).all())
+    return counts
+
+
+def products_by_category():
+    rows = db.session.execute(
+        select(Category.id, Category.name, func.count(Product.id))
+        .outerjoin(Product, Product.category_id == Category.id)
+        .group_by(Category.id, Category.name)
+        .order_by(func.count(Product.id).desc())
+    ).all()
+    return [{'category_id': id, 'name': name, 'products': count} for id, name, count in rows]
+
+
+def products_by_retailer(limit=50):
+    rows = db.session.execute(
+        select(Retailer.id, Retailer.name, func.count(Product.id))
+        .outerjoin(Product, Product.retailer_id == Retailer.id)
+        .group_by(Retailer.id, Retailer.name)
+        .order_by(func.count(Product.id).desc())
+        .limit(limit)
+    ).all()
+    return [{'retailer_id': id, 'name': name, 'products': count} for id, name, count in rows]
+
+
+def signups_per_day(days=30):
+    since = datetime.utcnow() - timedelta(days=days)
+    day = func.date(User.created_at).label('day')
+    rows = db.session.execute(
+        select(day, func.count()).where(User.created_at >= since).group_by(day).order_by(day)
+    ).all()
+    return [{'day': str(day), 'signups': count} for day, count in rows]
+
+
+def recount(connection):
+    """Rebuild analytics_counters from scratch with COUNT/GROUP BY queries."""
+    deltas = Counter()
+    for is_admin, is_retailer, count in connection.execute(
+        select(User.is_admin, User.is_retailer, func.count()).group_by(User.is_admin, User.is_retailer)
+    ):
+        deltas['users'] += count
+        deltas[f'users.{user_role(is_admin, is_retailer)}'] += count
+    for approved, count in connection.execute(select(Retailer.approved, func.count()).group_by(Retailer.approved)):
+        deltas['retailers'] += count
+        deltas['retailers.approved' if approved else 'retailers.pending'] += count
+    for category_id, count in connection.execute(select(Product.category_id, func.count()).group_by(Product.category_id)):
+        deltas['products'] += count
+        deltas[f'products.category.{category_id}'] += count
+    for retailer_id, count in connection.execute(select(Product.retailer_id, func.count()).group_by(Product.retailer_id)):
+        deltas[f'products.retailer.{retailer_id}'] += count
+
+    connection.execute(delete(AnalyticsCounter))
+    if deltas:
+        connection.execute(insert(AnalyticsCounter), [{'name': name, 'value': value} for name, value in deltas.items()])
+
+
+def init_app(app):
+    @app.cli.command('analytics-recount')
+    def analytics_recount():
+        """Rebuild the admin dashboard counters from the base tables."""
+        with db.engine.begin() as connection:
+            recount(connection)
+        click.echo('Analytics counters rebuilt.')
@@ -0,0 +1,73 @@
+"""ASGI entry point: ``uvicorn app.asgi:app``.
+
+/events is served by Starlette, so an idle SSE connection costs a coroutine
+instead of a worker thread. GETs on /products, /categories, /search and
+/check_session are served by the async handlers in app/async_reads.py
+(unless ASYNC_READS_ENABLED is off). Every other path goes to the Flask app,
+which runs in a thread pool.
+"""
+from contextlib import asynccontextmanager
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from . import create_app, push
+from .async_db import async_db
+from .async_reads import AsyncReads, cors_headers, request_identity
+from .models import db
+
+flask_app = create_app()
+
+
+def _replay(topics, last_event_id):
+    with flask_app.app_context():
+        try:
+            return push.replay(topics, last_event_id, flask_app.config['PUSH_REPLAY_LIMIT'])
+        finally:
+            db.session.remove()
+
+
+async def events(request):
+    identity = await request_identity(flask_app, request)
+    headers = cors_headers(flask_app, request)
+    topics = push.topics_for(identity)
+    if not topics:
+        return JSONResponse({'error': 'Unauthorized'}, 401, headers=headers)
+
+    try:
+        last_event_id = push.parse_last_event_id(
+            request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+        )
+    except ValueError:
+        return JSONResponse({'error': 'Invalid Last-Event-ID'}, 400, headers=headers)
+
+    config = flask_app.config
+    # Subscribe before replaying so nothing falls between the two
+    sub = push.broker.subscribe(push.AsyncSubscription(topics, config['PUSH_QUEUE_SIZE']))
+    try:
+        backlog = await run_in_threadpool(_replay, topics, last_event_id)
+    except Exception:
+        push.broker.unsubscribe(sub)
+        raise
+
+    return StreamingResponse(
+        push.async_stream(sub, backlog, last_event_id, config['PUSH_HEARTBEAT']),
+        media_type='text/event-stream',
+        headers={**push.SSE_HEADERS, **headers}
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await async_db.dispose()
+
+
+routes = [Route('/events', events)]
+if flask_app.config['ASYNC_READS_ENABLED']:
+    routes += AsyncReads(flask_app).routes()
+
+app = Starlette(routes=[*routes, Mount('/', app=WsgiToAsgi(flask_app))], lifespan=lifespan)
@@ -0,0 +1,117 @@
+from uuid import uuid4
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from .database import REPLICA_BIND
+from .models import db
+
+# Async engine for the ASGI read path (app/async_reads.py). It shares the
+# models and database with the Flask app but talks to it through an async
+# driver, so a request waiting on a query holds a coroutine instead of a
+# worker. The engine is bound to the event loop that first uses it, which is
+# why it is created lazily inside the ASGI server rather than in create_app.
+# Everything served here is a read, so it uses the replica when there is one;
+# a second, primary engine then checks whether the replica has caught up
+# before a response is cached.
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_url(url):
+    """``url`` with its driver swapped for the async one (psycopg2 -> asyncpg, pysqlite -> aiosqlite)."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {backend!r}; set ASYNC_DATABASE_URI')
+    connect_args = {}
+    if backend == 'postgresql' and 'sslmode' in url.query:
+        # asyncpg takes the libpq sslmode names as its ssl argument
+        connect_args['ssl'] = url.query['sslmode']
+        url = url.difference_update_query(['sslmode'])
+    return url.set(drivername=ASYNC_DRIVERS[backend]), connect_args
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.primary_engine = None
+        self._sessionmaker = None
+        self._primary_sessionmaker = None
+
+    def init_app(self, app):
+        app.config.setdefault('ASYNC_DATABASE_URI', None)
+        app.config.setdefault('ASYNC_DB_POOL_SIZE', 10)
+        self.app = app
+        app.extensions['async_db'] = self
+
+    def _engine_for(self, url, connect_args):
+        config = self.app.config
+        options = {'connect_args': connect_args}
+        if url.get_backend_name() != 'sqlite' and config['DB_PGBOUNCER']:
+            # Transaction pooling cannot keep asyncpg's named prepared
+            # statements, so disable its cache and make names unique
+            options['poolclass'] = NullPool
+            connect_args.update(statement_cache_size=0, prepared_statement_name_func=lambda: f'__asyncpg_{uuid4()}__')
+        elif url.get_backend_name() != 'sqlite':
+            options.update(pool_size=config['ASYNC_DB_POOL_SIZE'], pool_recycle=config['DB_POOL_RECYCLE'],
+                           pool_pre_ping=config['DB_POOL_PRE_PING'])
+        return create_async_engine(url, **options)
+
+    def _create_engine(self):
+        config = self.app.config
+        replica = None
+        if config['ASYNC_DATABASE_URI']:
+            url, connect_args = make_url(config['ASYNC_DATABASE_URI']), {}
+        else:
+            # Flask-SQLAlchemy resolves relative SQLite paths against the
+            # instance folder; start from its engine so both open one file
+            with self.app.app_context():
+                replica = db.engines.get(REPLICA_BIND)
+                url, connect_args = async_url((replica or db.engine).url)
+                primary_url = db.engine.url
+        self.engine = self._engine_for(url, connect_args)
+        self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        if replica is not None:
+            self.primary_engine = self._engine_for(*async_url(primary_url))
+            self._primary_sessionmaker = async_sessionmaker(self.primary_engine, expire_on_commit=False)
+        else:
+            self.primary_engine, self._primary_sessionmaker = self.engine, self._sessionmaker
+
+    @property
+    def has_replica(self):
+        if self._sessionmaker is None:
+            self._create_engine()
+        return self.primary_engine is not self.engine
+
+    def session(self):
+        """A new AsyncSession; use it as ``async with async_db.session() as session``."""
+        if self._sessionmaker is None:
+            self._create_engine()
+        return self._sessionmaker()
+
+    def primary_session(self):
+        """A new AsyncSession on the primary; the same as session() without a replica."""
+        if self._sessionmaker is None:
+            self._create_engine()
+        return self._primary_sessionmaker()
+
+    async def dispose(self):
+        if self.primary_engine is not None and self.primary_engine is not self.engine:
+            await self.primary_engine.dispose()
+        if self.engine is not None:
+            await self.engine.dispose()
+        self.engine = self.primary_engine = None
+        self._sessionmaker = self._primary_sessionmaker = None
+
+
+async_db = AsyncDatabase()
+
+
+def init_app(app):
+    async_db.init_app(app)
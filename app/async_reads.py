@@ -0,0 +1,245 @@
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.http import parse_date, parse_etags
+
+from . import facets, search, snapshot
+from .async_db import async_db
+from .cache import cache
+from .conditional import not_modified, validators
+from .history import history
+from .metrics import AsgiInstrumentation
+from .models import Category, CollectionVersion, Product
+from .pagination import InvalidCursor, keyset_query, keyset_result, parse_limit
+from .routes import PRODUCT_SORT_KEYS
+from .serializers import CategoryOut, ProductOut, dumps, product_rows, products_from_rows, search_results
+from .sessions import identity_from_row, identity_query, session_from_cookie
+
+# Async versions of the hottest read endpoints, served by Starlette ahead of
+# the Flask mount in app/asgi.py. They answer exactly like the Flask
+# resources: same bodies, the same ETag/Last-Modified validators, and the
+# same response cache entries (keys use the Flask endpoint names), so a
+# client cannot tell which side served it and a cached page is shared by
+# both. Only GET is routed here; every other method on these paths falls
+# through to Flask. The response cache, the session store and the history
+# buffer are synchronous clients (filesystem, Redis), so they are called
+# through the thread pool rather than on the event loop.
+
+
+def cors_headers(flask_app, request):
+    # Flask-CORS only covers the Flask routes
+    origin = request.headers.get('origin')
+    if origin and origin in flask_app.config['CORS_ORIGINS']:
+        return {'Access-Control-Allow-Origin': origin, 'Access-Control-Allow-Credentials': 'true', 'Vary': 'Origin'}
+    return {}
+
+
+async def request_identity(flask_app, request):
+    """As sessions.current_identity for a Starlette request: decoded in the pool, roles read from the primary."""
+    cookie_name = flask_app.session_interface.get_cookie_name(flask_app)
+    data = await run_in_threadpool(session_from_cookie, flask_app, request.cookies.get(cookie_name))
+    if not data.get('user_id'):
+        return {}
+    async with async_db.primary_session() as session:
+        row = (await session.execute(identity_query(data['user_id']))).first()
+    return identity_from_row(row, data.get('generation'))
+
+
+class AsyncReads:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    def routes(self):
+        # (path, handler, the Flask rule it mirrors, for the metrics label)
+        routes = [
+            ('/products', self.products, '/products'),
+            ('/products/{product_id:int}', self.products, '/products/<int:product_id>'),
+            ('/categories', self.categories, '/categories'),
+            ('/categories/{category_id:int}', self.categories, '/categories/<int:category_id>'),
+            ('/search/{query}', self.search, '/search/<string:query>'),
+            ('/check_session', self.check_session, '/check_session'),
+        ]
+        return [
+            Route(path, handler, methods=['GET'], middleware=[Middleware(AsgiInstrumentation, endpoint=rule)])
+            for path, handler, rule in routes
+        ]
+
+    def _respond(self, request, status, body=b'', headers=None):
+        headers = {**(headers or {}), **cors_headers(self.flask_app, request)}
+        return Response(body, status, headers=headers, media_type='application/json' if body else None)
+
+    async def _serve(self, request, handler, endpoint, tags, view_args, conditional=None):
+        """Run ``handler`` behind the same validators and response cache as the Flask resource.
+
+        ``conditional`` is a (collection, Cache-Control) pair for endpoints
+        wrapped in @conditional; ``view_args`` key the cache entry.
+        """
+        async with async_db.session() as session:
+            headers = {}
+            if conditional:
+                collection, cache_control = conditional
+                version, updated_at = await self._current_version(session, collection)
+                etag, last_modified, headers = validators(
+                    collection, version, updated_at, None, f'{request.url.path}?{request.url.query}', cache_control
+                )
+                if not_modified(etag, last_modified, parse_etags(request.headers.get('if-none-match')),
+                                parse_date(request.headers.get('if-modified-since'))):
+                    return self._respond(request, 304, headers=headers)
+
+            key = None
+            if cache.enabled:
+                key = await run_in_threadpool(
+                    cache.key_for, tags, view_args, endpoint=endpoint, params=request.query_params.multi_items()
+                )
+                body = await run_in_threadpool(cache.get, key)
+                if body is not None:
+                    return self._respond(request, 200, body, {**headers, 'X-Cache': 'HIT'})
+
+            # As @cached: a body read from a replica that is behind the
+            # primary's collection versions is served but not stored
+            seen = await self._versions(session, tags) if key is not None and async_db.has_replica else None
+            data, status = await handler(session, request)
+            body = dumps(data) + b'\n'
+            if status != 200:
+                return self._respond(request, status, body)
+            if key is not None:
+                if seen is None or await self._caught_up(seen, tags):
+                    await run_in_threadpool(cache.set, key, body)
+                headers['X-Cache'] = 'MISS'
+            return self._respond(request, 200, body, headers)
+
+    @staticmethod
+    async def _versions(session, names):
+        statement = select(CollectionVersion.name, CollectionVersion.version).where(CollectionVersion.name.in_(names))
+        return dict((await session.execute(statement)).all())
+
+    async def _caught_up(self, seen, names):
+        async with async_db.primary_session() as primary:
+            current = await self._versions(primary, names)
+        return all(seen.get(name, 0) >= version for name, version in current.items())
+
+    @staticmethod
+    async def _current_version(session, name):
+        # As conditional.current_version: from the same database as the body
+        row = await session.get(CollectionVersion, name)
+        return (row.version, row.updated_at) if row else (0, None)
+
+    async def products(self, request):
+        product_id = request.path_params.get('product_id')
+
+        async def handler(session, request):
+            if product_id:
+                row = (await session.execute(product_rows().where(Product.id == product_id))).first()
+                if row is None:
+                    return {'error': 'Product not found'}, 404
+                return ProductOut.from_row(row), 200
+
+            args = request.query_params
+            sort = args.get('sort', 'newest')
+            sort_keys = PRODUCT_SORT_KEYS.get(sort)
+            if sort_keys is None and sort not in snapshot.RATIO_SORTS:
+                return {'error': 'Invalid sort'}, 400
+            try:
+                filters = facets.parse_filters(args)
+            except facets.InvalidFilter as e:
+                return {'error': f'Invalid {e}'}, 400
+            limit = parse_limit(args=args)
+            try:
+                if sort_keys is None:
+                    rows, next_cursor = await self._ratio_page(session, sort, filters, limit, args.get('cursor'))
+                else:
+                    statement = keyset_query(product_rows().where(*facets.conditions(filters)), sort_keys, limit,
+                                             cursor=args.get('cursor'))
+                    rows, next_cursor = keyset_result((await session.execute(statement)).all(), sort_keys, limit)
+            except InvalidCursor:
+                return {'error': 'Invalid cursor'}, 400
+            body = {'products': products_from_rows(rows), 'next_cursor': next_cursor}
+            if args.get('facets') == 'true':
+                body['facets'] = facets.facets_from_rows((await session.execute(facets.facet_counts_query(filters))).all())
+            return body, 200
+
+        view_args = {'product_id': product_id} if product_id is not None else {}
+        return await self._serve(request, handler, 'main.productresource', ('products',), view_args,
+                                 ('products', 'public, no-cache'))
+
+    async def _ratio_page(self, session, sort, filters, limit, cursor):
+        # As ProductResource._ratio_page. Mapping the snapshot and ranking it
+        # touch files and run NumPy, so they go to the thread pool
+        version = await self._current_version(session, 'products')
+        ranked = await run_in_threadpool(self._rank_snapshot, version, sort, filters, limit, cursor)
+        if ranked is not None:
+            ids, next_cursor = ranked
+            rows = (await session.execute(product_rows().where(Product.id.in_(ids)))).all()
+            return snapshot.ordered_rows(rows, ids), next_cursor
+        statement, columns = snapshot.ratio_page_query(sort, filters, limit, cursor)
+        rows, next_cursor = keyset_result((await session.execute(statement)).all(), columns, limit)
+        return [row[:-1] for row in rows], next_cursor
+
+    @staticmethod
+    def _rank_snapshot(version, sort, filters, limit, cursor):
+        catalog = snapshot.catalog.current(*version)
+        if catalog is None:
+            return None
+        return catalog.rank(sort, filters, limit, cursor)
+
+    async def categories(self, request):
+        category_id = request.path_params.get('category_id')
+
+        async def handler(session, request):
+            if category_id:
+                category = await session.get(Category, category_id)
+                if category is None:
+                    return {'error': 'Category not found'}, 404
+                return CategoryOut.from_model(category), 200
+            categories = (await session.execute(select(Category))).scalars().all()
+            return [CategoryOut.from_model(category) for category in categories], 200
+
+        view_args = {'category_id': category_id} if category_id is not None else {}
+        return await self._serve(request, handler, 'main.categoryresource', ('categories',), view_args,
+                                 ('categories', 'public, max-age=300'))
+
+    async def search(self, request):
+        query = request.path_params['query']
+        user_id = (await request_identity(self.flask_app, request)).get('user_id')
+        if user_id and request.query_params.get('record') == 'true':
+            await run_in_threadpool(history.record, user_id, query)
+
+        async def handler(session, request):
+            cursor = request.query_params.get('cursor')
+            sort_keys = PRODUCT_SORT_KEYS['value']
+            limit = parse_limit(args=request.query_params)
+            # match() inspects the connection (dialect, FTS table) synchronously
+            matching = await session.run_sync(
+                lambda sync_session: search.match(select(Product), query,
+                                                  connection=sync_session.connection())
+            )
+            try:
+                statement = keyset_query(matching, sort_keys, limit, cursor=cursor)
+            except InvalidCursor:
+                return {'error': 'Invalid cursor'}, 400
+            products, next_cursor = keyset_result((await session.execute(statement)).scalars().all(), sort_keys, limit)
+            if not products:
+                return {'error': 'No products found'}, 404
+            return {'products': search_results(products, first_page=not cursor), 'next_cursor': next_cursor}, 200
+
+        view_args = {'query': ' '.join(search.tokenize(query))}
+        return await self._serve(request, handler, 'main.searchproductsresource', ('products',), view_args)
+
+    def _no_session(self, request):
+        # As Flask's `{}, 204`: the body is dropped but the JSON type is kept
+        return Response(status_code=204, headers=cors_headers(self.flask_app, request), media_type='application/json')
+
+    async def check_session(self, request):
+        identity = await request_identity(self.flask_app, request)
+        if not identity:
+            return self._no_session(request)
+
+        body = dumps({
+            'id': identity['user_id'],
+            'username': identity['username'],
+            'is_retailer': identity['is_retailer'],
+            'is_admin': identity['is_admin'],
+        }) + b'\n'
+        return self._respond(request, 200, body)
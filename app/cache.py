@@ -0,0 +1,241 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from cachelib import BaseCache, FileSystemCache, NullCache, RedisCache, SimpleCache
+from flask import current_app, make_response, request
+
+from .conditional import caught_up, collection_versions
+from .database import replica_bind
+from .serializers import dumps
+
+
+class LRUCache(BaseCache):
+    """In-process LRU with per-entry TTL, counting hits, misses and evictions."""
+
+    def __init__(self, max_entries=1024, default_timeout=60):
+        super().__init__(default_timeout=default_timeout)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expiry(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._entries:
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[0] is None or entry[0] > time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _shared_backend(config):
+    cache_type = config['CACHE_TYPE']
+    timeout = config['CACHE_DEFAULT_TIMEOUT']
+    if cache_type == 'null':
+        return NullCache()
+    if cache_type == 'simple':
+        return SimpleCache(default_timeout=timeout)
+    if cache_type == 'filesystem':
+        return FileSystemCache(config['CACHE_DIR'], threshold=config['CACHE_THRESHOLD'], default_timeout=timeout)
+    if cache_type == 'redis':
+        import redis
+        return RedisCache(
+            redis.from_url(config['CACHE_REDIS_URL']),
+            default_timeout=timeout,
+            key_prefix=config['CACHE_KEY_PREFIX']
+        )
+    raise ValueError(f'Unknown CACHE_TYPE {cache_type!r}')
+
+
+class ResponseCache:
+    """Caches encoded JSON responses, invalidated by tag.
+
+    Every tag has a version token in the shared backend and each entry key
+    embeds the tokens of its tags, so bumping a tag makes all of its entries
+    unreachable in every worker at once. Entries themselves live either in
+    the shared backend or, with CACHE_LOCAL_ENTRIES, in a per-worker LRU.
+    """
+
+    def __init__(self, app=None):
+        self.shared = NullCache()
+        self.entries = self.shared
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'simple')
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 60)
+        app.config.setdefault('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+        app.config.setdefault('CACHE_THRESHOLD', 5000)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+        app.config.setdefault('CACHE_KEY_PREFIX', 'buygenius_cache_')
+        app.config.setdefault('CACHE_LOCAL_ENTRIES', True)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+
+        self.shared = _shared_backend(app.config)
+        self.enabled = app.config['CACHE_TYPE'] != 'null'
+        if self.enabled and app.config['CACHE_LOCAL_ENTRIES']:
+            self.entries = LRUCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_DEFAULT_TIMEOUT'])
+        else:
+            self.entries = self.shared
+        app.extensions['response_cache'] = self
+
+    def _tag_version(self, tag):
+        key = f'tag:{tag}'
+        version = self.shared.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            # add() so concurrent workers agree on the first token
+            if not self.shared.add(key, version, timeout=0):
+                version = self.shared.get(key) or version
+        return version
+
+    def invalidate(self, *tags):
+        if not self.enabled:
+            return
+        for tag in tags:
+            self.shared.set(f'tag:{tag}', uuid.uuid4().hex, timeout=0)
+        with self._lock:
+            self.invalidations += len(tags)
+
+    def key_for(self, tags, view_args, endpoint=None, params=None):
+        """The entry key for the current request, or for ``endpoint`` and ``params`` outside Flask."""
+        versions = ','.join(f'{tag}={self._tag_version(tag)}' for tag in tags)
+        if endpoint is None:
+            endpoint, params = request.endpoint, request.args.items(multi=True)
+        params = sorted(params)
+        raw = f'{endpoint}|{sorted(view_args.items())}|{params}|{versions}'
+        return 'response:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        body = self.entries.get(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def set(self, key, body, timeout=None):
+        self.entries.set(key, body, timeout=timeout)
+
+    def stats(self):
+        stats = {
+            'pid': os.getpid(),
+            'backend': current_app.config['CACHE_TYPE'],
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+        if isinstance(self.entries, LRUCache):
+            stats.update({
+                'entries': len(self.entries),
+                'max_entries': self.entries.max_entries,
+                'evictions': self.entries.evictions,
+                'expirations': self.entries.expirations,
+            })
+        return stats
+
+
+cache = ResponseCache()
+
+
+def _json_body(body, status, cache_status):
+    resp = make_response(body, status)
+    resp.headers['Content-Type'] = 'application/json'
+    resp.headers['X-Cache'] = cache_status
+    return resp
+
+
+def cached(*tags, timeout=None, normalize=None):
+    """Cache a Resource GET's successful JSON response under ``tags``.
+
+    ``normalize`` may rewrite the view arguments used in the cache key, e.g.
+    to fold equivalent search strings together.
+
+    When the handler reads from a replica, the collection versions for
+    ``tags`` are read there before it runs and compared with the primary's
+    after. A replica that had not applied the latest write may have served
+    stale rows, so that body goes out but is not stored under the new key.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return f(*args, **kwargs)
+
+            key_args = normalize(dict(kwargs)) if normalize else kwargs
+            key = cache.key_for(tags, key_args)
+            body = cache.get(key)
+            if body is not None:
+                return _json_body(body, 200, 'HIT')
+
+            replica = replica_bind()
+            seen = collection_versions(tags, replica) if replica is not None else None
+            rv = f(*args, **kwargs)
+            if not (isinstance(rv, tuple) and len(rv) == 2 and rv[1] == 200):
+                return rv
+
+            body = dumps(rv[0]) + b'\n'
+            if seen is None or caught_up(seen, tags):
+                cache.set(key, body, timeout=timeout)
+            return _json_body(body, 200, 'MISS')
+        return wrapper
+    return decorator
@@ -0,0 +1,61 @@
+from sqlalchemy import func, select
+
+from .models import Product, Retailer
+
+# Cross-retailer price comparison. Listings of the same item by different
+# retailers share Product.canonical_key. Offers are ranked inside each group
+# with window functions, so a comparison, or a page of groups with their
+# best offer, is a single query over the canonical_key index.
+
+def total_cost():
+    return Product.price + func.coalesce(Product.delivery_cost, 0)
+
+
+def _ranked(*criteria):
+    """Every offer matching ``criteria`` with its group's aggregates and its rank in the group."""
+    total = total_cost()
+    group = Product.canonical_key
+    cheapest_first = [total.asc(), Product.value_score.desc(), Product.id.asc()]
+    best_value_first = [Product.value_score.desc(), total.asc(), Product.id.asc()]
+    return (
+        select(
+            Product.id.label('product_id'),
+            Product.name,
+            Product.price,
+            Product.delivery_cost,
+            total.label('total_cost'),
+            Product.value_score,
+            Product.payment_mode,
+            Product.image_url,
+            Product.retailer_id,
+            func.coalesce(Retailer.name, 'Unknown').label('retailer_name'),
+            Retailer.whatsapp_number.label('retailer_whatsapp'),
+            Product.canonical_key,
+            func.count().over(partition_by=group).label('offer_count'),
+            func.min(total).over(partition_by=group).label('min_total'),
+            func.max(total).over(partition_by=group).label('max_total'),
+            func.row_number().over(partition_by=group, order_by=cheapest_first).label('price_rank'),
+            func.first_value(Product.id).over(partition_by=group, order_by=best_value_first).label('best_value_id'),
+        )
+        .select_from(Product)
+        .outerjoin(Retailer, Product.retailer_id == Retailer.id)
+        .where(Product.canonical_key != '', *criteria)
+    )
+
+
+def offers_query(canonical_key):
+    """All offers for one item, cheapest total cost first."""
+    ranked = _ranked(Product.canonical_key == canonical_key).subquery()
+    return select(ranked).order_by(ranked.c.price_rank)
+
+
+def groups_query(category_id=None, min_offers=1):
+    """One row per item: its cheapest offer plus the group's aggregates.
+
+    Page it with keyset_page on the selected ``canonical_key``. The cursor
+    predicate is on the partition column, so Postgres applies it before
+    ranking rather than ranking the whole catalog for every page.
+    """
+    criteria = [Product.category_id == category_id] if category_id is not None else []
+    ranked = _ranked(*criteria).subquery()
+    return select(ranked).where(ranked.c.price_rank == 1, ranked.c.offer_count >= min_offers)
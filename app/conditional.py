@@ -0,0 +1,140 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request, session
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from werkzeug.http import http_date
+
+from .database import upsert
+from .models import db, Category, CollectionVersion, Conversation, Message, Notification, Product, Retailer
+
+# Collections whose version is bumped whenever a row of the model changes.
+# Retailer changes bump 'products' too because product payloads embed the
+# retailer's name and WhatsApp number.
+TRACKED_MODELS = {
+    Product: ('products',),
+    Retailer: ('products', 'retailers'),
+    Category: ('categories',),
+    Notification: ('notifications',),
+    Message: ('messages',),
+    Conversation: ('messages',),
+}
+
+
+def bump(connection, *names):
+    """Advance the version of ``names`` inside the caller's transaction.
+
+    Writes that bypass the ORM (bulk inserts and the like) must call this
+    themselves; ORM writes are picked up by the flush hooks below.
+    """
+    now = datetime.utcnow()
+    for name in names:
+        # One upsert, so two transactions creating the same row don't race
+        # on the primary key
+        statement = upsert(connection, CollectionVersion).values(name=name, version=1, updated_at=now)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[CollectionVersion.name],
+            set_={'version': CollectionVersion.version + 1, 'updated_at': now},
+        ))
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_changed_collections(sess, flush_context, instances):
+    changed = sess.info.setdefault('changed_collections', set())
+    for obj in sess.new | sess.deleted:
+        changed.update(TRACKED_MODELS.get(type(obj), ()))
+    for obj in sess.dirty:
+        if type(obj) in TRACKED_MODELS and sess.is_modified(obj):
+            changed.update(TRACKED_MODELS[type(obj)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_collections(sess, flush_context):
+    changed = sess.info.pop('changed_collections', None)
+    if changed:
+        bump(sess.connection(), *sorted(changed))
+
+
+def current_version(name):
+    # In @read_only handlers this reads the replica, like the handler's own
+    # queries, so the validators describe the data the body is built from
+    row = db.session.get(CollectionVersion, name)
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
+
+
+def collection_versions(names, bind=None):
+    """{name: version} for the ``names`` that have a version row, read from ``bind`` or the primary."""
+    return dict(db.session.execute(
+        select(CollectionVersion.name, CollectionVersion.version).where(CollectionVersion.name.in_(names)),
+        bind_arguments={'bind': bind if bind is not None else db.engine}
+    ).all())
+
+
+def caught_up(seen, names):
+    """Whether versions ``seen`` on a replica are at least the primary's current ones."""
+    current = collection_versions(names)
+    return all(seen.get(name, 0) >= version for name, version in current.items())
+
+
+def validators(collection, version, updated_at, scope, full_path, cache_control, per_user=False):
+    """The ETag, Last-Modified datetime and response headers for one version of ``collection``."""
+    raw = f'{collection}:{version}:{scope}:{full_path}'
+    etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if per_user:
+        headers['Vary'] = 'Cookie'
+    last_modified = updated_at.replace(tzinfo=timezone.utc) if updated_at else None
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return etag, last_modified, headers
+
+
+def not_modified(etag, last_modified, if_none_match, if_modified_since):
+    # If-None-Match wins over If-Modified-Since when both are sent (RFC 9110)
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    if if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def conditional(collection, cache_control, per_user=False):
+    """Serve a Resource GET with ETag/Last-Modified validators.
+
+    The validators come from the collection's version row, so a matching
+    If-None-Match or If-Modified-Since is answered with 304 before the
+    wrapped handler runs any query. ``per_user`` scopes the ETag to the
+    session's user for endpoints whose body depends on who is asking.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            version, updated_at = current_version(collection)
+            scope = session.get('user_id') if per_user else None
+            etag, last_modified, headers = validators(
+                collection, version, updated_at, scope, request.full_path, cache_control, per_user
+            )
+
+            if not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+                resp = make_response('', 304)
+                resp.headers.extend(headers)
+                return resp
+
+            rv = f(*args, **kwargs)
+            if isinstance(rv, tuple):
+                data, status = rv[0], rv[1]
+                if not 200 <= status < 300:
+                    return rv
+                return data, status, {**(rv[2] if len(rv) > 2 else {}), **headers}
+            if not hasattr(rv, 'status_code'):
+                return rv, 200, headers
+            if 200 <= rv.status_code < 300:
+                rv.headers.update(headers)
+            return rv
+        return wrapper
+    return decorator
@@ -7,7 +7,11 @@ load_dotenv()  # Load .env file
 class Config:
     # Security & Sessions
     SECRET_KEY = os.getenv('SECRET_KEY', 'fallback-secret-key-for-dev')
-    SESSION_TYPE = 'filesystem'
+    # 'cookie' (stateless signed cookie), 'kv' (shared store with TTL) or the
+    # legacy 'filesystem' store
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL')
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND') or ('kv' if SESSION_REDIS_URL else 'cookie')
+    SESSION_TTL = int(os.getenv('SESSION_TTL', 7 * 24 * 3600))
     SESSION_PERMANENT = False
     SESSION_USE_SIGNER = True
     SESSION_KEY_PREFIX = 'buygenius_'
@@ -20,6 +24,88 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL or 'sqlite:///local.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Postgres connection pool per worker process. The default 5 + 5 overflow
+    # covers gunicorn's 8 threads; keep workers x (size + overflow) under the
+    # server's connection limit. DB_PGBOUNCER=true disables the app-side pool
+    # for PgBouncer in transaction mode
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+    # Optional read replica for catalog, search and dashboard reads
+    REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+    if REPLICA_DATABASE_URL and REPLICA_DATABASE_URL.startswith("postgres://"):
+        REPLICA_DATABASE_URL = REPLICA_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+    # ASGI read path (app.asgi): async handlers for the hot GET endpoints.
+    # The async engine derives its URL from SQLALCHEMY_DATABASE_URI unless
+    # ASYNC_DATABASE_URI overrides it
+    ASYNC_READS_ENABLED = os.getenv('ASYNC_READS_ENABLED', 'true').lower() == 'true'
+    ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URI')
+    ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', 10))
+
+    # Password hashing: bcrypt cost factor and the size of the hashing pool
+    # (0 hashes inline on the request thread)
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+
+    # Bulk product import: rows per INSERT/commit and the cap per upload.
+    # CSV uploads are copied to a temp file first, so they are also capped in
+    # bytes (0 disables the cap)
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+    IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', 50000))
+    IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', 50 * 1024 * 1024))
+    # Rows fetched per server-side cursor round trip by /products/export
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+    # Search history write-behind: flush when this many are queued or every
+    # HISTORY_FLUSH_INTERVAL seconds; a user's repeated term is recorded once
+    # per HISTORY_DEDUPE_WINDOW seconds
+    HISTORY_BUFFER_SIZE = int(os.getenv('HISTORY_BUFFER_SIZE', 200))
+    HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 2.0))
+    HISTORY_DEDUPE_WINDOW = int(os.getenv('HISTORY_DEDUPE_WINDOW', 60))
+
+    # Autocomplete: seconds between full rebuilds of each process's index
+    SUGGEST_REFRESH_INTERVAL = int(os.getenv('SUGGEST_REFRESH_INTERVAL', 300))
+
+    # Recommendations: neighbors stored per product, and how often each
+    # process recomputes the products touched by new wishlist, message and
+    # feedback rows (seconds)
+    RECOMMEND_NEIGHBORS = int(os.getenv('RECOMMEND_NEIGHBORS', 20))
+    RECOMMEND_REFRESH_INTERVAL = int(os.getenv('RECOMMEND_REFRESH_INTERVAL', 60))
+
+    # Catalog snapshot for /products?sort=cost_benefit|marginal_benefit:
+    # memory-mapped NumPy columns shared by the workers on a host. The
+    # directory defaults to one per database under the system temp dir.
+    # Product commits rebuild it at most once per interval (seconds)
+    CATALOG_SNAPSHOT_ENABLED = os.getenv('CATALOG_SNAPSHOT_ENABLED', 'true').lower() == 'true'
+    CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR')
+    CATALOG_SNAPSHOT_MIN_INTERVAL = float(os.getenv('CATALOG_SNAPSHOT_MIN_INTERVAL', 30))
+
+    # Server-Sent Events: how often each process polls push_events, the
+    # keep-alive interval and how long events stay replayable (seconds)
+    PUSH_POLL_INTERVAL = float(os.getenv('PUSH_POLL_INTERVAL', 1.0))
+    PUSH_HEARTBEAT = int(os.getenv('PUSH_HEARTBEAT', 15))
+    PUSH_RETENTION = int(os.getenv('PUSH_RETENTION', 24 * 3600))
+    # Under gunicorn each /events stream holds a request thread; cap them per
+    # process (0 disables the cap). app.asgi streams are not counted
+    PUSH_MAX_THREAD_STREAMS = int(os.getenv('PUSH_MAX_THREAD_STREAMS', 4))
+
+    # Instrumentation: a request repeating one SQL statement this many times
+    # is logged as a likely N+1; METRICS_TOKEN lets a scraper read /metrics
+    METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', 5))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # Response cache: 'simple' (per worker), 'filesystem' (shared on one
+    # host), 'redis' (shared across hosts) or 'null' to disable
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+    CACHE_TYPE = os.getenv('CACHE_TYPE') or ('redis' if CACHE_REDIS_URL else 'filesystem')
+    CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 60))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+
     # CORS Configuration
     CORS_ORIGINS = [
         "https://buy-genius.netlify.app",
@@ -0,0 +1,135 @@
+import os
+import weakref
+from functools import wraps
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+# Engine setup for the primary database and the optional read replica.
+#
+# Postgres engines get an explicit pool sized for the gthread workers, with
+# pre-ping and recycling so connections dropped by the managed database or
+# an idle timeout are replaced instead of failing a request. Behind PgBouncer
+# in transaction mode the app keeps no pool of its own (PgBouncer is the
+# pool). SQLite keeps SQLAlchemy's defaults.
+#
+# With `gunicorn --preload` the engines are created in the master, so each
+# worker drops the inherited pool right after fork and opens its own.
+#
+# Handlers decorated with @read_only send their queries to the 'replica'
+# bind when REPLICA_DATABASE_URL is set. Anything that writes, and every
+# query after it in the same request, goes to the primary. A response read
+# from a replica that is behind the primary's collection versions is served
+# but not cached (see app/cache.py).
+
+REPLICA_BIND = 'replica'
+
+_engines = weakref.WeakSet()
+
+
+def _dispose_inherited_pools():
+    # close=False: the parent still owns those sockets; just forget them
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_inherited_pools)
+
+
+def engine_options(url, config):
+    """Pool settings for an engine on ``url``."""
+    if make_url(url).get_backend_name() != 'postgresql':
+        return {}
+    if config['DB_PGBOUNCER']:
+        # A client-side pool would pin PgBouncer's server connections
+        return {'poolclass': NullPool}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def upsert(connection, model):
+    """An INSERT on ``model`` that supports ``on_conflict_do_update`` on the connection's dialect."""
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+def _is_write(clause):
+    return clause is not None and (
+        getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+    )
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that reads from the replica inside @read_only handlers."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only'):
+            if self._flushing or _is_write(clause):
+                # Read-your-writes: stay on the primary for the rest of the request
+                self.info['read_only'] = False
+            else:
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(f):
+    """Route a Resource handler's queries to the replica bind, when one is configured."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        info = current_app.extensions['sqlalchemy'].session.info
+        previous = info.get('read_only', False)
+        info['read_only'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            info['read_only'] = previous
+    return wrapper
+
+
+def replica_bind():
+    """The replica engine when the current request's reads go to it, else None."""
+    sqlalchemy = current_app.extensions['sqlalchemy']
+    if not sqlalchemy.session.info.get('read_only'):
+        return None
+    return sqlalchemy.engines.get(REPLICA_BIND)
+
+
+def init_app(app):
+    from .models import db
+
+    config = app.config
+    config.setdefault('DB_POOL_SIZE', 5)
+    config.setdefault('DB_MAX_OVERFLOW', 5)
+    config.setdefault('DB_POOL_TIMEOUT', 10)
+    config.setdefault('DB_POOL_RECYCLE', 1800)
+    config.setdefault('DB_POOL_PRE_PING', True)
+    config.setdefault('DB_PGBOUNCER', False)
+    config.setdefault('REPLICA_DATABASE_URL', None)
+
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS win over the computed ones
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(config['SQLALCHEMY_DATABASE_URI'], config),
+        **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+    replica_url = config['REPLICA_DATABASE_URL']
+    if replica_url:
+        config['SQLALCHEMY_BINDS'] = {
+            **config.get('SQLALCHEMY_BINDS', {}),
+            REPLICA_BIND: {'url': replica_url, **engine_options(replica_url, config)},
+        }
+
+    db.init_app(app)
+
+    with app.app_context():
+        _engines.update(db.engines.values())
@@ -0,0 +1,347 @@
+import csv
+import io
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+from faker import Faker
+from sqlalchemy import func, insert, select, text
+
+from .cache import cache
+from .conditional import bump
+from .hashing import hasher
+from .models import (
+    db, Category, Conversation, Feedback, Message, Product, Retailer, User, UserHistory, Wishlist
+)
+from . import analytics, recommend, search
+
+# Synthetic data at production scale. Rows are generated as plain tuples and
+# written in chunks, each in its own transaction. Postgres loads them with
+# COPY; other databases use multi-row INSERTs. Every account shares one
+# pre-hashed password. Ids are assigned up front, so foreign keys need no
+# RETURNING round trips, and the same seed always yields the same data.
+#
+# Activity is skewed the way real traffic is. A few retailers list most of
+# the catalog, popular items are listed by many retailers, and a minority of
+# users send most messages and searches. Derived state (search index,
+# counters, collection versions, response cache) is rebuilt once at the end.
+
+CATALOG = {
+    'Electronics': (['Samsung', 'Sony', 'LG', 'Hisense', 'TCL', 'JBL'], ['Television', 'Soundbar', 'Speaker', 'Headphones', 'Monitor'], (3000, 250000)),
+    'Phones': (['Samsung', 'Apple', 'Tecno', 'Infinix', 'Oppo', 'Xiaomi', 'Nokia'], ['Galaxy', 'iPhone', 'Spark', 'Hot', 'Reno', 'Redmi'], (8000, 200000)),
+    'Computers': (['HP', 'Dell', 'Lenovo', 'Apple', 'Asus', 'Acer'], ['Laptop', 'EliteBook', 'ThinkPad', 'MacBook', 'Chromebook'], (25000, 350000)),
+    'Fashion': (["Levi's", 'Nike', 'Adidas', 'Puma', 'Zara'], ['Jeans', 'Sneakers', 'Hoodie', 'T-Shirt', 'Jacket'], (800, 20000)),
+    'Home & Kitchen': (['Ramtons', 'Philips', 'Von', 'Mika', 'Bosch'], ['Blender', 'Fridge', 'Microwave', 'Kettle', 'Cooker'], (1500, 150000)),
+}
+GENERIC = (['Acme', 'Prime', 'Nova', 'Zenith'], ['Starter Kit', 'Bundle', 'Pack', 'Set'], (500, 50000))
+PAYMENT_MODES = ['Cash/Card/M-Pesa', 'M-Pesa', 'Card', 'Cash on delivery']
+
+DEFAULT_COUNTS = dict(users=1000, retailers=20, products=10000, messages=10000, wishlists=5000, history=20000, feedback=2000)
+
+
+def _zipf(n, exponent=1.0):
+    """Cumulative weights for rng.choices: item i has weight 1 / (i + 1) ** exponent."""
+    total, weights = 0.0, []
+    for i in range(n):
+        total += 1.0 / (i + 1) ** exponent
+        weights.append(total)
+    return weights
+
+
+def sync_sequences(connection):
+    """Move Postgres id sequences past rows inserted with explicit ids."""
+    if connection.dialect.name != 'postgresql':
+        return
+    for model in (Category, User, Retailer, Product, Conversation):
+        table = model.__tablename__
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 1)) FROM {table}"
+        ))
+
+
+class DataGenerator:
+    def __init__(self, engine, seed=42, chunk_size=10000, password='password', days=365, log=print):
+        self.engine = engine
+        self.rng = random.Random(seed)
+        self.fake = Faker()
+        self.fake.seed_instance(seed)
+        self.chunk_size = chunk_size
+        self.password = password
+        self.days = days
+        self.log = log
+        # Midnight, so reruns on the same day produce identical rows
+        self.now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Writing
+
+    def _write(self, conn, table, columns, rows):
+        if not rows:
+            return
+        if conn.dialect.name == 'postgresql':
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            buf.seek(0)
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+        else:
+            conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+    def _load(self, model, columns, rows):
+        """Write ``rows`` in chunks, one transaction each; returns the row count."""
+        table = model.__table__
+        started, written, chunk = time.perf_counter(), 0, []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                with self.engine.begin() as conn:
+                    self._write(conn, table, columns, chunk)
+                written += len(chunk)
+                chunk = []
+        with self.engine.begin() as conn:
+            self._write(conn, table, columns, chunk)
+        written += len(chunk)
+        self._report(table.name, written, started)
+        return written
+
+    def _report(self, name, count, started):
+        elapsed = time.perf_counter() - started
+        self.log(f'{name:<14} {count:>10} rows  {elapsed:7.1f}s  {count / elapsed if elapsed else 0:>10.0f} rows/s')
+
+    def _next_id(self, model):
+        with self.engine.connect() as conn:
+            return (conn.scalar(select(func.max(model.id))) or 0) + 1
+
+    def _timestamp(self, max_days=None):
+        return self.now - timedelta(seconds=self.rng.random() * (max_days or self.days) * 86400)
+
+    # Tables
+
+    def _categories(self):
+        with self.engine.begin() as conn:
+            existing = dict(conn.execute(select(Category.name, Category.id)).all())
+            missing = [name for name in CATALOG if name not in existing]
+            if missing:
+                conn.execute(insert(Category), [{'name': name} for name in missing])
+                existing = dict(conn.execute(select(Category.name, Category.id)).all())
+        return existing
+
+    def _users(self, count, password_hash):
+        first = [self.fake.first_name() for _ in range(500)]
+        last = [self.fake.last_name() for _ in range(500)]
+        start = self._next_id(User)
+        rng = self.rng
+
+        def rows():
+            for user_id in range(start, start + count):
+                name = f'{rng.choice(first)}.{rng.choice(last)}'.lower()
+                yield (user_id, f'{name}{user_id}', f'{name}{user_id}@example.com', password_hash,
+                       False, False, self._timestamp())
+
+        self._load(User, ['id', 'username', 'email', 'password_hash', 'is_retailer', 'is_admin', 'created_at'], rows())
+        return list(range(start, start + count))
+
+    def _retailers(self, count, password_hash):
+        owners_start = self._next_id(User)
+        start = self._next_id(Retailer)
+        companies = [self.fake.company() for _ in range(count)]
+        rng = self.rng
+        self._load(User, ['id', 'username', 'email', 'password_hash', 'is_retailer', 'is_admin', 'created_at'], (
+            (owners_start + i, f'shop{owners_start + i}', f'shop{owners_start + i}@example.com', password_hash,
+             True, False, self._timestamp())
+            for i in range(count)
+        ))
+        self._load(Retailer, ['id', 'name', 'user_id', 'whatsapp_number', 'approved'], (
+            (start + i, companies[i], owners_start + i, f'+2547{rng.randint(0, 99999999):08d}', rng.random() < 0.9)
+            for i in range(count)
+        ))
+        return list(range(start, start + count)), list(range(owners_start, owners_start + count))
+
+    def _items(self, count, categories):
+        """The distinct things retailers sell; several listings share one item."""
+        rng = self.rng
+        items = []
+        names = list(categories)
+        for _ in range(count):
+            category = rng.choice(names)
+            brands, nouns, (low, high) = CATALOG.get(category, GENERIC)
+            name = f'{rng.choice(brands)} {rng.choice(nouns)} {rng.choice("ABCDEFGHJKMNPSTXZ")}{rng.randint(1, 99)}'
+            # Log-uniform base price within the category's range
+            price = round(math.exp(rng.uniform(math.log(low), math.log(high))), -1)
+            items.append((name, categories[category], price))
+        return items
+
+    def _products(self, count, retailer_ids, categories):
+        rng = self.rng
+        items = self._items(max(1, count // 3), categories)
+        item_weights = _zipf(len(items), 0.8)
+        retailer_weights = _zipf(len(retailer_ids), 1.1)
+        start = self._next_id(Product)
+        blurbs = [self.fake.sentence(nb_words=10) for _ in range(200)]
+
+        def rows():
+            for product_id in range(start, start + count):
+                name, category_id, base = items[rng.choices(range(len(items)), cum_weights=item_weights)[0]]
+                retailer_id = retailer_ids[rng.choices(range(len(retailer_ids)), cum_weights=retailer_weights)[0]]
+                price = round(base * rng.uniform(0.85, 1.15), -1)
+                delivery = rng.choice([0, 0, 200, 300, 500, 1000])
+                estimated_value = round(price * rng.uniform(0.9, 1.3), 2)
+                marginal_benefit = round(rng.uniform(0.02, 0.2), 3)
+                created_at = self._timestamp()
+                yield (
+                    product_id, name, price, f'{name}. {rng.choice(blurbs)}', delivery, rng.choice(PAYMENT_MODES),
+                    retailer_id, category_id, created_at, created_at,
+                    f'https://example.com/images/{product_id}.jpg', estimated_value, marginal_benefit,
+                    Product.compute_value_score(price, delivery, estimated_value, marginal_benefit),
+                    Product.compute_canonical_key(name),
+                )
+
+        self._load(Product, [
+            'id', 'name', 'price', 'description', 'delivery_cost', 'payment_mode', 'retailer_id', 'category_id',
+            'created_at', 'updated_at', 'image_url', 'estimated_value', 'marginal_benefit', 'value_score',
+            'canonical_key',
+        ], rows())
+        return start, count
+
+    def _messages(self, count, user_ids, retailer_ids, owner_ids):
+        """Conversations of a few messages each, mostly started by the most active users."""
+        rng = self.rng
+        user_weights = _zipf(len(user_ids), 0.7)
+        retailer_weights = _zipf(len(retailer_ids), 1.1)
+        lines = [self.fake.sentence(nb_words=8) for _ in range(500)]
+        conversation_id = self._next_id(Conversation)
+        seen = set()
+        started = time.perf_counter()
+        conversations, messages, written, threads = [], [], 0, 0
+        conversation_columns = ['id', 'user_id', 'retailer_id', 'product_id', 'created_at', 'last_message_at']
+        message_columns = ['sender_id', 'receiver_id', 'retailer_id', 'conversation_id', 'content', 'sent_at', 'read_at']
+
+        def flush():
+            with self.engine.begin() as conn:
+                self._write(conn, Conversation.__table__, conversation_columns, conversations)
+                self._write(conn, Message.__table__, message_columns, messages)
+
+        attempts = 0
+        while written + len(messages) < count and attempts < count * 4:
+            attempts += 1
+            index = rng.choices(range(len(retailer_ids)), cum_weights=retailer_weights)[0]
+            user_id = user_ids[rng.choices(range(len(user_ids)), cum_weights=user_weights)[0]]
+            if (user_id, index) in seen:
+                continue
+            seen.add((user_id, index))
+            retailer_id, owner_id = retailer_ids[index], owner_ids[index]
+
+            length = min(count - written - len(messages), 1 + int(rng.expovariate(1 / 5)))
+            sent_at = self._timestamp()
+            for n in range(length):
+                sender, receiver = (user_id, owner_id) if n % 2 == 0 else (owner_id, user_id)
+                read_at = None if n == length - 1 and rng.random() < 0.5 else sent_at
+                messages.append((sender, receiver, retailer_id, conversation_id, rng.choice(lines), sent_at, read_at))
+                sent_at += timedelta(minutes=rng.expovariate(1 / 90))
+            conversations.append((conversation_id, user_id, retailer_id, None, messages[-length][5], messages[-1][5]))
+            conversation_id += 1
+            threads += 1
+
+            if len(messages) >= self.chunk_size:
+                flush()
+                written += len(messages)
+                conversations, messages = [], []
+        flush()
+        written += len(messages)
+        self._report('conversations', threads, started)
+        self._report('messages', written, started)
+
+    def _wishlists(self, count, user_ids, first_product, products):
+        rng = self.rng
+        product_weights = _zipf(products, 0.8)
+        mean = max(1.0, count / len(user_ids))
+
+        def rows():
+            # One pass over the users keeps (user, product) pairs unique, so
+            # the total lands near ``count`` rather than exactly on it
+            emitted = 0
+            for user_id in user_ids:
+                wanted = min(count - emitted, int(rng.expovariate(1 / mean)))
+                picks = set(rng.choices(range(products), cum_weights=product_weights, k=wanted))
+                for offset in sorted(picks):
+                    yield (user_id, first_product + offset, self._timestamp())
+                emitted += len(picks)
+                if emitted >= count:
+                    return
+
+        self._load(Wishlist, ['user_id', 'product_id', 'added_at'], rows())
+
+    def _history(self, count, user_ids):
+        rng = self.rng
+        vocabulary = sorted({word.lower() for brands, nouns, _ in CATALOG.values() for word in brands + nouns})
+        vocabulary += [self.fake.word() for _ in range(200)]
+        term_weights = _zipf(len(vocabulary), 1.0)
+        user_weights = _zipf(len(user_ids), 0.7)
+
+        def rows():
+            for _ in range(count):
+                terms = rng.choices(vocabulary, cum_weights=term_weights, k=rng.choice([1, 1, 1, 2]))
+                user_id = user_ids[rng.choices(range(len(user_ids)), cum_weights=user_weights)[0]]
+                yield (user_id, ' '.join(terms), self._timestamp(90))
+
+        self._load(UserHistory, ['user_id', 'search_term', 'searched_at'], rows())
+
+    def _feedback(self, count, user_ids, first_product, products):
+        rng = self.rng
+        comments = [self.fake.sentence(nb_words=12) for _ in range(500)]
+        product_weights = _zipf(products, 0.8)
+        user_weights = _zipf(len(user_ids), 0.7)
+        self._load(Feedback, ['user_id', 'product_id', 'comment', 'feedback_date'], (
+            (user_ids[rng.choices(range(len(user_ids)), cum_weights=user_weights)[0]],
+             first_product + rng.choices(range(products), cum_weights=product_weights)[0],
+             rng.choice(comments), self._timestamp())
+            for _ in range(count)
+        ))
+
+    # Derived state
+
+    def _finish(self):
+        started = time.perf_counter()
+        with self.engine.begin() as conn:
+            sync_sequences(conn)
+            search.rebuild_index(conn)
+            analytics.recount(conn)
+            recommend.rebuild(conn)
+            bump(conn, 'products', 'retailers', 'categories', 'messages')
+        cache.invalidate('products', 'categories', 'retailers', 'recommendations')
+        self.log(f'{"derived state":<14} {"":>10}       {time.perf_counter() - started:7.1f}s')
+
+    def run(self, users, retailers, products, messages, wishlists, history, feedback):
+        users, retailers, products = max(1, users), max(1, retailers), max(1, products)
+        password_hash = hasher.hash(self.password)
+        categories = self._categories()
+        user_ids = self._users(users, password_hash)
+        retailer_ids, owner_ids = self._retailers(retailers, password_hash)
+        first_product, products = self._products(products, retailer_ids, categories)
+        self._messages(messages, user_ids, retailer_ids, owner_ids)
+        self._wishlists(wishlists, user_ids, first_product, products)
+        self._history(history, user_ids)
+        self._feedback(feedback, user_ids, first_product, products)
+        self._finish()
+
+
+def init_app(app):
+    @app.cli.command('generate-data')
+    @click.option('--seed', default=42, show_default=True, help='Random seed; the same seed gives the same data.')
+    @click.option('--chunk-size', default=10000, show_default=True, help='Rows per transaction.')
+    @click.option('--password', default='password', show_default=True, help='Password shared by every generated account.')
+    @click.option('--days', default=365, show_default=True, help='Spread timestamps over this many days.')
+    @click.option('--users', default=DEFAULT_COUNTS['users'], show_default=True)
+    @click.option('--retailers', default=DEFAULT_COUNTS['retailers'], show_default=True)
+    @click.option('--products', default=DEFAULT_COUNTS['products'], show_default=True)
+    @click.option('--messages', default=DEFAULT_COUNTS['messages'], show_default=True)
+    @click.option('--wishlists', default=DEFAULT_COUNTS['wishlists'], show_default=True)
+    @click.option('--history', default=DEFAULT_COUNTS['history'], show_default=True)
+    @click.option('--feedback', default=DEFAULT_COUNTS['feedback'], show_default=True)
+    def generate_data(seed, chunk_size, password, days, **counts):
+        """Append synthetic users, retailers, products and activity to the database."""
+        generator = DataGenerator(db.engine, seed=seed, chunk_size=chunk_size, password=password, days=days,
+                                  log=click.echo)
+        generator.run(**counts)
+        click.echo('Synthetic data generated.')
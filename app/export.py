@@ -0,0 +1,70 @@
+import csv
+import io
+from datetime import datetime
+
+import msgspec
+
+from .models import db, Product
+from .serializers import ProductOut, product_rows
+
+# Full catalog export. The SELECT runs with yield_per, which on Postgres opens
+# a server-side cursor, and every partition of rows is encoded and handed to
+# the WSGI server before the next one is fetched. Memory use depends on the
+# batch size, not on the size of the catalog, and the client starts
+# receiving rows as soon as the first batch is read.
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+COLUMNS = ProductOut.__struct_fields__
+
+_encoder = msgspec.json.Encoder()
+
+
+def export_query(retailer_id=None, category_id=None, updated_since=None):
+    query = product_rows()
+    if retailer_id is not None:
+        query = query.where(Product.retailer_id == retailer_id)
+    if category_id is not None:
+        query = query.where(Product.category_id == category_id)
+    if updated_since is not None:
+        query = query.where(Product.updated_at >= updated_since)
+    return query.order_by(Product.id)
+
+
+def _ndjson(partition):
+    return _encoder.encode_lines([ProductOut.from_row(row) for row in partition])
+
+
+def _csv_cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv(partition):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerows([[_csv_cell(value) for value in row] for row in partition])
+    return out.getvalue().encode('utf-8')
+
+
+def _csv_header():
+    out = io.StringIO()
+    csv.writer(out).writerow(COLUMNS)
+    return out.getvalue().encode('utf-8')
+
+
+def stream_products(query, fmt, batch_size=1000):
+    """Yield the encoded export in chunks of ``batch_size`` rows."""
+    encode = _csv if fmt == 'csv' else _ndjson
+    if fmt == 'csv':
+        yield _csv_header()
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield encode(partition)
+    finally:
+        result.close()
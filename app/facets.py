@@ -0,0 +1,183 @@
+import math
+
+from sqlalchemy import String, and_, case, cast, func, literal, null, select, true, union_all
+
+from .compare import total_cost
+from .models import Category, Product, Retailer
+
+# Catalog filters and facet counts for GET /products.
+#
+# Each facet is counted with every filter applied except its own, so the
+# client can show how many results each alternative would give (picking a
+# second category widens the result instead of emptying it). All facets come
+# back from one UNION ALL, a single round trip. Category, retailer and
+# payment mode are GROUP BYs (the first two over their indexes). Free delivery
+# and the price buckets have fixed values, so they are conditional counts
+# from one shared scan instead of GROUP BYs over computed expressions, which
+# SQLite can only answer by sorting every row.
+
+# Lower bounds of the price facet's buckets; the last one is open-ended
+PRICE_BUCKETS = (0, 1000, 5000, 20000, 100000)
+MULTI_VALUED = ('category_id', 'retailer_id', 'payment_mode')
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _values(args, name):
+    # Repeated parameters and comma-separated lists both work
+    return [value for raw in args.getlist(name) for value in raw.split(',') if value]
+
+
+def _number(args, name, kind=float):
+    raw = args.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        value = kind(raw)
+    except ValueError:
+        raise InvalidFilter(name)
+    # float() also parses 'nan' and 'inf', which no price compares sensibly with
+    if not math.isfinite(value) or value < 0:
+        raise InvalidFilter(name)
+    return value
+
+
+def parse_filters(args):
+    """The catalog filters in ``args`` (Flask or Starlette query parameters)."""
+    filters = {}
+    for name in ('category_id', 'retailer_id'):
+        values = _values(args, name)
+        if values:
+            try:
+                filters[name] = [int(value) for value in values]
+            except ValueError:
+                raise InvalidFilter(name)
+    payment_modes = _values(args, 'payment_mode')
+    if payment_modes:
+        filters['payment_mode'] = payment_modes
+    for name in ('min_price', 'max_price', 'max_total'):
+        value = _number(args, name)
+        if value is not None:
+            filters[name] = value
+    free_delivery = args.get('free_delivery')
+    if free_delivery not in (None, ''):
+        if free_delivery not in ('true', 'false'):
+            raise InvalidFilter('free_delivery')
+        filters['free_delivery'] = free_delivery == 'true'
+    return filters
+
+
+def _free_delivery():
+    return func.coalesce(Product.delivery_cost, 0) == 0
+
+
+def _price_clauses(filters):
+    clauses = []
+    if 'min_price' in filters:
+        clauses.append(Product.price >= filters['min_price'])
+    if 'max_price' in filters:
+        clauses.append(Product.price <= filters['max_price'])
+    return clauses
+
+
+def _free_delivery_clauses(filters):
+    if 'free_delivery' not in filters:
+        return []
+    return [_free_delivery() if filters['free_delivery'] else ~_free_delivery()]
+
+
+def conditions(filters, exclude=()):
+    """WHERE clauses for ``filters``, leaving out those of the facets named in ``exclude``."""
+    clauses = []
+    for name in MULTI_VALUED:
+        if name in filters and name not in exclude:
+            clauses.append(getattr(Product, name).in_(filters[name]))
+    if 'price' not in exclude:
+        clauses.extend(_price_clauses(filters))
+    if 'max_total' in filters:
+        clauses.append(total_cost() <= filters['max_total'])
+    if 'free_delivery' not in exclude:
+        clauses.extend(_free_delivery_clauses(filters))
+    return clauses
+
+
+def _grouped(name, column, filters, labels=None):
+    # Group on the bare column (index-only where possible), then label the few groups
+    counts = select(column.label('value'), func.count().label('count')).where(
+        *conditions(filters, exclude=(name,))
+    ).group_by(column).subquery()
+    label = labels.name if labels is not None else cast(null(), String)
+    query = select(
+        literal(name).label('facet'),
+        cast(counts.c.value, String).label('value'),
+        label.label('label'),
+        counts.c.count,
+    ).select_from(counts)
+    if labels is not None:
+        query = query.outerjoin(labels, labels.id == counts.c.value)
+    return query
+
+
+def _fixed(filters):
+    """(facet, value, count column) for the fixed-value facets, counted in one scan."""
+    def count_where(*clauses):
+        return func.count(case((and_(true(), *clauses), 1)))
+
+    free_clauses, price_clauses = _free_delivery_clauses(filters), _price_clauses(filters)
+    counts = [
+        ('free_delivery', 'true', count_where(_free_delivery(), *price_clauses)),
+        ('free_delivery', 'false', count_where(~_free_delivery(), *price_clauses)),
+    ]
+    for index, lower in enumerate(PRICE_BUCKETS):
+        bucket = [Product.price >= lower]
+        if index + 1 < len(PRICE_BUCKETS):
+            bucket.append(Product.price < PRICE_BUCKETS[index + 1])
+        counts.append(('price', str(index), count_where(*bucket, *free_clauses)))
+
+    scan = select(*[count.label(f'c{i}') for i, (_, _, count) in enumerate(counts)]).where(
+        *conditions(filters, exclude=('free_delivery', 'price'))
+    ).cte('fixed_facets')
+    no_label = cast(null(), String)
+    return [
+        select(literal(facet).label('facet'), literal(value).label('value'), no_label.label('label'),
+               scan.c[f'c{i}'].label('count'))
+        for i, (facet, value, _) in enumerate(counts)
+    ]
+
+
+def facet_counts_query(filters):
+    """One statement returning (facet, value, label, count) rows for every facet."""
+    return union_all(
+        _grouped('category_id', Product.category_id, filters, Category),
+        _grouped('retailer_id', Product.retailer_id, filters, Retailer),
+        _grouped('payment_mode', Product.payment_mode, filters),
+        *_fixed(filters),
+    )
+
+
+def facets_from_rows(rows):
+    """Group facet_counts_query() rows into {facet: [{value, label, count}, ...]}, most common first."""
+    facets = {'category_id': [], 'retailer_id': [], 'payment_mode': [], 'free_delivery': [], 'price': []}
+    for facet, value, label, count in rows:
+        if not count:
+            continue
+        if facet in ('category_id', 'retailer_id'):
+            entry = {'value': int(value), 'label': label, 'count': count}
+        elif facet == 'free_delivery':
+            entry = {'value': value == 'true', 'count': count}
+        elif facet == 'price':
+            index = int(value)
+            upper = PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None
+            entry = {'min': PRICE_BUCKETS[index], 'max': upper, 'count': count}
+        else:
+            entry = {'value': value, 'count': count}
+        facets[facet].append(entry)
+
+    for facet, entries in facets.items():
+        if facet == 'price':
+            entries.sort(key=lambda entry: entry['min'])
+        else:
+            entries.sort(key=lambda entry: (-entry['count'], str(entry['value'])))
+    return facets
@@ -0,0 +1,72 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small bounded thread pool.
+
+    bcrypt releases the GIL, so with threaded workers (see gunicorn.conf.py)
+    hashing happens off the request threads while they keep serving cheap
+    reads. The pool size caps how many CPU cores logins may take at once;
+    callers beyond ``max_pending`` wait for a free slot. ``workers=0`` hashes
+    inline on the calling thread, which was the previous behaviour.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_pending=32):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # Pool threads do not survive fork(); gunicorn --preload children
+            # start their own pool on first use.
+            os.register_at_fork(after_in_child=self._reset)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 32)
+        self._reset()
+        self.rounds = app.config['BCRYPT_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        with self._slots:
+            return self._executor.submit(fn, *args).result()
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, password_hash):
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError:
+            # Not a bcrypt hash
+            return False
+
+    def needs_rehash(self, password_hash):
+        # $2b$<cost>$<salt+hash>
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError, SQLAlchemyError, TimeoutError as PoolTimeout
+
+from .models import db, UserHistory
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying the same rows for (lost connection, locked database,
+# pool exhausted). Anything else means the database rejects the rows.
+TRANSIENT_ERRORS = (OperationalError, PoolTimeout)
+
+
+def normalize_term(term):
+    return ' '.join(term.split()).lower()
+
+
+class SearchHistoryBuffer:
+    """Write-behind buffer for user_history.
+
+    Searches are queued in memory and written by a background thread in one
+    multi-row INSERT, either when ``size`` entries are pending or every
+    ``interval`` seconds. The same user repeating the same term within
+    ``window`` seconds is recorded once. Whatever is still pending is flushed
+    at interpreter exit and from gunicorn's worker_exit hook.
+    """
+
+    def __init__(self, size=200, interval=2.0, window=60):
+        self.app = None
+        self.enabled = True
+        self.size = size
+        self.interval = interval
+        self.window = window
+        self.written = 0
+        self.dropped = 0
+        self._reset()
+        atexit.register(self.flush)
+        if hasattr(os, 'register_at_fork'):
+            # Entries queued in the parent belong to the parent; the flusher
+            # thread does not survive fork()
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._pending = []
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        app.config.setdefault('HISTORY_BUFFER_ENABLED', True)
+        app.config.setdefault('HISTORY_BUFFER_SIZE', 200)
+        app.config.setdefault('HISTORY_FLUSH_INTERVAL', 2.0)
+        app.config.setdefault('HISTORY_DEDUPE_WINDOW', 60)
+        self.app = app
+        self.enabled = app.config['HISTORY_BUFFER_ENABLED']
+        self.size = app.config['HISTORY_BUFFER_SIZE']
+        self.interval = app.config['HISTORY_FLUSH_INTERVAL']
+        self.window = app.config['HISTORY_DEDUPE_WINDOW']
+        app.extensions['search_history'] = self
+
+    def record(self, user_id, term):
+        """Queue a search and return the queued row, or None when it repeats one inside the window."""
+        term = term.strip()
+        key = (user_id, normalize_term(term))
+        now = time.monotonic()
+        with self._lock:
+            seen = self._recent.get(key)
+            if seen is not None and now - seen < self.window:
+                return None
+            self._recent[key] = now
+            entry = {'user_id': user_id, 'search_term': term, 'searched_at': datetime.utcnow()}
+            self._pending.append(entry)
+            full = len(self._pending) >= self.size
+
+        if not self.enabled:
+            self.flush()
+        elif full:
+            self._wake.set()
+        self._ensure_flusher()
+        return entry
+
+    def has_pending(self, user_id):
+        with self._lock:
+            return any(entry['user_id'] == user_id for entry in self._pending)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'pending': pending, 'written': self.written, 'dropped': self.dropped}
+
+    def _ensure_flusher(self):
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='history-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def _forget_old(self, now):
+        cutoff = now - self.window
+        self._recent = {key: seen for key, seen in self._recent.items() if seen >= cutoff}
+
+    def _insert(self, rows):
+        with self.app.app_context():
+            # Own connection and transaction, independent of any request session
+            with db.engine.begin() as connection:
+                connection.execute(insert(UserHistory), rows)
+
+    def _requeue(self, rows):
+        with self._lock:
+            # Keep the rows for the next attempt, within reason
+            room = max(0, 10 * self.size - len(self._pending))
+            self._pending[:0] = rows[:room]
+            self.dropped += len(rows) - min(len(rows), room)
+
+    def flush(self):
+        """Write everything pending; safe to call from any thread.
+
+        A batch the database rejects (say a row whose user was deleted since)
+        is split in halves until the offending rows are isolated and dropped,
+        so one bad row can't block every later flush. Transient errors put
+        the unwritten rows back in the queue.
+        """
+        if self.app is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                self._forget_old(time.monotonic())
+            written = 0
+            batches = [rows] if rows else []
+            while batches:
+                batch = batches.pop(0)
+                try:
+                    self._insert(batch)
+                except TRANSIENT_ERRORS:
+                    logger.exception('search history flush failed')
+                    self._requeue([row for unwritten in [batch, *batches] for row in unwritten])
+                    break
+                except SQLAlchemyError:
+                    if len(batch) > 1:
+                        half = len(batch) // 2
+                        batches[:0] = [batch[:half], batch[half:]]
+                        continue
+                    logger.warning('dropping search history row the database rejects', exc_info=True)
+                    with self._lock:
+                        self.dropped += 1
+                    continue
+                written += len(batch)
+            self.written += written
+            return written
+
+
+history = SearchHistoryBuffer()
@@ -0,0 +1,280 @@
+import csv
+import json
+import logging
+import math
+import tempfile
+from collections import Counter
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+
+from .models import db, Category, Product
+from .cache import cache
+from .conditional import bump
+from . import analytics, search, suggest
+
+logger = logging.getLogger(__name__)
+
+# Bulk product import. Rows are parsed and validated one at a time straight
+# off the request stream, then written in chunks: one multi-row INSERT and
+# one commit per chunk, so a large upload never holds a long transaction and
+# never keeps more than a chunk of rows in memory. Core inserts skip the ORM
+# hooks, so each chunk refreshes the derived state (value score, canonical
+# key, search index, counters, collection version, suggestions) itself.
+
+FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+OPTIONAL_TEXT = ('description', 'payment_mode', 'image_url')
+OPTIONAL_NUMBERS = ('delivery_cost', 'estimated_value', 'marginal_benefit')
+# CSV uploads are checked before import; bigger ones spill to a temp file
+CSV_SPOOL_SIZE = 1024 * 1024
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportEncodingError(ValueError):
+    pass
+
+
+class ImportTooLargeError(ValueError):
+    pass
+
+
+def detect_format(mimetype, requested=None):
+    if requested:
+        if requested not in ('csv', 'ndjson'):
+            raise ImportFormatError(f'Unsupported format {requested!r}')
+        return requested
+    fmt = FORMATS.get(mimetype)
+    if fmt is None:
+        raise ImportFormatError('Send text/csv or application/x-ndjson')
+    return fmt
+
+
+def _lines(stream):
+    # A line that is not UTF-8 comes through as None. UTF-8 never uses the
+    # newline byte inside a character, so lines can be decoded one by one.
+    first = True
+    for line in stream:
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            line = None
+        else:
+            if first:
+                line = line.lstrip('\ufeff')
+        first = False
+        yield line
+
+
+def checked_csv(stream, max_bytes=None):
+    """Copy a CSV upload to a spooled temp file, raising ImportEncodingError if any line is not UTF-8.
+
+    A quoted CSV field can span lines, so a bad line can't be reported as
+    one row's error; the whole upload is refused before anything is written.
+    Uploads over ``max_bytes`` raise ImportTooLargeError as soon as the limit
+    is crossed, so at most that much is ever written to disk.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_SIZE)
+    size = 0
+    for number, line in enumerate(stream, start=1):
+        size += len(line)
+        if max_bytes is not None and size > max_bytes:
+            spool.close()
+            raise ImportTooLargeError(f'Uploads are limited to {max_bytes} bytes')
+        try:
+            line.decode('utf-8')
+        except UnicodeDecodeError:
+            spool.close()
+            raise ImportEncodingError(f'Line {number} is not valid UTF-8')
+        spool.write(line)
+    spool.seek(0)
+    return spool
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, record_or_None, error_or_None)`` from the stream.
+
+    CSV streams must have been through checked_csv() first.
+    """
+    lines = _lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for number, line in enumerate(lines, start=1):
+        if line is None:
+            yield number, None, 'Invalid UTF-8'
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, 'Invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Expected a JSON object'
+            continue
+        yield number, record, None
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _number(value):
+    if isinstance(value, bool):
+        raise ValueError
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError
+    return number
+
+
+def load_categories():
+    rows = db.session.execute(select(Category.id, Category.name)).all()
+    by_id = {row.id for row in rows}
+    by_name = {row.name.strip().lower(): row.id for row in rows}
+    return by_id, by_name
+
+
+def validate(record, retailer_id, categories):
+    """Turn one raw record into insert parameters, or return the field errors."""
+    by_id, by_name = categories
+    errors = {}
+    values = {'retailer_id': retailer_id}
+
+    name = record.get('name')
+    if _blank(name):
+        errors['name'] = 'Required'
+    else:
+        values['name'] = str(name).strip()
+
+    if _blank(record.get('price')):
+        errors['price'] = 'Required'
+    else:
+        try:
+            values['price'] = _number(record['price'])
+        except (TypeError, ValueError):
+            errors['price'] = 'Must be a non-negative number'
+
+    for field in OPTIONAL_NUMBERS:
+        if _blank(record.get(field)):
+            values[field] = None
+            continue
+        try:
+            values[field] = _number(record[field])
+        except (TypeError, ValueError):
+            errors[field] = 'Must be a non-negative number'
+
+    for field in OPTIONAL_TEXT:
+        values[field] = None if _blank(record.get(field)) else str(record[field])
+
+    category_id = record.get('category_id')
+    category = record.get('category')
+    if not _blank(category_id):
+        try:
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            category_id = None
+        if category_id not in by_id:
+            errors['category_id'] = 'Unknown category'
+        else:
+            values['category_id'] = category_id
+    elif not _blank(category):
+        category_id = by_name.get(str(category).strip().lower())
+        if category_id is None:
+            errors['category'] = 'Unknown category'
+        else:
+            values['category_id'] = category_id
+    else:
+        errors['category_id'] = 'Required'
+
+    if errors:
+        return None, errors
+    values['value_score'] = Product.compute_value_score(
+        values['price'], values['delivery_cost'], values['estimated_value'], values['marginal_benefit']
+    )
+    values['canonical_key'] = Product.compute_canonical_key(values['name'])
+    return values, None
+
+
+def _write_chunk(chunk):
+    ids = db.session.scalars(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True),
+        [values for _, values in chunk]
+    ).all()
+    connection = db.session.connection()
+    search.index_products(connection, ids)
+    deltas = Counter()
+    for _, values in chunk:
+        deltas.update(analytics.contributions(Product, values))
+    analytics.increment(connection, deltas)
+    bump(connection, 'products')
+    db.session.commit()
+    suggest.add_products(zip(ids, (values['name'] for _, values in chunk)))
+    return len(ids)
+
+
+def import_products(stream, fmt, retailer_id, chunk_size=500, max_rows=50000, max_errors=100, max_bytes=None):
+    """Import products from ``stream`` for ``retailer_id`` and return a report.
+
+    Rows are numbered by their line in the upload. Invalid rows are skipped
+    and reported; valid rows are inserted chunk by chunk, so a database error
+    only fails the rows of the chunk it happened in. A CSV upload that is not
+    UTF-8 raises ImportEncodingError, and one over ``max_bytes`` raises
+    ImportTooLargeError, before any row is written. NDJSON is read straight
+    off the stream and stops at ``max_rows``.
+    """
+    if fmt == 'csv':
+        stream = checked_csv(stream, max_bytes)
+    categories = load_categories()
+    report = {'received': 0, 'inserted': 0, 'failed': 0, 'errors': [], 'truncated': False}
+
+    def fail(row, error):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'row': row, 'error': error})
+
+    chunk = []
+
+    def flush():
+        try:
+            report['inserted'] += _write_chunk(chunk)
+        except DBAPIError:
+            # The driver's message stays in the log; it describes our schema
+            logger.exception('product import chunk failed')
+            db.session.rollback()
+            for row, _ in chunk:
+                fail(row, 'Could not be saved')
+        chunk.clear()
+
+    for row, record, error in read_rows(stream, fmt):
+        if report['received'] >= max_rows:
+            report['truncated'] = True
+            break
+        report['received'] += 1
+        if error:
+            fail(row, error)
+            continue
+        values, errors = validate(record, retailer_id, categories)
+        if errors:
+            fail(row, errors)
+            continue
+        chunk.append((row, values))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    if report['inserted']:
+        cache.invalidate('products')
+    return report
@@ -0,0 +1,127 @@
+from datetime import datetime
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, Conversation, Message, Product, Retailer, User
+from .conditional import bump
+
+# Messages between a shopper and a retailer are grouped into conversations
+# (one per shopper, retailer and optional product). The inbox lists
+# conversations by last_message_at from an index and fills in the last
+# message and the unread count with correlated subqueries, so it reads one
+# bounded page however many messages a user has.
+
+
+def is_participant(conversation, user_id, retailer_id=None):
+    return conversation.user_id == user_id or (retailer_id is not None and conversation.retailer_id == retailer_id)
+
+
+def other_participant(conversation, user_id):
+    retailer_user_id = db.session.scalar(select(Retailer.user_id).where(Retailer.id == conversation.retailer_id))
+    return retailer_user_id if conversation.user_id == user_id else conversation.user_id
+
+
+def _retailer_for(receiver_id, product_id, retailer_id):
+    if retailer_id:
+        return retailer_id
+    if product_id:
+        retailer_id = db.session.scalar(select(Product.retailer_id).where(Product.id == product_id))
+        if retailer_id:
+            return retailer_id
+    return db.session.scalar(select(Retailer.id).where(Retailer.user_id == receiver_id))
+
+
+def get_or_create(user_id, retailer_id, product_id=None):
+    criteria = {'user_id': user_id, 'retailer_id': retailer_id, 'product_id': product_id}
+    conversation = Conversation.query.filter_by(**criteria).first()
+    if conversation:
+        return conversation
+    conversation = Conversation(**criteria)
+    try:
+        # Savepoint, so losing a race with another request only costs a retry
+        with db.session.begin_nested():
+            db.session.add(conversation)
+    except IntegrityError:
+        conversation = Conversation.query.filter_by(**criteria).one()
+    return conversation
+
+
+def conversation_for(sender_id, receiver_id, product_id=None, retailer_id=None):
+    """The thread a new message belongs in, or None for a message that involves no retailer."""
+    retailer_id = _retailer_for(receiver_id, product_id, retailer_id)
+    if not retailer_id:
+        return None
+    retailer_user_id = db.session.scalar(select(Retailer.user_id).where(Retailer.id == retailer_id))
+    if sender_id == retailer_user_id:
+        shopper_id = receiver_id
+    elif receiver_id == retailer_user_id:
+        shopper_id = sender_id
+    else:
+        return None
+    return get_or_create(shopper_id, retailer_id, product_id)
+
+
+def conversation_rows(user_id, retailer_id=None):
+    """SELECT of ConversationOut rows for everything ``user_id`` takes part in."""
+    last_message_id = (
+        select(Message.id)
+        .where(Message.conversation_id == Conversation.id)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(1)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    unread = (
+        select(func.count(Message.id))
+        .where(
+            Message.conversation_id == Conversation.id,
+            Message.receiver_id == user_id,
+            Message.read_at.is_(None)
+        )
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+
+    participant = Conversation.user_id == user_id
+    if retailer_id:
+        participant = or_(participant, Conversation.retailer_id == retailer_id)
+
+    return (
+        select(
+            Conversation.id.label('id'),
+            Conversation.user_id.label('user_id'),
+            User.username.label('username'),
+            Conversation.retailer_id.label('retailer_id'),
+            Retailer.name.label('retailer_name'),
+            Conversation.product_id.label('product_id'),
+            Product.name.label('product_name'),
+            Conversation.last_message_at.label('last_message_at'),
+            Message.sender_id.label('last_sender_id'),
+            Message.content.label('last_message'),
+            unread.label('unread_count'),
+        )
+        .select_from(Conversation)
+        .join(User, User.id == Conversation.user_id)
+        .join(Retailer, Retailer.id == Conversation.retailer_id)
+        .outerjoin(Product, Product.id == Conversation.product_id)
+        .outerjoin(Message, Message.id == last_message_id)
+        .where(participant)
+    )
+
+
+def mark_read(conversation_id, user_id):
+    result = db.session.execute(
+        update(Message)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.receiver_id == user_id,
+            Message.read_at.is_(None)
+        )
+        .values(read_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        # Core UPDATE: tell conditional GETs the inbox changed
+        bump(db.session.connection(), 'messages')
+    return result.rowcount
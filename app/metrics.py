@@ -0,0 +1,248 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Per-request instrumentation. Every request records its wall time, SQL
+# statement count and time (from engine events), JSON encoding time and
+# response size. The totals go out in a Server-Timing header and are
+# aggregated into per-endpoint histograms that /metrics serves in the
+# Prometheus text format. Aggregates are per process; Prometheus sums the
+# workers it scrapes. Flask requests keep their stats on flask.g; the
+# Starlette read handlers in app.async_reads go through AsgiInstrumentation,
+# which keeps them in a context variable (copied into the greenlets and
+# threads the request's work runs in) and reports under the Flask rule.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_time', 'serialize_time', 'repeats')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.repeats = Counter()
+
+
+_async_stats = ContextVar('request_stats', default=None)
+
+
+def current():
+    """The running request's stats, or None outside an instrumented request."""
+    if not has_request_context():
+        return _async_stats.get()
+    return g.get('request_stats')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_started'].pop()
+    stats = current()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += time.perf_counter() - started
+        stats.repeats[statement] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_execute(context):
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def record_serialization(seconds):
+    stats = current()
+    if stats is not None:
+        stats.serialize_time += seconds
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.total}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.total}'
+
+
+METRICS = (
+    ('http_request_duration_seconds', 'Request wall time.', DURATION_BUCKETS),
+    ('http_request_db_seconds', 'Time spent executing SQL per request.', DURATION_BUCKETS),
+    ('http_request_sql_statements', 'SQL statements executed per request.', STATEMENT_BUCKETS),
+    ('http_request_serialize_seconds', 'JSON encoding time per request.', DURATION_BUCKETS),
+    ('http_response_size_bytes', 'Response body size.', SIZE_BUCKETS),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Instrumentation:
+    def __init__(self):
+        self.app = None
+        self.enabled = True
+        self.n_plus_one_threshold = 5
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Each worker reports its own requests
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = Counter()
+        self._n_plus_one = Counter()
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('METRICS_TOKEN', None)
+        self.app = app
+        self.enabled = app.config['METRICS_ENABLED']
+        self.n_plus_one_threshold = app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        app.extensions['metrics'] = self
+        if self.enabled:
+            app.before_request(self._start)
+            app.after_request(self._finish)
+
+    def _start(self):
+        g.request_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        # None for streamed bodies, which are sized only as they are sent.
+        # calculate_content_length() would read a generator body to the end
+        size = None if response.is_streamed else response.calculate_content_length()
+        response.headers['Server-Timing'] = self.observe(stats, request.method, endpoint, response.status_code, size)
+        return response
+
+    def observe(self, stats, method, endpoint, status, size):
+        """Aggregate one finished request; returns its Server-Timing header value."""
+        elapsed = time.perf_counter() - stats.started
+        repeated = [(count, sql) for sql, count in stats.repeats.items() if count >= self.n_plus_one_threshold]
+        for count, sql in repeated:
+            logger.warning('Possible N+1 on %s %s: %d executions of %s', method, endpoint, count, sql)
+
+        labels = f'method="{method}",endpoint="{_escape(endpoint)}"'
+        with self._lock:
+            self._requests[(labels, status)] += 1
+            if repeated:
+                self._n_plus_one[labels] += 1
+            observed = (elapsed, stats.db_time, stats.statements, stats.serialize_time, size)
+            for (name, _, buckets), value in zip(METRICS, observed):
+                if value is None:
+                    continue
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[(name, labels)] = Histogram(buckets)
+                histogram.observe(value)
+
+        return ', '.join([
+            f'db;desc="{stats.statements} queries";dur={stats.db_time * 1000:.1f}',
+            f'serialize;dur={stats.serialize_time * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+
+    def render(self):
+        """All aggregates in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append('# HELP http_requests_total Requests handled.')
+            lines.append('# TYPE http_requests_total counter')
+            for (labels, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+
+            lines.append('# HELP http_request_n_plus_one_total Requests that repeated one SQL statement '
+                         'METRICS_N_PLUS_ONE_THRESHOLD or more times.')
+            lines.append('# TYPE http_request_n_plus_one_total counter')
+            for labels, count in sorted(self._n_plus_one.items()):
+                lines.append(f'http_request_n_plus_one_total{{{labels}}} {count}')
+
+            for name, help_text, _ in METRICS:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.render(name, labels))
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation()
+
+
+class AsgiInstrumentation:
+    """ASGI middleware giving a Starlette route the same stats as a Flask request.
+
+    ``endpoint`` is the Flask rule the route mirrors, so both sides of a
+    path report under one label.
+    """
+
+    def __init__(self, app, endpoint):
+        self.app = app
+        self.endpoint = endpoint
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not instrumentation.enabled:
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _async_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                length = next((value for name, value in headers if name == b'content-length'), None)
+                timing = instrumentation.observe(
+                    stats, scope['method'], self.endpoint, message['status'],
+                    int(length) if length is not None else None
+                )
+                message = {**message, 'headers': [*headers, (b'server-timing', timing.encode('latin-1'))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _async_stats.reset(token)
+
+
+def init_app(app):
+    instrumentation.init_app(app)
@@ -1,9 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy_serializer import SerializerMixin
 from datetime import datetime
-import bcrypt
+import re
+from .database import RoutingSession
+from .hashing import hasher
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model, SerializerMixin):
     __tablename__ = 'users'
@@ -14,15 +17,19 @@ class User(db.Model, SerializerMixin):
     is_retailer = db.Column(db.Boolean, default=False)
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Stored in the session at login and advanced at logout, which revokes
+    # every copy of the session cookie
+    session_generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     feedbacks = db.relationship('Feedback', back_populates='user', cascade='all, delete-orphan')
     wishlists = db.relationship('Wishlist', back_populates='user', cascade='all, delete-orphan')
     messages_sent = db.relationship('Message', foreign_keys='Message.sender_id', back_populates='sender', cascade='all, delete-orphan')
     messages_received = db.relationship('Message', foreign_keys='Message.receiver_id', back_populates='receiver', cascade='all, delete-orphan')
     search_history = db.relationship('UserHistory', back_populates='user', cascade='all, delete-orphan')
+    conversations = db.relationship('Conversation', back_populates='user', cascade='all, delete-orphan')
     retailer = db.relationship('Retailer', uselist=False, back_populates='user')
 
-    serialize_rules = ('-password_hash', '-feedbacks.user', '-wishlists.user', '-messages_sent.sender', '-messages_received.receiver', '-search_history.user', '-retailer.user')
+    serialize_rules = ('-password_hash', '-session_generation', '-feedbacks.user', '-wishlists.user', '-messages_sent.sender', '-messages_received.receiver', '-search_history.user', '-retailer.user')
 
     @property
     def password(self):
@@ -30,10 +37,13 @@ class User(db.Model, SerializerMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = hasher.hash(password)
 
     def verify_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return hasher.verify(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
 
     def to_dict(self):
         return {
@@ -56,8 +66,13 @@ class Retailer(db.Model, SerializerMixin):
     user = db.relationship('User', back_populates='retailer')
     products = db.relationship('Product', back_populates='retailer', cascade='all, delete-orphan')
     messages = db.relationship('Message', foreign_keys='Message.retailer_id', back_populates='retailer', cascade='all, delete-orphan')
+    conversations = db.relationship('Conversation', back_populates='retailer', cascade='all, delete-orphan')
+
+    serialize_rules = ('-user.retailer', '-products.retailer', '-messages.retailer', '-conversations.retailer')
 
-    serialize_rules = ('-user.retailer', '-products.retailer', '-messages.retailer')
+    __table_args__ = (
+        db.Index('ix_retailers_user_id', 'user_id'),
+    )
 
     def to_dict(self):
         return {
@@ -91,18 +106,35 @@ class Product(db.Model, SerializerMixin):
     retailer_id = db.Column(db.Integer, db.ForeignKey('retailers.id'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     image_url = db.Column(db.String)
     estimated_value = db.Column(db.Float)  
     marginal_benefit = db.Column(db.Float)  
+    # Cost-benefit + marginal-benefit ratio, kept up to date on every write
+    # so "best buy" ordering can be answered from an index.
+    value_score = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    # Normalized name shared by every retailer's listing of the same item,
+    # used to group offers for price comparison.
+    canonical_key = db.Column(db.String, nullable=False, default='', server_default='')
     
     feedbacks = db.relationship('Feedback', back_populates='product', cascade='all, delete-orphan')
     messages = db.relationship('Message', foreign_keys='Message.product_id', back_populates='product', cascade='all, delete-orphan')
     wishlists = db.relationship('Wishlist', back_populates='product', cascade='all, delete-orphan')
+    conversations = db.relationship('Conversation', back_populates='product', cascade='all, delete-orphan')
     retailer = db.relationship('Retailer', back_populates='products')
     category = db.relationship('Category', back_populates='products')
 
     serialize_rules = ('-retailer.products', '-category.products', '-feedbacks.product', '-messages.product', '-wishlists.product')
 
+    __table_args__ = (
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_value_score_id', 'value_score', 'id'),
+        db.Index('ix_products_updated_at_id', 'updated_at', 'id'),
+        db.Index('ix_products_canonical_key_id', 'canonical_key', 'id'),
+        db.Index('ix_products_retailer_id_id', 'retailer_id', 'id'),
+        db.Index('ix_products_category_id_id', 'category_id', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -126,11 +158,29 @@ class Product(db.Model, SerializerMixin):
 
     def calculate_marginal_benefit(self):
         total_cost = self.price + (self.delivery_cost or 0)
-        return self.marginal_benefit / total_cost if total_cost > 0 else 0
+        benefit = self.marginal_benefit if self.marginal_benefit is not None else 0
+        return benefit / total_cost if total_cost > 0 else 0
 
-    def calculate_marginal_benefit(self):
-        total_cost = self.price + (self.delivery_cost or 0)
-        return self.marginal_benefit / total_cost if total_cost > 0 else 0
+    @staticmethod
+    def compute_value_score(price, delivery_cost, estimated_value, marginal_benefit):
+        total_cost = (price or 0) + (delivery_cost or 0)
+        if total_cost <= 0:
+            return 0
+        return ((estimated_value or 0) + (marginal_benefit or 0)) / total_cost
+
+    def calculate_value_score(self):
+        return self.compute_value_score(self.price, self.delivery_cost, self.estimated_value, self.marginal_benefit)
+
+    @staticmethod
+    def compute_canonical_key(name):
+        # "Samsung  Galaxy S23!" and "samsung galaxy s23" are the same item
+        return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _refresh_derived_columns(mapper, connection, target):
+    target.value_score = target.calculate_value_score()
+    target.canonical_key = Product.compute_canonical_key(target.name)
 
 class Feedback(db.Model, SerializerMixin):
     __tablename__ = 'feedback'
@@ -143,6 +193,11 @@ class Feedback(db.Model, SerializerMixin):
     user = db.relationship('User', back_populates='feedbacks')
     product = db.relationship('Product', back_populates='feedbacks')
 
+    __table_args__ = (
+        db.Index('ix_feedback_user_id', 'user_id'),
+        db.Index('ix_feedback_product_id', 'product_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -161,6 +216,10 @@ class UserHistory(db.Model, SerializerMixin):
     
     user = db.relationship('User', back_populates='search_history')
 
+    __table_args__ = (
+        db.Index('ix_user_history_user_searched_at', 'user_id', 'searched_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -176,13 +235,25 @@ class Message(db.Model, SerializerMixin):
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=True)
     retailer_id = db.Column(db.Integer, db.ForeignKey('retailers.id'), nullable=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=True)
     content = db.Column(db.String, nullable=False)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    read_at = db.Column(db.DateTime, nullable=True)
    
     sender = db.relationship('User', foreign_keys=[sender_id], back_populates='messages_sent')
     receiver = db.relationship('User', foreign_keys=[receiver_id], back_populates='messages_received')
     product = db.relationship('Product', back_populates='messages')
     retailer = db.relationship('Retailer', back_populates='messages')
+    conversation = db.relationship('Conversation', back_populates='messages')
+
+    __table_args__ = (
+        db.Index('ix_messages_sender_receiver_sent_at', 'sender_id', 'receiver_id', 'sent_at'),
+        db.Index('ix_messages_sender_sent_at_id', 'sender_id', 'sent_at', 'id'),
+        db.Index('ix_messages_product_id', 'product_id'),
+        db.Index('ix_messages_receiver_sent_at', 'receiver_id', 'sent_at'),
+        db.Index('ix_messages_retailer_sent_at', 'retailer_id', 'sent_at'),
+        db.Index('ix_messages_conversation_sent_at', 'conversation_id', 'sent_at', 'id'),
+    )
 
     def to_dict(self):
         return {
@@ -191,8 +262,49 @@ class Message(db.Model, SerializerMixin):
             'receiver_id': self.receiver_id,
             'product_id': self.product_id,
             'retailer_id': self.retailer_id,
+            'conversation_id': self.conversation_id,
             'content': self.content,
-            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'read_at': self.read_at.isoformat() if self.read_at else None
+        }
+
+
+class Conversation(db.Model):
+    # One thread between a shopper and a retailer, optionally about a product
+    __tablename__ = 'conversations'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    retailer_id = db.Column(db.Integer, db.ForeignKey('retailers.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    user = db.relationship('User', back_populates='conversations')
+    retailer = db.relationship('Retailer', back_populates='conversations')
+    product = db.relationship('Product', back_populates='conversations')
+    messages = db.relationship('Message', back_populates='conversation', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'retailer_id', 'product_id', name='uq_conversations_participants'),
+        # NULLs never compare equal, so the constraint above can't stop
+        # duplicate general (product-less) conversations
+        db.Index(
+            'uq_conversations_general', 'user_id', 'retailer_id', unique=True,
+            postgresql_where=product_id.is_(None), sqlite_where=product_id.is_(None),
+        ),
+        db.Index('ix_conversations_user_last_message', 'user_id', 'last_message_at', 'id'),
+        db.Index('ix_conversations_retailer_last_message', 'retailer_id', 'last_message_at', 'id'),
+        db.Index('ix_conversations_product_id', 'product_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'retailer_id': self.retailer_id,
+            'product_id': self.product_id,
+            'created_at': self.created_at.isoformat(),
+            'last_message_at': self.last_message_at.isoformat()
         }
 
 
@@ -206,6 +318,12 @@ class Wishlist(db.Model, SerializerMixin):
     user = db.relationship('User', back_populates='wishlists')
     product = db.relationship('Product', back_populates='wishlists')
 
+    __table_args__ = (
+        # Also serves "this user's wishlist" lookups
+        db.UniqueConstraint('user_id', 'product_id', name='uq_wishlists_user_product'),
+        db.Index('ix_wishlists_product_id', 'product_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -223,6 +341,10 @@ class Notification(db.Model):
 
     retailer = db.relationship('Retailer', backref=db.backref('notifications', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_notifications_retailer_id', 'retailer_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -230,3 +352,69 @@ class Notification(db.Model):
             'retailer_id': self.retailer_id,
             'seen': self.seen
         }
+
+class CollectionVersion(db.Model):
+    __tablename__ = 'collection_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class AnalyticsCounter(db.Model):
+    __tablename__ = 'analytics_counters'
+    name = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'value': self.value
+        }
+
+class PushEvent(db.Model):
+    # Outbox for the Server-Sent Events channel; ids double as SSE event ids
+    __tablename__ = 'push_events'
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(64), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_push_events_topic_id', 'topic', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'topic': self.topic,
+            'kind': self.kind,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat()
+        }
+
+class ProductNeighbor(db.Model):
+    # Precomputed "similar products", best first; see app/recommend.py
+    __tablename__ = 'product_neighbors'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_product_neighbors_neighbor_id', 'neighbor_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'rank': self.rank,
+            'neighbor_id': self.neighbor_id,
+            'score': self.score
+        }
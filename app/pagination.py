@@ -0,0 +1,93 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import DateTime, Select, and_, or_
+
+from .models import db
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_limit(default=DEFAULT_LIMIT, maximum=MAX_LIMIT, args=None):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(values):
+    # Cursors are opaque to clients: a urlsafe base64 JSON list of the key values
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(cursor)
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and isinstance(column.type, DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+        decoded.append(value)
+    return decoded
+
+
+def _after(columns, values, descending):
+    # Lexicographic "row comes after the cursor" predicate, written with
+    # plain AND/OR so it works on SQLite as well as Postgres.
+    column, value = columns[0], values[0]
+    past = column < value if descending else column > value
+    if len(columns) == 1:
+        return past
+    return or_(past, and_(column == value, _after(columns[1:], values[1:], descending)))
+
+
+def keyset_query(query, columns, limit, cursor=None, descending=True):
+    """``query`` narrowed to the page after ``cursor``, with one extra row to detect a next page."""
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns), descending))
+
+    ordering = [column.desc() if descending else column.asc() for column in columns]
+    return query.order_by(*ordering).limit(limit + 1)
+
+
+def keyset_result(rows, columns, limit):
+    """Trim the rows fetched by keyset_query() to ``limit`` and build the next cursor."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return rows, next_cursor
+
+
+def keyset_page(query, columns, limit, cursor=None, descending=True):
+    """Fetch one page of ``query`` ordered by ``columns`` and the cursor for the next one.
+
+    ``query`` may be a Query or a select(); ``columns`` must be readable by
+    name from the returned rows.
+    """
+    query = keyset_query(query, columns, limit, cursor=cursor, descending=descending)
+    # Accepts both legacy Query objects and 2.0-style select() statements
+    rows = db.session.execute(query).all() if isinstance(query, Select) else query.all()
+    return keyset_result(rows, columns, limit)
@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask import Response
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .models import db, Message, Notification, PushEvent
+from .serializers import MessageOut, NotificationOut, dumps
+
+# Server-Sent Events push channel.
+#
+# New messages and notifications are written to push_events in the same
+# transaction that creates them. Each process runs a single poller thread
+# that reads new push_events rows and fans them out to the SSE connections
+# subscribed in that process. The database load is therefore one cheap
+# primary-key range query per process per interval, however many clients are
+# connected, and events reach subscribers in every worker and host. Clients
+# that reconnect with Last-Event-ID are replayed what they missed from the
+# table.
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', 'id topic kind payload')
+
+# Ids are handed out before commit, so on Postgres a lower id can become
+# visible after a higher one. The poller re-reads this many ids behind its
+# high-water mark and skips the ones it already delivered.
+_REORDER_WINDOW = 100
+
+RETRY = b'retry: 3000\n\n'
+KEEP_ALIVE = b': keep-alive\n\n'
+
+
+def topics_for(identity):
+    """The topics a session is allowed to receive."""
+    user_id = identity.get('user_id')
+    if not user_id:
+        return []
+    topics = [f'user:{user_id}']
+    if identity.get('retailer_id'):
+        topics.append(f"retailer:{identity['retailer_id']}")
+    if identity.get('is_admin'):
+        topics.append('admins')
+    return topics
+
+
+def _events_for(obj):
+    if isinstance(obj, Message):
+        return [(f'user:{obj.receiver_id}', 'message', dumps(MessageOut.from_model(obj)))]
+    if isinstance(obj, Notification):
+        payload = dumps(NotificationOut.from_model(obj))
+        topics = ['admins']
+        if obj.retailer_id:
+            topics.append(f'retailer:{obj.retailer_id}')
+        return [(topic, 'notification', payload) for topic in topics]
+    return []
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_events(sess, flush_context):
+    now = datetime.utcnow()
+    rows = [
+        {'topic': topic, 'kind': kind, 'payload': payload.decode('utf-8'), 'created_at': now}
+        for obj in sess.new
+        for topic, kind, payload in _events_for(obj)
+    ]
+    if rows:
+        sess.connection().execute(insert(PushEvent), rows)
+        sess.info['push_pending'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_poller(sess):
+    # Local subscribers hear about their own process's writes immediately
+    if sess.info.pop('push_pending', False):
+        broker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(sess):
+    sess.info.pop('push_pending', None)
+
+
+def parse_last_event_id(value):
+    if not value:
+        return None
+    last_event_id = int(value)
+    if last_event_id < 0:
+        raise ValueError(value)
+    return last_event_id
+
+
+def replay(topics, after_id, limit):
+    """Events on ``topics`` newer than ``after_id``, oldest first."""
+    if after_id is None:
+        return []
+    rows = db.session.execute(
+        select(PushEvent.id, PushEvent.topic, PushEvent.kind, PushEvent.payload)
+        .where(PushEvent.topic.in_(topics), PushEvent.id > after_id)
+        .order_by(PushEvent.id)
+        .limit(limit)
+    ).all()
+    return [Event(*row) for row in rows]
+
+
+def format_event(ev):
+    return f'id: {ev.id}\nevent: {ev.kind}\ndata: {ev.payload}\n\n'.encode('utf-8')
+
+
+class StreamLimitReached(Exception):
+    pass
+
+
+class ThreadSubscription:
+    """A subscriber served by a WSGI worker thread.
+
+    The queue holds ``maxsize`` events plus a slot for the closing sentinel,
+    so a subscriber that falls behind still gets what was queued before the
+    stream ends.
+    """
+
+    def __init__(self, topics, maxsize):
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize + 1)
+        self.closed = False
+
+    def offer(self, ev):
+        # Only the poller thread offers, so the size can't change in between
+        if self.closed or self.queue.qsize() >= self.maxsize:
+            return False
+        self.queue.put_nowait(ev)
+        return True
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class AsyncSubscription:
+    """A subscriber served by an asyncio task; fed from the poller thread.
+
+    As ThreadSubscription, the queue keeps a slot for the closing sentinel.
+    """
+
+    def __init__(self, topics, maxsize):
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self.queue = asyncio.Queue(maxsize + 1)
+        self.loop = asyncio.get_running_loop()
+        self.closed = False
+
+    def _put(self, ev):
+        if self.closed:
+            return
+        if ev is None or self.queue.qsize() >= self.maxsize:
+            # Closed, or too slow to keep up: the stream ends once the
+            # queued events are sent and the client resumes with Last-Event-ID
+            self.closed = True
+            ev = None
+        self.queue.put_nowait(ev)
+
+    def offer(self, ev):
+        if self.closed or self.loop.is_closed():
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, ev)
+        except RuntimeError:
+            # The loop closed after the check above
+            return False
+        return True
+
+    def close(self):
+        if not self.closed and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._put, None)
+            except RuntimeError:
+                pass
+
+
+class Broker:
+    """Per-process fan-out from push_events to local subscribers."""
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self.retention = 24 * 3600
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # The poller thread does not survive fork(); children start their own
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        app.config.setdefault('PUSH_POLL_INTERVAL', 1.0)
+        app.config.setdefault('PUSH_HEARTBEAT', 15)
+        app.config.setdefault('PUSH_QUEUE_SIZE', 100)
+        app.config.setdefault('PUSH_REPLAY_LIMIT', 500)
+        app.config.setdefault('PUSH_RETENTION', 24 * 3600)
+        app.config.setdefault('PUSH_MAX_THREAD_STREAMS', 4)
+        self.app = app
+        self.poll_interval = app.config['PUSH_POLL_INTERVAL']
+        self.retention = app.config['PUSH_RETENTION']
+        app.extensions['push'] = self
+        app.cli.add_command(prune_command)
+
+    def subscribe(self, sub, limit=None):
+        """Register ``sub``; returns None if ``limit`` subscribers of its kind are already open."""
+        with self._lock:
+            if limit is not None and self._count(type(sub)) >= limit:
+                return None
+            for topic in sub.topics:
+                self._subscribers.setdefault(topic, set()).add(sub)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='push-poller', daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for topic in sub.topics:
+                subs = self._subscribers.get(topic)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[topic]
+        sub.close()
+
+    def _count(self, kind=None):
+        subs = {sub for subs in self._subscribers.values() for sub in subs}
+        return len([sub for sub in subs if kind is None or isinstance(sub, kind)])
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count()
+
+    def wake(self):
+        self._wake.set()
+
+    def _dispatch(self, ev):
+        with self._lock:
+            subs = list(self._subscribers.get(ev.topic, ()))
+        for sub in subs:
+            if not sub.offer(ev):
+                self.unsubscribe(sub)
+
+    def _poll(self, conn, high, delivered):
+        """Dispatch the events after ``high``, and those inside the reorder window not in ``delivered``.
+
+        Returns the new high-water mark.
+        """
+        rows = conn.execute(
+            select(PushEvent.id, PushEvent.topic, PushEvent.kind, PushEvent.payload)
+            .where(PushEvent.id > high - _REORDER_WINDOW)
+            .order_by(PushEvent.id)
+            .limit(1000)
+        ).all()
+        seen = set(delivered)
+        for row in rows:
+            if row.id in seen:
+                continue
+            delivered.append(row.id)
+            high = max(high, row.id)
+            self._dispatch(Event(*row))
+        return high
+
+    def _run(self):
+        with self.app.app_context():
+            engine = db.engine
+        with engine.connect() as conn:
+            high = conn.scalar(select(func.max(PushEvent.id))) or 0
+        delivered = deque(maxlen=4 * _REORDER_WINDOW)
+        last_prune = time.monotonic()
+
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with engine.connect() as conn:
+                    high = self._poll(conn, high, delivered)
+                if time.monotonic() - last_prune > 600:
+                    last_prune = time.monotonic()
+                    prune(engine, self.retention)
+            except SQLAlchemyError:
+                logger.exception('push poller query failed')
+
+
+broker = Broker()
+
+
+def prune(engine, retention):
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    with engine.begin() as conn:
+        return conn.execute(delete(PushEvent).where(PushEvent.created_at < cutoff)).rowcount
+
+
+@click.command('push-prune')
+def prune_command():
+    """Delete push events older than PUSH_RETENTION seconds."""
+    removed = prune(db.engine, broker.retention)
+    click.echo(f'Removed {removed} push events.')
+
+
+def _is_new(ev, floor, replayed):
+    # Live events can repeat what was just replayed, or predate Last-Event-ID
+    return ev.id > floor and ev.id not in replayed
+
+
+def _sync_stream(sub, backlog, floor, heartbeat):
+    replayed = {ev.id for ev in backlog}
+    yield RETRY
+    for ev in backlog:
+        yield format_event(ev)
+    # Runs until the closing sentinel, so events queued before a slow
+    # subscriber was dropped are still sent
+    while True:
+        try:
+            ev = sub.queue.get(timeout=heartbeat)
+        except queue.Empty:
+            yield KEEP_ALIVE
+            continue
+        if ev is None:
+            break
+        if _is_new(ev, floor, replayed):
+            yield format_event(ev)
+
+
+async def async_stream(sub, backlog, last_event_id, heartbeat):
+    floor = last_event_id or 0
+    replayed = {ev.id for ev in backlog}
+    try:
+        yield RETRY
+        for ev in backlog:
+            yield format_event(ev)
+        while True:
+            try:
+                ev = await asyncio.wait_for(sub.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield KEEP_ALIVE
+                continue
+            if ev is None:
+                break
+            if _is_new(ev, floor, replayed):
+                yield format_event(ev)
+    finally:
+        broker.unsubscribe(sub)
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def stream_response(topics, last_event_id):
+    """A streaming Flask response for ``topics``; holds one worker thread while open.
+
+    Raises StreamLimitReached when PUSH_MAX_THREAD_STREAMS streams are
+    already open in this process, so streams can't take every request thread.
+    """
+    config = broker.app.config
+    # Subscribe before replaying so nothing falls between the two
+    sub = broker.subscribe(
+        ThreadSubscription(topics, config['PUSH_QUEUE_SIZE']), limit=config['PUSH_MAX_THREAD_STREAMS'] or None
+    )
+    if sub is None:
+        raise StreamLimitReached()
+    try:
+        backlog = replay(topics, last_event_id, config['PUSH_REPLAY_LIMIT'])
+    except Exception:
+        broker.unsubscribe(sub)
+        raise
+    # Hand the connection back to the pool for the life of the stream
+    db.session.close()
+
+    body = _sync_stream(sub, backlog, last_event_id or 0, config['PUSH_HEARTBEAT'])
+    resp = Response(body, mimetype='text/event-stream', headers=SSE_HEADERS)
+    resp.call_on_close(lambda: broker.unsubscribe(sub))
+    return resp
+
+
+def init_app(app):
+    broker.init_app(app)
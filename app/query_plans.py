@@ -0,0 +1,112 @@
+import json
+
+import click
+from sqlalchemy import or_, text
+
+from .models import db, Feedback, Message, Notification, Product, Retailer, UserHistory, Wishlist
+from .compare import offers_query
+from .export import export_query
+from .messaging import conversation_rows
+from .serializers import product_rows
+
+# Query-plan regression check: `flask check-query-plans` runs EXPLAIN for the
+# queries behind the catalog, dashboards and inboxes and fails if any of them
+# reads a whole table instead of using an index. Run it against a seeded
+# database after schema or query changes (e.g. in CI after `python seed.py`);
+# tests/test_query_plans.py runs the same check under pytest.
+#
+# Postgres ignores indexes on small tables, so the check disables sequential
+# scans for the EXPLAIN: a plan that still scans has no usable index.
+
+
+def _page(query, *ordering):
+    return query.order_by(*ordering).limit(50)
+
+
+def hot_queries():
+    """(name, statement) pairs for the hot paths, with placeholder ids."""
+    newest = [Product.created_at.desc(), Product.id.desc()]
+    recent = [Message.sent_at.desc(), Message.id.desc()]
+    return [
+        ('products newest', _page(product_rows(), *newest)),
+        ('products best value', _page(product_rows(), Product.value_score.desc(), Product.id.desc())),
+        ('retailer dashboard products', product_rows().where(Product.retailer_id == 1)),
+        ('export by retailer', export_query(retailer_id=1, category_id=None, updated_since=None)),
+        ('export by category', export_query(retailer_id=None, category_id=1, updated_since=None)),
+        ('compare offers', offers_query('samsung galaxy s23')),
+        ('retailer by user', Retailer.query.filter_by(user_id=1).statement),
+        ('user messages', _page(Message.query.filter(or_(Message.sender_id == 1, Message.receiver_id == 1)), *recent).statement),
+        ('sent messages', _page(Message.query.filter_by(sender_id=1), *recent).statement),
+        ('retailer messages', _page(Message.query.filter_by(retailer_id=1), *recent).statement),
+        ('conversation messages', _page(Message.query.filter_by(conversation_id=1), *recent).statement),
+        ('conversations', conversation_rows(1).limit(50)),
+        ('wishlist', Wishlist.query.filter_by(user_id=1).statement),
+        ('wishlist duplicate', Wishlist.query.filter_by(user_id=1, product_id=1).statement),
+        ('user feedback', Feedback.query.filter_by(user_id=1).statement),
+        ('product feedback', Feedback.query.filter_by(product_id=1).statement),
+        ('search history', UserHistory.query.filter_by(user_id=1).order_by(UserHistory.searched_at.desc()).statement),
+        ('retailer notifications', Notification.query.filter_by(retailer_id=1).statement),
+    ]
+
+
+def _explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    params = compiled.construct_params()
+    if compiled.positiontup:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + compiled.string, params).scalar()
+        return json.loads(plan) if isinstance(plan, str) else plan
+    return connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + compiled.string, params).all()
+
+
+def _pg_full_scans(node):
+    if node.get('Node Type') == 'Seq Scan':
+        yield node.get('Relation Name')
+    for child in node.get('Plans', ()):
+        yield from _pg_full_scans(child)
+
+
+def full_scans(connection, statement):
+    """Tables ``statement`` reads in full."""
+    plan = _explain(connection, statement)
+    if connection.dialect.name == 'postgresql':
+        return [table for entry in plan for table in _pg_full_scans(entry['Plan'])]
+    # SQLite reports "SCAN products" for a table scan and "SCAN products
+    # USING INDEX ..." for an ordered index walk. Scans of subquery results
+    # are named after the subquery and are not table reads.
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and ' USING ' not in detail:
+            table = detail.split()[1]
+            if table in db.metadata.tables:
+                scans.append(table)
+    return scans
+
+
+def check(connection):
+    """Return {query name: [fully scanned tables]} for the queries that regressed."""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+    failures = {}
+    for name, statement in hot_queries():
+        scans = full_scans(connection, statement)
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+def init_app(app):
+    @app.cli.command('check-query-plans')
+    def check_query_plans():
+        """Fail if a hot query's plan falls back to a full table scan."""
+        # The connection rolls back on close, taking SET LOCAL with it
+        with db.engine.connect() as connection:
+            failures = check(connection)
+        for name, tables in failures.items():
+            click.echo(f'FULL SCAN  {name}: {", ".join(tables)}')
+        if failures:
+            raise SystemExit(1)
+        click.echo(f'{len(hot_queries())} query plans use indexes.')
@@ -0,0 +1,372 @@
+import logging
+import os
+import threading
+import time
+
+import click
+import numpy as np
+from sqlalchemy import delete, distinct, event, func, insert, literal, select, union_all
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .cache import cache
+from .models import db, Feedback, Message, Product, ProductNeighbor, User, Wishlist
+from .serializers import product_rows
+
+logger = logging.getLogger(__name__)
+
+# Item-to-item recommendations: "people who wanted this also wanted".
+#
+# Wishlist entries, enquiries about a product and feedback are implicit
+# ratings, weighted by intent; a user who did several of these for the same
+# product counts once, at the strongest weight. Two products are similar
+# when the same users went for both: cosine similarity over the user x
+# product matrix. NumPy computes it from sorted (user, product, weight)
+# arrays, pairing each user's products and summing per pair, so there is no
+# dense matrix and no SciPy. The best RECOMMEND_NEIGHBORS per product are
+# stored in product_neighbors, and both endpoints read that table by primary
+# key.
+#
+# `flask recommendations-rebuild` recomputes everything. Between rebuilds,
+# committed wishlist, message and feedback rows mark their product and user
+# dirty, and a background thread in each process recomputes the rows of
+# every product they affect, which leaves the table as a rebuild would.
+
+WEIGHTS = {'wishlist': 3.0, 'message': 2.0, 'feedback': 1.0}
+# Users' products paired per NumPy pass; bounds memory on large datasets
+PAIR_CHUNK = 2_000_000
+# A shopper's strongest signals seed their recommendations
+SEEDS = 20
+
+
+def signals(users=None, products=None):
+    """(user_id, product_id, weight) rows from every source, before de-duplication.
+
+    ``users`` and ``products`` (id lists or subqueries) restrict every source
+    separately, so each one is read through its own index.
+    """
+    sources = [
+        (select(Wishlist.user_id, Wishlist.product_id, literal(WEIGHTS['wishlist']).label('weight')),
+         Wishlist.user_id, Wishlist.product_id),
+        # Only shoppers' enquiries; retailers answering about their own
+        # products say nothing about demand
+        (select(Message.sender_id, Message.product_id, literal(WEIGHTS['message']))
+         .join(User, Message.sender_id == User.id)
+         .where(Message.product_id.isnot(None), User.is_retailer.isnot(True)),
+         Message.sender_id, Message.product_id),
+        (select(Feedback.user_id, Feedback.product_id, literal(WEIGHTS['feedback'])),
+         Feedback.user_id, Feedback.product_id),
+    ]
+    parts = []
+    for query, user_column, product_column in sources:
+        if users is not None:
+            query = query.where(user_column.in_(users))
+        if products is not None:
+            query = query.where(product_column.in_(products))
+        parts.append(query)
+    return union_all(*parts).subquery()
+
+
+def interactions_query(users=None, products=None):
+    """One (user_id, product_id, weight) row per user and product, optionally restricted."""
+    source = signals(users, products)
+    return select(
+        source.c.user_id, source.c.product_id, func.max(source.c.weight).label('weight')
+    ).group_by(source.c.user_id, source.c.product_id)
+
+
+def _arrays(rows):
+    # Plain tuples: NumPy probes Row objects for array protocols one by one
+    data = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+def _pair_sums(user_index, item_index, weights, n_items):
+    """Sum of w(u, a) * w(u, b) over users, as (a * n_items + b keys, sums) for a != b."""
+    order = np.argsort(user_index, kind='stable')
+    item_index, weights = item_index[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(user_index[order]) != 0])
+    sizes = np.diff(np.r_[starts, len(order)])
+    # Split on user boundaries so each pass pairs about PAIR_CHUNK entries
+    pair_counts = sizes * sizes
+    chunk_of_user = (np.cumsum(pair_counts) - pair_counts) // PAIR_CHUNK
+    key_parts, sum_parts = [], []
+    for group_slice in np.split(np.arange(len(sizes)), np.flatnonzero(np.diff(chunk_of_user)) + 1):
+        group_sizes, group_starts = sizes[group_slice], starts[group_slice]
+        # Every entry of a user pairs with every entry of the same user
+        entry_sizes = np.repeat(group_sizes, group_sizes)
+        entry_group_start = np.repeat(group_starts, group_sizes)
+        entries = np.arange(group_starts[0], group_starts[0] + len(entry_sizes))
+        left = np.repeat(entries, entry_sizes)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(entry_sizes) - entry_sizes, entry_sizes)
+        right = np.repeat(entry_group_start, entry_sizes) + offsets
+        distinct_items = left != right
+        left, right = left[distinct_items], right[distinct_items]
+        keys = item_index[left] * n_items + item_index[right]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        key_parts.append(unique_keys)
+        sum_parts.append(np.bincount(inverse, weights=weights[left] * weights[right]))
+    if not key_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    keys, inverse = np.unique(np.concatenate(key_parts), return_inverse=True)
+    return keys, np.bincount(inverse, weights=np.concatenate(sum_parts))
+
+
+def similar_items(users, products, weights, neighbors, targets=None, norms=None):
+    """Top ``neighbors`` by cosine similarity for each product with co-occurrences.
+
+    ``users``, ``products`` and ``weights`` are parallel arrays with one entry
+    per user and product. With ``targets``, only those products' neighbors are
+    computed; the arrays must then hold every entry of every user of a
+    target, and ``norms`` maps each product in them to its norm over all
+    users. Returns parallel (product_ids, neighbor_ids, scores, ranks) arrays.
+    """
+    if not len(users):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0), empty
+    items, item_index = np.unique(products, return_inverse=True)
+    _, user_index = np.unique(users, return_inverse=True)
+    if norms is None:
+        item_norms = np.sqrt(np.bincount(item_index, weights=weights * weights, minlength=len(items)))
+    else:
+        item_norms = np.array([norms[product_id] for product_id in items.tolist()])
+
+    keys, sums = _pair_sums(user_index, item_index, weights, len(items))
+    left, right = keys // len(items), keys % len(items)
+    if targets is not None:
+        wanted = np.isin(items[left], np.fromiter(targets, dtype=np.int64))
+        left, right, sums = left[wanted], right[wanted], sums[wanted]
+    scores = sums / (item_norms[left] * item_norms[right])
+
+    # Best first within each product, ties broken by neighbor id
+    order = np.lexsort((items[right], -scores, left))
+    left, right, scores = left[order], right[order], scores[order]
+    group_starts = np.flatnonzero(np.r_[True, np.diff(left) != 0])
+    ranks = np.arange(len(left)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(left)]))
+    keep = ranks < neighbors
+    return items[left[keep]], items[right[keep]], scores[keep], ranks[keep]
+
+
+def store(connection, neighbors, replace=None, chunk_size=5000):
+    """Write similar_items() output, replacing every row or only those of the ``replace`` products."""
+    if replace is None:
+        connection.execute(delete(ProductNeighbor))
+    else:
+        replace = sorted(replace)
+        for start in range(0, len(replace), chunk_size):
+            connection.execute(
+                delete(ProductNeighbor).where(ProductNeighbor.product_id.in_(replace[start:start + chunk_size]))
+            )
+    rows = [
+        {'product_id': product_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+        for product_id, neighbor_id, score, rank in zip(*(column.tolist() for column in neighbors))
+    ]
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(insert(ProductNeighbor), rows[start:start + chunk_size])
+    return len(rows)
+
+
+def rebuild(connection, neighbors=20):
+    """Recompute product_neighbors for the whole catalog; returns the rows written."""
+    users, products, weights = _arrays(connection.execute(interactions_query()).all())
+    return store(connection, similar_items(users, products, weights, neighbors))
+
+
+def refresh(connection, user_ids=(), product_ids=(), neighbors=20):
+    """Recompute every neighbor list that signals of ``user_ids`` on ``product_ids`` can change.
+
+    That is the lists of every product of ``user_ids`` (their shared users
+    changed) and of every product sharing a user with one of ``product_ids``
+    (the changed product's norm, and so its score with each of them, moved).
+    The stored rows then match a full rebuild. Returns the number of
+    products refreshed.
+    """
+    targets = set(product_ids)
+    if user_ids:
+        theirs = signals(users=list(user_ids))
+        targets.update(connection.scalars(select(distinct(theirs.c.product_id))))
+    if product_ids:
+        changed_users = select(signals(products=sorted(product_ids)).c.user_id)
+        co_occurring = signals(users=changed_users)
+        targets.update(connection.scalars(select(distinct(co_occurring.c.product_id))))
+    if not targets:
+        return 0
+
+    # Everything the users of the targets interacted with, plus the norms of
+    # those products over all their users
+    target_signals = signals(products=sorted(targets))
+    target_users = select(target_signals.c.user_id)
+    users, products, weights = _arrays(connection.execute(interactions_query(users=target_users)).all())
+    related_signals = signals(users=target_users)
+    per_user = interactions_query(products=select(related_signals.c.product_id)).subquery()
+    norms = {
+        product_id: np.sqrt(total) for product_id, total in connection.execute(
+            select(per_user.c.product_id, func.sum(per_user.c.weight * per_user.c.weight))
+            .group_by(per_user.c.product_id)
+        )
+    }
+    store(connection, similar_items(users, products, weights, neighbors, targets=targets, norms=norms),
+          replace=targets)
+    return len(targets)
+
+
+def similar_query(product_id, limit):
+    """product_rows() plus score for the products most similar to ``product_id``, best first."""
+    return (
+        product_rows()
+        .add_columns(ProductNeighbor.score)
+        .join(ProductNeighbor, ProductNeighbor.neighbor_id == Product.id)
+        .where(ProductNeighbor.product_id == product_id)
+        .order_by(ProductNeighbor.rank)
+        .limit(limit)
+    )
+
+
+def for_user_query(user_id, limit):
+    """product_rows() plus score for ``user_id``: neighbors of their strongest signals they have not seen."""
+    mine = interactions_query(users=[user_id]).subquery()
+    seeds = select(mine).order_by(mine.c.weight.desc(), mine.c.product_id.desc()).limit(SEEDS).subquery()
+    scores = (
+        select(ProductNeighbor.neighbor_id, func.sum(ProductNeighbor.score * seeds.c.weight).label('score'))
+        .join(seeds, ProductNeighbor.product_id == seeds.c.product_id)
+        .where(ProductNeighbor.neighbor_id.not_in(select(mine.c.product_id)))
+        .group_by(ProductNeighbor.neighbor_id)
+        .subquery()
+    )
+    return (
+        product_rows()
+        .add_columns(scores.c.score)
+        .join(scores, scores.c.neighbor_id == Product.id)
+        .order_by(scores.c.score.desc(), Product.id)
+        .limit(limit)
+    )
+
+
+class Recommender:
+    """Keeps product_neighbors current between full rebuilds.
+
+    Committed signals mark their user and product dirty; a background thread
+    recomputes the affected products every ``interval`` seconds.
+    """
+
+    def __init__(self, neighbors=20, interval=60):
+        self.app = None
+        self.enabled = True
+        self.neighbors = neighbors
+        self.interval = interval
+        self.refreshed = 0
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._users = set()
+        self._products = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMMEND_ENABLED', True)
+        app.config.setdefault('RECOMMEND_NEIGHBORS', 20)
+        app.config.setdefault('RECOMMEND_REFRESH_INTERVAL', 60)
+        self.app = app
+        self.enabled = app.config['RECOMMEND_ENABLED']
+        self.neighbors = app.config['RECOMMEND_NEIGHBORS']
+        self.interval = app.config['RECOMMEND_REFRESH_INTERVAL']
+        app.extensions['recommend'] = self
+
+    def mark(self, user_ids, product_ids):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._users.update(user_ids)
+            self._products.update(product_ids)
+        self._ensure_refresher()
+
+    def stats(self):
+        with self._lock:
+            return {'dirty_users': len(self._users), 'dirty_products': len(self._products), 'refreshed': self.refreshed}
+
+    def _ensure_refresher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='recommend-refresher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+    def refresh(self):
+        """Recompute the neighbors of everything marked dirty; safe to call from any thread."""
+        if self.app is None:
+            return 0
+        with self._refresh_lock:
+            with self._lock:
+                users, self._users = self._users, set()
+                products, self._products = self._products, set()
+            if not users and not products:
+                return 0
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as connection:
+                        count = refresh(connection, users, products, self.neighbors)
+            except SQLAlchemyError:
+                logger.exception('recommendation refresh failed')
+                with self._lock:
+                    self._users |= users
+                    self._products |= products
+                return 0
+            cache.invalidate('recommendations')
+            self.refreshed += count
+            return count
+
+
+recommender = Recommender()
+
+
+# Signals are collected at flush and handed to the recommender only once the
+# transaction commits.
+
+def _signal(obj):
+    if isinstance(obj, (Wishlist, Feedback)):
+        return obj.user_id, obj.product_id
+    if isinstance(obj, Message) and obj.product_id is not None:
+        return obj.sender_id, obj.product_id
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_signals(sess, flush_context):
+    found = [signal for signal in map(_signal, list(sess.new) + list(sess.deleted)) if signal]
+    if found:
+        sess.info.setdefault('recommend_signals', []).extend(found)
+
+
+@event.listens_for(Session, 'after_commit')
+def _mark_committed(sess):
+    found = sess.info.pop('recommend_signals', None)
+    if found:
+        recommender.mark({user_id for user_id, _ in found}, {product_id for _, product_id in found})
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_uncommitted(sess):
+    sess.info.pop('recommend_signals', None)
+
+
+def init_app(app):
+    recommender.init_app(app)
+
+    @app.cli.command('recommendations-rebuild')
+    def recommendations_rebuild():
+        """Recompute similar products for the whole catalog."""
+        started = time.perf_counter()
+        with db.engine.begin() as connection:
+            rows = rebuild(connection, app.config['RECOMMEND_NEIGHBORS'])
+        cache.invalidate('recommendations')
+        click.echo(f'Stored {rows} product neighbors in {time.perf_counter() - started:.1f}s.')
@@ -1,14 +1,30 @@
-from flask import Blueprint, request, session, jsonify
+from flask import Blueprint, Response, current_app, request, session, jsonify, stream_with_context
 from flask_restful import Api, Resource
 from flask_cors import CORS
 from datetime import datetime
-from .models import db, User, Retailer, Category, Product, Feedback, UserHistory, Message, Wishlist, Notification
+from .models import db, User, Retailer, Category, Product, Feedback, UserHistory, Message, Conversation, Wishlist, Notification
+from .pagination import InvalidCursor, keyset_page, keyset_result, parse_limit
+from .serializers import (
+    CategoryOut, ComparisonOut, ConversationOut, FeedbackOut, MessageOut, NotificationOut, ProductGroupOut,
+    ProductOut, RecommendationOut, RetailerOut, SuggestionOut, UserHistoryOut, UserOut, WishlistOut, output_json, product_rows,
+    products_from_rows, search_results
+)
+from .cache import cache, cached
+from .conditional import conditional, current_version
+from .database import read_only
+from .sessions import identity, login_user, logout_user
+from .export import EXPORT_FORMATS, export_query, stream_products
+from .history import history
+from .importer import ImportEncodingError, ImportFormatError, ImportTooLargeError, detect_format, import_products
+from . import analytics, compare, facets, messaging, metrics, push, recommend, search, snapshot, suggest
 import os
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from werkzeug.security import check_password_hash
 
 main = Blueprint('main', __name__)
 api = Api(main)
+api.representation('application/json')(output_json)
 
 admin_emails = {
     os.getenv('ADMIN_EMAIL_1'),
@@ -80,34 +96,34 @@ class Login(Resource):
         if user and user.verify_password(data['password']):
             if user.is_retailer and not user.retailer.approved:
                 return {'error': 'Retailer account not approved yet. Please wait for admin approval.'}, 403
-            
-            session['user_id'] = user.id
-            session['is_retailer'] = user.is_retailer
-            session['is_admin'] = user.is_admin
+
+            # Upgrade hashes made with an older BCRYPT_ROUNDS while we have the password
+            if user.password_needs_rehash():
+                user.password = data['password']
+                db.session.commit()
+
+            login_user(session, user)
             return user.to_dict(), 200
 
         return {'error': 'Invalid credentials'}, 401
 
 class Logout(Resource):
     def delete(self):
-        session.pop('user_id', None)
-        session.pop('is_retailer', None)
-        session.pop('is_admin', None)
+        logout_user(session)
         return '', 204
 
 class CheckSession(Resource):
     def get(self):
-        user_id = session.get('user_id')
-        if user_id:
-            user = User.query.get(user_id)
-            if user:
-                return {
-                    'id': user.id,
-                    'username': user.username,
-                    'is_retailer': user.is_retailer,
-                    'is_admin': user.is_admin
-                }, 200
-        return {}, 204
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {}, 204
+
+        return {
+            'id': user_id,
+            'username': identity['username'],
+            'is_retailer': identity['is_retailer'],
+            'is_admin': identity['is_admin']
+        }, 200
 
 class ClearSession(Resource):
     def delete(self):
@@ -141,7 +157,7 @@ class UserResource(Resource):
             )
 
         users = query.all()
-        return [user.to_dict() for user in users], 200
+        return [UserOut.from_model(user) for user in users], 200
 
     def put(self, user_id):
         data = request.get_json()
@@ -169,16 +185,23 @@ class UserResource(Resource):
         return {'error': 'User not found'}, 404
 
 
+def _normalize_search(view_args):
+    # Searches that tokenize the same return the same results
+    view_args['query'] = ' '.join(search.tokenize(view_args['query']))
+    return view_args
+
 # Retailer Resource
 class RetailerResource(Resource):
+    @read_only
+    @cached('retailers')
     def get(self, retailer_id=None):
         if retailer_id:
             retailer = Retailer.query.get(retailer_id)
             if retailer:
-                return retailer.to_dict(), 200
+                return RetailerOut.from_model(retailer), 200
             return {'error': 'Retailer not found'}, 404
         retailers = Retailer.query.all()
-        return [retailer.to_dict() for retailer in retailers], 200
+        return [RetailerOut.from_model(retailer) for retailer in retailers], 200
 
     def post(self):
         data = request.get_json()
@@ -189,52 +212,98 @@ class RetailerResource(Resource):
         )
         db.session.add(new_retailer)
         db.session.commit()
+        cache.invalidate('retailers', 'products')
         return new_retailer.to_dict(), 201
 
 # Category Resource
 class CategoryResource(Resource):
+    @read_only
+    @conditional('categories', 'public, max-age=300')
+    @cached('categories')
     def get(self, category_id=None):
         if category_id:
             category = Category.query.get(category_id)
             if category:
-                return category.to_dict(), 200
+                return CategoryOut.from_model(category), 200
             return {'error': 'Category not found'}, 404
         categories = Category.query.all()
-        return [category.to_dict() for category in categories], 200
+        return [CategoryOut.from_model(category) for category in categories], 200
 
     def post(self):
         data = request.get_json()
         new_category = Category(name=data['name'])
         db.session.add(new_category)
         db.session.commit()
+        cache.invalidate('categories')
         return new_category.to_dict(), 201
 
 # Product Resource
+PRODUCT_SORT_KEYS = {
+    'newest': [Product.created_at, Product.id],
+    'value': [Product.value_score, Product.id],
+}
+
 class ProductResource(Resource):
+    @read_only
+    @conditional('products', 'public, no-cache')
+    @cached('products')
     def get(self, product_id=None):
         if product_id:
             product = Product.query.get(product_id)
             if product:
-                # Include retailer details including WhatsApp number
-                product_data = product.to_dict()
-                product_data['retailer_whatsapp'] = product.retailer.whatsapp_number if product.retailer else None
-                return product_data, 200
+                # Includes retailer details including WhatsApp number
+                return ProductOut.from_model(product), 200
             return {'error': 'Product not found'}, 404
-        products = Product.query.all()
-        products_data = []
-        for product in products:
-            product_data = product.to_dict()
-            product_data['retailer_whatsapp'] = product.retailer.whatsapp_number if product.retailer else None
-            products_data.append(product_data)
-        return products_data, 200
+        # Keyset pagination, newest first by default or best value first with
+        # ?sort=value (plus the ratio sorts, see _ratio_page). The retailer is
+        # joined in the same query so each page is a single bounded SELECT of
+        # plain rows.
+        sort = request.args.get('sort', 'newest')
+        sort_keys = PRODUCT_SORT_KEYS.get(sort)
+        if sort_keys is None and sort not in snapshot.RATIO_SORTS:
+            return {'error': 'Invalid sort'}, 400
+        try:
+            filters = facets.parse_filters(request.args)
+        except facets.InvalidFilter as e:
+            return {'error': f'Invalid {e}'}, 400
+
+        try:
+            if sort_keys is None:
+                rows, next_cursor = self._ratio_page(sort, filters, parse_limit(), request.args.get('cursor'))
+            else:
+                rows, next_cursor = keyset_page(
+                    product_rows().where(*facets.conditions(filters)),
+                    sort_keys,
+                    parse_limit(),
+                    cursor=request.args.get('cursor')
+                )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
+        body = {'products': products_from_rows(rows), 'next_cursor': next_cursor}
+        if request.args.get('facets') == 'true':
+            body['facets'] = facets.facets_from_rows(db.session.execute(facets.facet_counts_query(filters)).all())
+        return body, 200
+
+    def _ratio_page(self, sort, filters, limit, cursor):
+        # No index orders by these ratios: rank in the shared catalog
+        # snapshot while it is current, otherwise sort in SQL
+        catalog = snapshot.catalog.current(*current_version('products'))
+        if catalog is not None:
+            ids, next_cursor = catalog.rank(sort, filters, limit, cursor)
+            rows = db.session.execute(product_rows().where(Product.id.in_(ids))).all()
+            return snapshot.ordered_rows(rows, ids), next_cursor
+        statement, columns = snapshot.ratio_page_query(sort, filters, limit, cursor)
+        rows, next_cursor = keyset_result(db.session.execute(statement).all(), columns, limit)
+        return [row[:-1] for row in rows], next_cursor
 
     def post(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_retailer:
+        retailer_id = identity.get('retailer_id')
+        if not identity.get('is_retailer') or not retailer_id:
             return {'error': 'Only retailers can post products'}, 403
 
         data = request.get_json()
@@ -244,22 +313,22 @@ class ProductResource(Resource):
             description=data['description'],
             delivery_cost=data['delivery_cost'],
             payment_mode=data['payment_mode'],
-            retailer_id=user.retailer.id,
+            retailer_id=retailer_id,
             category_id=data['category_id'],
             image_url=data['image_url']
         )
         db.session.add(new_product)
         db.session.commit()
+        cache.invalidate('products')
         return new_product.to_dict(), 201
 
     def put(self, product_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
         product = Product.query.get(product_id)
-        if not product or product.retailer_id != user.retailer.id:
+        if not product or product.retailer_id != identity.get('retailer_id'):
             return {'error': 'Only the retailer who posted the product can update it'}, 403
 
         data = request.get_json()
@@ -271,36 +340,175 @@ class ProductResource(Resource):
         product.category_id = data['category_id']
         product.image_url = data['image_url']
         db.session.commit()
+        cache.invalidate('products')
         return product.to_dict(), 200
 
     def delete(self, product_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
         product = Product.query.get(product_id)
-        if not product or product.retailer_id != user.retailer.id:
+        if not product or product.retailer_id != identity.get('retailer_id'):
             return {'error': 'Only the retailer who posted the product can delete it'}, 403
 
         db.session.delete(product)
         db.session.commit()
+        cache.invalidate('products')
         return {}, 204
 
 
+class ProductImportResource(Resource):
+    def post(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        retailer_id = identity.get('retailer_id')
+        if not identity.get('is_retailer') or not retailer_id:
+            return {'error': 'Only retailers can import products'}, 403
+
+        try:
+            fmt = detect_format(request.mimetype, request.args.get('format'))
+        except ImportFormatError as e:
+            return {'error': str(e)}, 415
+
+        max_bytes = current_app.config.get('IMPORT_MAX_BYTES')
+        if max_bytes and (request.content_length or 0) > max_bytes:
+            return {'error': f'Uploads are limited to {max_bytes} bytes'}, 413
+
+        # Read from the raw stream so the upload is never held in memory whole
+        try:
+            report = import_products(
+                request.stream,
+                fmt,
+                retailer_id,
+                chunk_size=current_app.config.get('IMPORT_CHUNK_SIZE', 500),
+                max_rows=current_app.config.get('IMPORT_MAX_ROWS', 50000),
+                max_bytes=max_bytes or None
+            )
+        except ImportEncodingError as e:
+            return {'error': str(e)}, 400
+        except ImportTooLargeError as e:
+            return {'error': str(e)}, 413
+        return report, 201 if report['inserted'] else 400
+
+
+class ProductExportResource(Resource):
+    def get(self):
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return {'error': 'Invalid format'}, 400
+
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = datetime.fromisoformat(updated_since)
+            except ValueError:
+                return {'error': 'Invalid updated_since'}, 400
+
+        query = export_query(
+            retailer_id=request.args.get('retailer_id', type=int),
+            category_id=request.args.get('category_id', type=int),
+            updated_since=updated_since or None
+        )
+        # Rows are fetched and encoded lazily while the response is sent
+        body = stream_with_context(
+            stream_products(query, fmt, batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+        )
+        return Response(body, mimetype=EXPORT_FORMATS[fmt], headers={
+            'Content-Disposition': f'attachment; filename=products.{fmt}',
+            'Cache-Control': 'no-store',
+        })
+
+
+class CompareResource(Resource):
+    @read_only
+    @conditional('products', 'public, no-cache')
+    @cached('products', 'retailers')
+    def get(self, product_id=None):
+        # /compare/<product_id> or /compare?name= returns every retailer's
+        # offer for that item; plain /compare lists one row per item with its
+        # cheapest offer.
+        if product_id is not None:
+            canonical_key = db.session.query(Product.canonical_key).filter_by(id=product_id).scalar()
+            if canonical_key is None:
+                return {'error': 'Product not found'}, 404
+        elif request.args.get('name'):
+            canonical_key = Product.compute_canonical_key(request.args['name'])
+        else:
+            return self._groups()
+
+        rows = db.session.execute(compare.offers_query(canonical_key)).all()
+        if not rows:
+            return {'error': 'No offers found'}, 404
+        return ComparisonOut.from_rows(rows), 200
+
+    def _groups(self):
+        min_offers = request.args.get('min_offers', 1, type=int)
+        query = compare.groups_query(
+            category_id=request.args.get('category_id', type=int),
+            min_offers=max(1, min_offers)
+        )
+        try:
+            rows, next_cursor = keyset_page(
+                query,
+                [query.selected_columns.canonical_key],
+                parse_limit(),
+                cursor=request.args.get('cursor'),
+                descending=False
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
+        return {'groups': [ProductGroupOut.from_row(row) for row in rows], 'next_cursor': next_cursor}, 200
+
+
+class SimilarProductsResource(Resource):
+    @read_only
+    @cached('products', 'recommendations')
+    def get(self, product_id):
+        # Precomputed by app/recommend.py: one primary-key range read
+        if not db.session.query(Product.id).filter_by(id=product_id).scalar():
+            return {'error': 'Product not found'}, 404
+        limit = parse_limit(default=10, maximum=current_app.config['RECOMMEND_NEIGHBORS'])
+        rows = db.session.execute(recommend.similar_query(product_id, limit)).all()
+        return {'product_id': product_id, 'similar': [RecommendationOut.from_row(row) for row in rows]}, 200
+
+
+class RecommendationsResource(Resource):
+    @read_only
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        # Neighbors of the user's strongest signals; shoppers with none yet
+        # get the best-value products instead
+        limit = parse_limit(default=10, maximum=50)
+        rows = db.session.execute(recommend.for_user_query(user_id, limit)).all()
+        if rows:
+            return {'personalized': True, 'recommendations': [RecommendationOut.from_row(row) for row in rows]}, 200
+        best_value = [key.desc() for key in PRODUCT_SORT_KEYS['value']]
+        rows = db.session.execute(
+            product_rows().add_columns(Product.value_score).order_by(*best_value).limit(limit)
+        ).all()
+        return {'personalized': False, 'recommendations': [RecommendationOut.from_row(row) for row in rows]}, 200
+
+
 # Feedback Resource
 class FeedbackResource(Resource):
     def get(self, feedback_id=None):
         if feedback_id:
             feedback = Feedback.query.get(feedback_id)
             if feedback:
-                return feedback.to_dict(), 200
+                return FeedbackOut.from_model(feedback), 200
             return {'error': 'Feedback not found'}, 404
         feedbacks = Feedback.query.all()
-        return [feedback.to_dict() for feedback in feedbacks], 200
+        return [FeedbackOut.from_model(feedback) for feedback in feedbacks], 200
 
     def post(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
@@ -317,21 +525,23 @@ class FeedbackResource(Resource):
 # Wishlist Resource
 class WishlistResource(Resource):
     def get(self, wishlist_id=None):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
         if wishlist_id:
             wishlist = Wishlist.query.get(wishlist_id)
             if wishlist and wishlist.user_id == user_id:
-                return wishlist.to_dict(), 200
+                return WishlistOut.from_model(wishlist), 200
             return {'error': 'Wishlist item not found'}, 404
-        wishlists = Wishlist.query.filter_by(user_id=user_id).all()
-        return [wishlist.to_dict() for wishlist in wishlists], 200
+        wishlists = Wishlist.query.options(
+            joinedload(Wishlist.product).joinedload(Product.retailer)
+        ).filter_by(user_id=user_id).all()
+        return [WishlistOut.from_model(wishlist) for wishlist in wishlists], 200
 
 
     def post(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
@@ -340,20 +550,27 @@ class WishlistResource(Resource):
         if not product_id:
             return {'error': 'Product ID is required'}, 400
 
-        wishlist_item = Wishlist.query.filter_by(user_id=user_id, product_id=product_id).first()
-        if wishlist_item:
-            return {'error': 'Product is already in the wishlist'}, 400
+        # Checked up front: SQLite doesn't enforce the foreign key, so a
+        # missing product would otherwise be saved as an orphan row
+        if not db.session.get(Product, product_id):
+            return {'error': 'Product not found'}, 404
 
         new_wishlist_item = Wishlist(
             user_id=user_id,
             product_id=product_id
         )
         db.session.add(new_wishlist_item)
-        db.session.commit()
+        try:
+            # uq_wishlists_user_product rejects duplicates, including two
+            # concurrent adds of the same product
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Product is already in the wishlist'}, 400
         return new_wishlist_item.to_dict(), 201
     
     def delete(self, wishlist_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
@@ -367,76 +584,180 @@ class WishlistResource(Resource):
 
 
 # Message Resource
+MESSAGE_SORT_KEYS = [Message.sent_at, Message.id]
+CONVERSATION_SORT_KEYS = [Conversation.last_message_at, Conversation.id]
+
 class MessageResource(Resource):
+    @conditional('messages', 'private, no-cache', per_user=True)
     def get(self, message_id=None):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
         if message_id:
             message = Message.query.get(message_id)
             if message and (message.sender_id == user_id or message.receiver_id == user_id):
-                return message.to_dict(), 200
+                return MessageOut.from_model(message), 200
             return {'error': 'Message not found or unauthorized access'}, 404
 
-        messages = Message.query.filter(
-            (Message.sender_id == user_id) | (Message.receiver_id == user_id)
-        ).all()
+        try:
+            messages, next_cursor = keyset_page(
+                Message.query.filter((Message.sender_id == user_id) | (Message.receiver_id == user_id)),
+                MESSAGE_SORT_KEYS,
+                parse_limit(),
+                cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
 
-        return [message.to_dict() for message in messages], 200
+        return {
+            'messages': [MessageOut.from_model(message) for message in messages],
+            'next_cursor': next_cursor
+        }, 200
 
     def post(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
         data = request.get_json()
+        conversation_id = data.get('conversation_id')
+        if conversation_id:
+            # Reply within an existing thread
+            conversation = db.session.get(Conversation, conversation_id)
+            if not conversation or not messaging.is_participant(conversation, user_id, identity.get('retailer_id')):
+                return {'error': 'Conversation not found'}, 404
+            receiver_id = messaging.other_participant(conversation, user_id)
+        else:
+            receiver_id = data.get('receiver_id')
+            if not receiver_id:
+                return {'error': 'receiver_id or conversation_id is required'}, 400
+            conversation = messaging.conversation_for(
+                user_id, receiver_id, data.get('product_id'), data.get('retailer_id')
+            )
+
+        now = datetime.utcnow()
         new_message = Message(
             sender_id=user_id,
-            receiver_id=data['receiver_id'],
-            product_id=data.get('product_id'),
-            retailer_id=data.get('retailer_id'),
-            content=data['content']
+            receiver_id=receiver_id,
+            product_id=conversation.product_id if conversation else data.get('product_id'),
+            retailer_id=conversation.retailer_id if conversation else data.get('retailer_id'),
+            conversation=conversation,
+            content=data['content'],
+            sent_at=now
         )
+        if conversation:
+            conversation.last_message_at = now
         db.session.add(new_message)
         db.session.commit()
         return new_message.to_dict(), 201
 
 
+class ConversationResource(Resource):
+    @conditional('messages', 'private, no-cache', per_user=True)
+    def get(self, conversation_id=None):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        retailer_id = identity.get('retailer_id')
+        if conversation_id is None:
+            # Inbox: most recently active threads first
+            try:
+                rows, next_cursor = keyset_page(
+                    messaging.conversation_rows(user_id, retailer_id),
+                    CONVERSATION_SORT_KEYS,
+                    parse_limit(),
+                    cursor=request.args.get('cursor')
+                )
+            except InvalidCursor:
+                return {'error': 'Invalid cursor'}, 400
+            return {
+                'conversations': [ConversationOut.from_row(row) for row in rows],
+                'next_cursor': next_cursor
+            }, 200
+
+        conversation = db.session.get(Conversation, conversation_id)
+        if not conversation or not messaging.is_participant(conversation, user_id, retailer_id):
+            return {'error': 'Conversation not found'}, 404
+
+        # Thread history, newest first; follow next_cursor for older messages
+        try:
+            messages, next_cursor = keyset_page(
+                Message.query.filter_by(conversation_id=conversation.id),
+                MESSAGE_SORT_KEYS,
+                parse_limit(),
+                cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+        return {
+            'conversation': conversation.to_dict(),
+            'messages': [MessageOut.from_model(message) for message in messages],
+            'next_cursor': next_cursor
+        }, 200
+
+
+class ConversationReadResource(Resource):
+    def post(self, conversation_id):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        conversation = db.session.get(Conversation, conversation_id)
+        if not conversation or not messaging.is_participant(conversation, user_id, identity.get('retailer_id')):
+            return {'error': 'Conversation not found'}, 404
+
+        marked = messaging.mark_read(conversation.id, user_id)
+        db.session.commit()
+        return {'marked_read': marked}, 200
+
+
 # Dashboard for Admin
 class AdminDashboard(Resource):
+    @read_only
     def get(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_admin:
+        if not identity.get('is_admin'):
             return {'error': 'Only admins can access this'}, 403
 
-        retailers = Retailer.query.filter_by(approved=False).all()
-        users = User.query.all()
-        products = Product.query.all()
-        analytics = {
-            'total_users': len(users),
-            'total_retailers': len(retailers),
-            'total_products': len(products)
-        }
+        # Totals come from the counters table; the lists are only the first
+        # page of each, continued through the /admin/* sub-resources.
+        totals = analytics.counters('users', 'products', 'retailers.pending', 'retailers.approved')
+        limit = parse_limit()
+        retailers, retailers_cursor = keyset_page(
+            Retailer.query.filter_by(approved=False), [Retailer.id], limit
+        )
+        users, users_cursor = keyset_page(User.query, [User.created_at, User.id], limit)
+        products, products_cursor = keyset_page(product_rows(), PRODUCT_SORT_KEYS['newest'], limit)
 
         return {
-            'retailers': [retailer.to_dict() for retailer in retailers],
-            'users': [user.to_dict() for user in users],
-            'products': [product.to_dict() for product in products],
-            'analytics': analytics
+            'retailers': [RetailerOut.from_model(retailer) for retailer in retailers],
+            'users': [UserOut.from_model(user) for user in users],
+            'products': products_from_rows(products),
+            'analytics': {
+                'total_users': totals['users'],
+                'total_retailers': totals['retailers.pending'],
+                'total_products': totals['products'],
+                'pending_retailers': totals['retailers.pending'],
+                'approved_retailers': totals['retailers.approved']
+            },
+            'next_cursors': {
+                'retailers': retailers_cursor,
+                'users': users_cursor,
+                'products': products_cursor
+            }
         }, 200
 
     def post(self, retailer_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_admin:
+        if not identity.get('is_admin'):
             return {'error': 'Only admins can access this'}, 403
 
         retailer = Retailer.query.get(retailer_id)
@@ -445,56 +766,155 @@ class AdminDashboard(Resource):
 
         retailer.approved = True
         db.session.commit()
+        cache.invalidate('retailers')
         return retailer.to_dict(), 200
 
+class AdminAnalyticsResource(Resource):
+    @read_only
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        if not identity.get('is_admin'):
+            return {'error': 'Only admins can access this'}, 403
+
+        try:
+            days = max(1, min(int(request.args.get('days', 30)), 365))
+        except ValueError:
+            return {'error': 'days must be an integer'}, 400
+
+        return {
+            'users_by_role': analytics.users_by_role(),
+            'retailers_by_status': analytics.retailers_by_status(),
+            'products_by_category': analytics.products_by_category(),
+            'products_by_retailer': analytics.products_by_retailer(),
+            'signups_per_day': analytics.signups_per_day(days)
+        }, 200
+
+class AdminUsersResource(Resource):
+    @read_only
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        if not identity.get('is_admin'):
+            return {'error': 'Only admins can access this'}, 403
+
+        try:
+            users, next_cursor = keyset_page(
+                User.query, [User.created_at, User.id], parse_limit(), cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
+        return {'users': [UserOut.from_model(user) for user in users], 'next_cursor': next_cursor}, 200
+
+class AdminProductsResource(Resource):
+    @read_only
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        if not identity.get('is_admin'):
+            return {'error': 'Only admins can access this'}, 403
+
+        try:
+            rows, next_cursor = keyset_page(
+                product_rows(), PRODUCT_SORT_KEYS['newest'], parse_limit(), cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
+        return {'products': products_from_rows(rows), 'next_cursor': next_cursor}, 200
+
+class AdminRetailersResource(Resource):
+    @read_only
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        if not identity.get('is_admin'):
+            return {'error': 'Only admins can access this'}, 403
+
+        query = Retailer.query
+        status = request.args.get('status')
+        if status == 'pending':
+            query = query.filter_by(approved=False)
+        elif status == 'approved':
+            query = query.filter_by(approved=True)
+        elif status:
+            return {'error': 'status must be pending or approved'}, 400
+
+        try:
+            retailers, next_cursor = keyset_page(
+                query, [Retailer.id], parse_limit(), cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
+        return {'retailers': [RetailerOut.from_model(retailer) for retailer in retailers], 'next_cursor': next_cursor}, 200
+
 # Dashboard for Retailers
 class RetailerDashboard(Resource):
+    @read_only
     def get(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_retailer:
+        retailer_id = identity.get('retailer_id')
+        if not identity.get('is_retailer') or not retailer_id:
             return {'error': 'Only retailers can access this'}, 403
 
-        products = Product.query.filter_by(retailer_id=user.retailer.id).all()
-        messages = Message.query.filter_by(retailer_id=user.retailer.id).all()
+        products = db.session.execute(product_rows().where(Product.retailer_id == retailer_id)).all()
+        messages, messages_cursor = keyset_page(
+            Message.query.filter_by(retailer_id=retailer_id), MESSAGE_SORT_KEYS, parse_limit()
+        )
 
         return {
-            'products': [product.to_dict() for product in products],
-            'messages': [message.to_dict() for message in messages]
+            'products': products_from_rows(products),
+            'messages': [MessageOut.from_model(message) for message in messages],
+            'next_cursors': {'messages': messages_cursor}
         }, 200
 
 # Dashboard for Users
 class UserDashboard(Resource):
+    @read_only
     def get(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
         user = User.query.get(user_id)
-        wishlists = Wishlist.query.filter_by(user_id=user.id).all()
+        wishlists = Wishlist.query.options(
+            joinedload(Wishlist.product).joinedload(Product.retailer)
+        ).filter_by(user_id=user.id).all()
         feedbacks = Feedback.query.filter_by(user_id=user.id).all()
-        messages = Message.query.filter_by(sender_id=user.id).all()
+        messages, messages_cursor = keyset_page(
+            Message.query.filter_by(sender_id=user.id), MESSAGE_SORT_KEYS, parse_limit()
+        )
         search_history = UserHistory.query.filter_by(user_id=user.id).all()
 
         return {
-            'user': user.to_dict(),
-            'wishlists': [wishlist.to_dict() for wishlist in wishlists],
-            'feedbacks': [feedback.to_dict() for feedback in feedbacks],
-            'messages': [message.to_dict() for message in messages],
-            'search_history': [history.to_dict() for history in search_history]
+            'user': UserOut.from_model(user),
+            'wishlists': [WishlistOut.from_model(wishlist) for wishlist in wishlists],
+            'feedbacks': [FeedbackOut.from_model(feedback) for feedback in feedbacks],
+            'messages': [MessageOut.from_model(message) for message in messages],
+            'search_history': [UserHistoryOut.from_model(history) for history in search_history],
+            'next_cursors': {'messages': messages_cursor}
         }, 200
 
 class ApproveRetailer(Resource):
     def post(self, retailer_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_admin:
+        if not identity.get('is_admin'):
             return {'error': 'Only admins can access this'}, 403
 
         retailer = Retailer.query.get(retailer_id)
@@ -503,18 +923,41 @@ class ApproveRetailer(Resource):
 
         retailer.approved = True
         db.session.commit()
+        cache.invalidate('retailers')
         return retailer.to_dict(), 200
 
+# Server-Sent Events for new messages and notifications. Under gunicorn each
+# open stream holds a worker thread, so only PUSH_MAX_THREAD_STREAMS may be
+# open per process; app.asgi serves the same stream from an event loop.
+class EventStreamResource(Resource):
+    def get(self):
+        topics = push.topics_for(identity)
+        if not topics:
+            return {'error': 'Unauthorized'}, 401
+
+        try:
+            last_event_id = push.parse_last_event_id(
+                request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+            )
+        except ValueError:
+            return {'error': 'Invalid Last-Event-ID'}, 400
+
+        try:
+            return push.stream_response(topics, last_event_id)
+        except push.StreamLimitReached:
+            return {'error': 'Too many open event streams, try again later'}, 503, {'Retry-After': '30'}
+
 # Notification Resource
 class NotificationResource(Resource):
+    @conditional('notifications', 'private, no-cache')
     def get(self, notification_id=None):
         if notification_id:
             notification = Notification.query.get(notification_id)
             if notification:
-                return notification.to_dict(), 200
+                return NotificationOut.from_model(notification), 200
             return {'error': 'Notification not found'}, 404
         notifications = Notification.query.all()
-        return [notification.to_dict() for notification in notifications], 200
+        return [NotificationOut.from_model(notification) for notification in notifications], 200
 
     def post(self):
         data = request.get_json()
@@ -528,12 +971,11 @@ class NotificationResource(Resource):
     
 class RejectRetailer(Resource):
     def post(self, retailer_id):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_admin:
+        if not identity.get('is_admin'):
             return {'error': 'Only admins can access this'}, 403
 
         retailer = Retailer.query.get(retailer_id)
@@ -543,44 +985,56 @@ class RejectRetailer(Resource):
         
         db.session.delete(retailer)
         db.session.commit()
+        cache.invalidate('retailers', 'products')
 
         return {'message': 'Retailer application rejected'}, 200    
 
 class SearchProductsResource(Resource):
+    @read_only
     def get(self, query):
-        products = Product.query.filter(Product.name.ilike(f"%{query}%")).all()
+        # ?record=true logs the search for the logged-in user, saving the
+        # client a separate POST /search_history. Done before the cache so
+        # cached hits are recorded too.
+        user_id = identity.get('user_id')
+        if user_id and request.args.get('record') == 'true':
+            history.record(user_id, query)
+        return self._search(query=query)
+
+    @cached('products', normalize=_normalize_search)
+    def _search(self, query):
+        # Best value first straight from the value_score index; top-k pages
+        # continue with ?cursor=.
+        cursor = request.args.get('cursor')
+        try:
+            products, next_cursor = keyset_page(
+                search.match(Product.query, query),
+                PRODUCT_SORT_KEYS['value'],
+                parse_limit(),
+                cursor=cursor
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+
         if not products:
             return {'error': 'No products found'}, 404
-        
-        products_with_ratios = []
-        for product in products:
-            try:
-                cb_ratio = product.calculate_cost_benefit() or 0 
-                mb_ratio = product.calculate_marginal_benefit() or 0  
-            except Exception as e:
-                return {'error': f'Error calculating ratios: {str(e)}'}, 500
-
-            products_with_ratios.append({
-                'product_id': product.id,
-                'name': product.name,
-                'price': product.price,
-                'description': product.description,
-                'cost_benefit_ratio': cb_ratio,
-                'marginal_benefit_ratio': mb_ratio,
-            })
-        
-        
-        products_with_ratios.sort(key=lambda p: (p['cost_benefit_ratio'] + p['marginal_benefit_ratio']), reverse=True)
-        
-        
-        if products_with_ratios:
-            products_with_ratios[0]['recommended'] = True
-        
-        return {'products': products_with_ratios}, 200
+
+        return {'products': search_results(products, first_page=not cursor), 'next_cursor': next_cursor}, 200
+
+class SuggestResource(Resource):
+    def get(self):
+        # Answered from the in-process prefix index; no query per keystroke
+        limit = parse_limit(default=8, maximum=20)
+        if not suggest.index.ensure_fresh():
+            # Still building in the background; don't let anyone cache this
+            return {'suggestions': []}, 200, {'Cache-Control': 'no-store'}
+        results = suggest.index.suggest(request.args.get('q', ''), limit)
+        return {
+            'suggestions': [SuggestionOut(text, kind, ident) for text, kind, ident in results]
+        }, 200, {'Cache-Control': 'public, max-age=60'}
 
 class SearchHistoryResource(Resource):
     def post(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
@@ -590,32 +1044,77 @@ class SearchHistoryResource(Resource):
         if not search_term:
             return {'error': 'Search term is required'}, 400
 
-        new_history = UserHistory(user_id=user_id, search_term=search_term)
-        db.session.add(new_history)
-        db.session.commit()
-
-        return new_history.to_dict(), 201
+        # Written behind by the buffer; repeats within the dedupe window are
+        # dropped. The response keeps the row's shape, with no id yet
+        entry = history.record(user_id, search_term)
+        searched_at = entry['searched_at'] if entry else datetime.utcnow()
+        return {
+            'id': None,
+            'user_id': user_id,
+            'search_term': search_term.strip(),
+            'searched_at': searched_at.isoformat()
+        }, 201
 
     def get(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
+        # Read-your-writes within this process: the user's searches queued
+        # here are written first. Ones queued by another worker appear after
+        # its next flush, within HISTORY_FLUSH_INTERVAL seconds
+        if history.has_pending(user_id):
+            history.flush()
+
         search_history = UserHistory.query.filter_by(user_id=user_id).order_by(UserHistory.searched_at.desc()).all()
-        return [history.to_dict() for history in search_history], 200
+        return [UserHistoryOut.from_model(history) for history in search_history], 200
+
+class CacheStatsResource(Resource):
+    def get(self):
+        user_id = identity.get('user_id')
+        if not user_id:
+            return {'error': 'Unauthorized'}, 401
+
+        if not identity.get('is_admin'):
+            return {'error': 'Only admins can access this'}, 403
+
+        return cache.stats(), 200
+
+class MetricsResource(Resource):
+    def get(self):
+        # Scrapers authenticate with METRICS_TOKEN; admins can use their session
+        token = current_app.config.get('METRICS_TOKEN')
+        if not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+            if not identity.get('user_id'):
+                return {'error': 'Unauthorized'}, 401
+            if not identity.get('is_admin'):
+                return {'error': 'Only admins can access this'}, 403
+
+        return Response(metrics.instrumentation.render(), mimetype='text/plain; version=0.0.4')
 
 class RetailerMessagesResource(Resource):
     def get(self):
-        user_id = session.get('user_id')
+        user_id = identity.get('user_id')
         if not user_id:
             return {'error': 'Unauthorized'}, 401
 
-        user = User.query.get(user_id)
-        if not user.is_retailer:
+        retailer_id = identity.get('retailer_id')
+        if not identity.get('is_retailer') or not retailer_id:
             return {'error': 'Only retailers can access this'}, 403
 
-        messages = Message.query.filter_by(retailer_id=user.retailer.id).all()
-        return [message.to_dict() for message in messages], 200
+        try:
+            messages, next_cursor = keyset_page(
+                Message.query.filter_by(retailer_id=retailer_id),
+                MESSAGE_SORT_KEYS,
+                parse_limit(),
+                cursor=request.args.get('cursor')
+            )
+        except InvalidCursor:
+            return {'error': 'Invalid cursor'}, 400
+        return {
+            'messages': [MessageOut.from_model(message) for message in messages],
+            'next_cursor': next_cursor
+        }, 200
 
 
 # Register resources with the API
@@ -628,18 +1127,33 @@ api.add_resource(UserResource, '/users', '/users/<int:user_id>')
 api.add_resource(RetailerResource, '/retailers', '/retailers/<int:retailer_id>')
 api.add_resource(CategoryResource, '/categories', '/categories/<int:category_id>')
 api.add_resource(ProductResource, '/products', '/products/<int:product_id>')
+api.add_resource(ProductImportResource, '/products/import')
+api.add_resource(ProductExportResource, '/products/export')
+api.add_resource(SimilarProductsResource, '/products/<int:product_id>/similar')
+api.add_resource(RecommendationsResource, '/recommendations')
+api.add_resource(CompareResource, '/compare', '/compare/<int:product_id>')
 api.add_resource(FeedbackResource, '/feedback', '/feedback/<int:feedback_id>')
 api.add_resource(WishlistResource, '/wishlist', '/wishlist/<int:wishlist_id>')
 api.add_resource(MessageResource, '/messages', '/messages/<int:message_id>')
+api.add_resource(ConversationResource, '/conversations', '/conversations/<int:conversation_id>')
+api.add_resource(ConversationReadResource, '/conversations/<int:conversation_id>/read')
 api.add_resource(AdminDashboard, '/admin_dashboard')
+api.add_resource(AdminAnalyticsResource, '/admin/analytics')
+api.add_resource(AdminUsersResource, '/admin/users')
+api.add_resource(AdminProductsResource, '/admin/products')
+api.add_resource(AdminRetailersResource, '/admin/retailers')
 api.add_resource(RetailerDashboard, '/retailer_dashboard')
 api.add_resource(UserDashboard, '/user_dashboard')
 api.add_resource(ApproveRetailer, '/approve_retailer/<int:retailer_id>')
 api.add_resource(NotificationResource, '/notifications')
+api.add_resource(EventStreamResource, '/events')
 api.add_resource(RejectRetailer, '/reject_retailer/<int:retailer_id>')
 api.add_resource(SearchProductsResource, '/search/<string:query>')
+api.add_resource(SuggestResource, '/suggest')
 api.add_resource(SearchHistoryResource, '/search_history')
 api.add_resource(RetailerMessagesResource, '/retailer_messages')
+api.add_resource(CacheStatsResource, '/cache_stats')
+api.add_resource(MetricsResource, '/metrics')
 
 
 
@@ -0,0 +1,165 @@
+import logging
+import re
+
+import click
+from sqlalchemy import DDL, and_, column, event, false, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+
+from .models import db, Product
+
+logger = logging.getLogger(__name__)
+
+# Product search has one index per backend:
+#   * Postgres: a GIN index over the tsvector of name + description.
+#   * SQLite: an FTS5 virtual table keyed by product id, kept in sync from
+#     the Product mapper events below.
+# Any other database (or a SQLite build without FTS5) falls back to ILIKE.
+
+FTS_TABLE = 'products_fts'
+TS_CONFIG = "'simple'::regconfig"
+MAX_TERMS = 8
+
+PG_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_products_search ON products USING gin "
+    "(to_tsvector('simple'::regconfig, coalesce(name, '') || ' ' || coalesce(description, '')))"
+)
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(name, description, tokenize='unicode61 remove_diacritics 2')"
+)
+
+_fts = table(FTS_TABLE, column('rowid'))
+_fts_available = {}
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _document():
+    # Must stay identical to the expression in ix_products_search so Postgres
+    # can answer the @@ match from the GIN index.
+    name = func.coalesce(Product.name, literal_column("''"))
+    description = func.coalesce(Product.description, literal_column("''"))
+    return func.to_tsvector(
+        literal_column(TS_CONFIG),
+        name.op('||')(literal_column("' '")).op('||')(description)
+    )
+
+
+event.listen(Product.__table__, 'after_create', DDL(PG_INDEX_DDL).execute_if(dialect='postgresql'))
+event.listen(Product.__table__, 'after_create', DDL(FTS_DDL).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'after_drop', DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect='sqlite'))
+
+
+@event.listens_for(Product.__table__, 'after_create')
+@event.listens_for(Product.__table__, 'after_drop')
+def _reset_fts_cache(target, connection, **kw):
+    _fts_available.pop(str(connection.engine.url), None)
+
+
+def fts_available(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+
+    key = str(connection.engine.url)
+    if key not in _fts_available:
+        found = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': FTS_TABLE}
+        ).first()
+        _fts_available[key] = found is not None
+    return _fts_available[key]
+
+
+def ensure_index(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(PG_INDEX_DDL))
+    elif connection.dialect.name == 'sqlite':
+        try:
+            connection.execute(text(FTS_DDL))
+        except OperationalError:
+            logger.warning('SQLite was built without FTS5; product search will use LIKE scans')
+        _fts_available.pop(str(connection.engine.url), None)
+
+
+def rebuild_index(connection):
+    """Recreate the search index from the products table (SQLite only; Postgres maintains its own)."""
+    ensure_index(connection)
+    if not fts_available(connection):
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+        "SELECT id, name, description FROM products"
+    ))
+
+
+def index_products(connection, ids):
+    """Refresh the FTS rows for ``ids`` after writes that bypass the ORM."""
+    if not ids or not fts_available(connection):
+        return
+    params = [{'id': product_id} for product_id in ids]
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), params)
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+        "SELECT id, name, description FROM products WHERE id = :id"
+    ), params)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _index_product(mapper, connection, target):
+    if not fts_available(connection):
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (:id, :name, :description)"),
+        {'id': target.id, 'name': target.name, 'description': target.description}
+    )
+
+
+@event.listens_for(Product, 'after_delete')
+def _unindex_product(mapper, connection, target):
+    if fts_available(connection):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+
+
+def match(query, search, connection=None):
+    """Restrict a Product query to rows matching ``search``.
+
+    Every term is matched as a prefix and all terms must be present. The
+    order is left to the caller: /search lists matches best value first.
+    ``connection`` picks the backend; it defaults to the Flask session's.
+    """
+    terms = tokenize(search)
+    if not terms:
+        return query.filter(false())
+
+    if connection is None:
+        connection = db.session.connection()
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        tsquery = func.to_tsquery(literal_column(TS_CONFIG), ' & '.join(f'{term}:*' for term in terms))
+        return query.filter(_document().op('@@')(tsquery))
+
+    if fts_available(connection):
+        fts_query = ' '.join(f'"{term}"*' for term in terms)
+        return query.join(_fts, _fts.c.rowid == Product.id).filter(
+            text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=fts_query)
+        )
+
+    return query.filter(and_(*[
+        or_(Product.name.ilike(f'%{term}%'), Product.description.ilike(f'%{term}%'))
+        for term in terms
+    ]))
+
+
+def init_app(app):
+    @app.cli.command('search-reindex')
+    def search_reindex():
+        """Create and rebuild the product search index."""
+        with db.engine.begin() as connection:
+            rebuild_index(connection)
+        click.echo('Product search index rebuilt.')
@@ -0,0 +1,331 @@
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import msgspec
+from flask import make_response
+from sqlalchemy import func, select
+
+from . import metrics
+from .models import Product, Retailer
+
+# Typed response shapes. They are encoded straight to JSON bytes by msgspec,
+# which is much cheaper than building dicts and running the stdlib encoder
+# over them for the large catalog and admin responses.
+
+
+class UserOut(msgspec.Struct):
+    id: int
+    username: str
+    email: str
+    is_retailer: Optional[bool]
+    is_admin: Optional[bool]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.email, user.is_retailer, user.is_admin, user.created_at)
+
+
+class RetailerOut(msgspec.Struct):
+    id: int
+    name: str
+    whatsapp_number: Optional[str]
+    approved: Optional[bool]
+    user_id: int
+
+    @classmethod
+    def from_model(cls, retailer):
+        return cls(retailer.id, retailer.name, retailer.whatsapp_number, retailer.approved, retailer.user_id)
+
+
+class CategoryOut(msgspec.Struct):
+    id: int
+    name: str
+
+    @classmethod
+    def from_model(cls, category):
+        return cls(category.id, category.name)
+
+
+class ProductOut(msgspec.Struct):
+    id: int
+    name: str
+    price: float
+    description: Optional[str]
+    delivery_cost: Optional[float]
+    payment_mode: Optional[str]
+    retailer_id: int
+    category_id: int
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    image_url: Optional[str]
+    value_score: float
+    canonical_key: str
+    retailer_name: str
+    retailer_user_id: Optional[int]
+    retailer_whatsapp: Optional[str]
+
+    @classmethod
+    def from_model(cls, product):
+        retailer = product.retailer
+        return cls(
+            product.id,
+            product.name,
+            product.price,
+            product.description,
+            product.delivery_cost,
+            product.payment_mode,
+            product.retailer_id,
+            product.category_id,
+            product.created_at,
+            product.updated_at,
+            product.image_url,
+            product.value_score or 0,
+            product.canonical_key or '',
+            retailer.name if retailer else 'Unknown',
+            retailer.user_id if retailer else None,
+            retailer.whatsapp_number if retailer else None
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows produced by product_rows() are already in field order
+        return cls(*row)
+
+
+class FeedbackOut(msgspec.Struct):
+    id: int
+    user_id: int
+    product_id: int
+    comment: Optional[str]
+    feedback_date: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, feedback):
+        return cls(feedback.id, feedback.user_id, feedback.product_id, feedback.comment, feedback.feedback_date)
+
+
+class UserHistoryOut(msgspec.Struct):
+    id: int
+    user_id: int
+    search_term: Optional[str]
+    searched_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, history):
+        return cls(history.id, history.user_id, history.search_term, history.searched_at)
+
+
+class MessageOut(msgspec.Struct):
+    id: int
+    sender_id: int
+    receiver_id: int
+    product_id: Optional[int]
+    retailer_id: Optional[int]
+    conversation_id: Optional[int]
+    content: str
+    sent_at: Optional[datetime]
+    read_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, message):
+        return cls(
+            message.id,
+            message.sender_id,
+            message.receiver_id,
+            message.product_id,
+            message.retailer_id,
+            message.conversation_id,
+            message.content,
+            message.sent_at,
+            message.read_at
+        )
+
+
+class ConversationOut(msgspec.Struct):
+    id: int
+    user_id: int
+    username: str
+    retailer_id: int
+    retailer_name: str
+    product_id: Optional[int]
+    product_name: Optional[str]
+    last_message_at: datetime
+    last_sender_id: Optional[int]
+    last_message: Optional[str]
+    unread_count: int
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows produced by messaging.conversation_rows() are in field order
+        return cls(*row)
+
+
+class WishlistOut(msgspec.Struct):
+    id: int
+    user_id: int
+    product: ProductOut
+    added_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, wishlist):
+        return cls(wishlist.id, wishlist.user_id, ProductOut.from_model(wishlist.product), wishlist.added_at)
+
+
+class NotificationOut(msgspec.Struct):
+    id: int
+    message: str
+    retailer_id: Optional[int]
+    seen: Optional[bool]
+
+    @classmethod
+    def from_model(cls, notification):
+        return cls(notification.id, notification.message, notification.retailer_id, notification.seen)
+
+
+class OfferOut(msgspec.Struct):
+    product_id: int
+    name: str
+    price: float
+    delivery_cost: Optional[float]
+    total_cost: float
+    value_score: float
+    payment_mode: Optional[str]
+    image_url: Optional[str]
+    retailer_id: int
+    retailer_name: str
+    retailer_whatsapp: Optional[str]
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows produced by the compare queries
+        return cls(*(getattr(row, field) for field in cls.__struct_fields__))
+
+
+class ComparisonOut(msgspec.Struct):
+    canonical_key: str
+    offer_count: int
+    min_total: float
+    max_total: float
+    cheapest_id: int
+    best_value_id: int
+    offers: List[OfferOut]
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Rows are cheapest first and all carry the group's aggregates
+        first = rows[0]
+        return cls(
+            first.canonical_key,
+            first.offer_count,
+            first.min_total,
+            first.max_total,
+            first.product_id,
+            first.best_value_id,
+            [OfferOut.from_row(row) for row in rows]
+        )
+
+
+class ProductGroupOut(msgspec.Struct):
+    canonical_key: str
+    offer_count: int
+    min_total: float
+    max_total: float
+    best_value_id: int
+    best_offer: OfferOut
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.canonical_key, row.offer_count, row.min_total, row.max_total, row.best_value_id, OfferOut.from_row(row))
+
+
+class SuggestionOut(msgspec.Struct):
+    text: str
+    kind: str
+    id: Optional[int]
+
+
+class RecommendationOut(msgspec.Struct):
+    product: ProductOut
+    score: float
+
+    @classmethod
+    def from_row(cls, row):
+        # product_rows() columns followed by the score
+        return cls(ProductOut.from_row(row[:-1]), row[-1])
+
+
+class SearchResultOut(msgspec.Struct, omit_defaults=True):
+    product_id: int
+    name: str
+    price: float
+    description: Optional[str]
+    cost_benefit_ratio: float
+    marginal_benefit_ratio: float
+    recommended: bool = False
+
+
+_PRODUCT_COLUMNS = {
+    'id': Product.id,
+    'name': Product.name,
+    'price': Product.price,
+    'description': Product.description,
+    'delivery_cost': Product.delivery_cost,
+    'payment_mode': Product.payment_mode,
+    'retailer_id': Product.retailer_id,
+    'category_id': Product.category_id,
+    'created_at': Product.created_at,
+    'updated_at': Product.updated_at,
+    'image_url': Product.image_url,
+    'value_score': Product.value_score,
+    'canonical_key': Product.canonical_key,
+    'retailer_name': func.coalesce(Retailer.name, 'Unknown'),
+    'retailer_user_id': Retailer.user_id,
+    'retailer_whatsapp': Retailer.whatsapp_number,
+}
+
+
+def product_rows():
+    """A SELECT returning plain tuples in ProductOut field order, without hydrating ORM objects."""
+    columns = [_PRODUCT_COLUMNS[field].label(field) for field in ProductOut.__struct_fields__]
+    return select(*columns).select_from(Product).outerjoin(Retailer, Product.retailer_id == Retailer.id)
+
+
+def products_from_rows(rows):
+    return [ProductOut.from_row(row) for row in rows]
+
+
+def search_results(products, first_page):
+    results = [
+        SearchResultOut(
+            product_id=product.id,
+            name=product.name,
+            price=product.price,
+            description=product.description,
+            cost_benefit_ratio=product.calculate_cost_benefit(),
+            marginal_benefit_ratio=product.calculate_marginal_benefit(),
+        )
+        for product in products
+    ]
+    # The best value match leads the first page
+    if results and first_page:
+        results[0].recommended = True
+    return results
+
+
+_encoder = msgspec.json.Encoder()
+
+
+def dumps(data):
+    started = time.perf_counter()
+    body = _encoder.encode(data)
+    metrics.record_serialization(time.perf_counter() - started)
+    return body
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful JSON representation backed by msgspec."""
+    resp = make_response(dumps(data) + b'\n', code)
+    resp.headers.extend(headers or {})
+    return resp
@@ -0,0 +1,246 @@
+import secrets
+
+from cachelib import RedisCache, SimpleCache
+from flask import g, session
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import select, update
+from werkzeug.datastructures import CallbackDict
+from werkzeug.local import LocalProxy
+
+from .models import db, Retailer, User
+
+# Session backends:
+#   * 'cookie': Flask's stateless signed cookie. Nothing is stored server side,
+#     so every worker and dyno can read it without any I/O.
+#   * 'kv': the cookie only carries a signed random id and the data lives in
+#     a shared key-value store (Redis, or an in-process SimpleCache stand-in)
+#     with a TTL.
+#   * 'filesystem': the previous Flask-Session file store, kept for
+#     compatibility only.
+#
+# Whatever the backend, the session only holds the user id and the user's
+# session generation. The role flags are loaded from the primary database
+# by each request that checks them (one primary-key lookup), so demoting an
+# admin, deleting a user or rejecting a retailer takes effect on their next
+# request. Logout advances the generation, which revokes every copy of the
+# cookie.
+
+SESSION_IDENTITY_KEYS = ('user_id', 'generation')
+
+
+class KeyValueSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a new random id; the old store key is deleted on save."""
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class KeyValueSessionInterface(SessionInterface):
+    def __init__(self, store, key_prefix, ttl, use_signer=True):
+        self.store = store
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.use_signer = use_signer
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='kv-session', key_derivation='hmac')
+
+    def _sid_from_cookie(self, app, value):
+        if not value:
+            return None
+        if not self.use_signer:
+            return value
+        try:
+            return self._signer(app).unsign(value).decode('utf-8')
+        except BadSignature:
+            return None
+
+    def load(self, app, cookie_value):
+        sid = self._sid_from_cookie(app, cookie_value)
+        if sid is None:
+            return None
+        data = self.store.get(self.key_prefix + sid)
+        return KeyValueSession(data, sid=sid) if data is not None else None
+
+    def open_session(self, app, request):
+        session = self.load(app, request.cookies.get(self.get_cookie_name(app)))
+        if session is None:
+            session = KeyValueSession(sid=secrets.token_urlsafe(32), new=True)
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.store.delete(self.key_prefix + session.previous_sid)
+
+        if not session:
+            if session.modified:
+                self.store.delete(self.key_prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when something changed; reads never touch the store
+        if not session.modified:
+            return
+
+        self.store.set(self.key_prefix + session.sid, dict(session), timeout=self.ttl)
+        value = session.sid
+        if self.use_signer:
+            value = self._signer(app).sign(value.encode('utf-8')).decode('utf-8')
+        response.set_cookie(
+            name,
+            value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+def _kv_store(app):
+    url = app.config.get('SESSION_REDIS_URL')
+    if url:
+        import redis
+        return RedisCache(redis.from_url(url), default_timeout=app.config['SESSION_TTL'])
+    return SimpleCache(threshold=app.config.get('SESSION_KV_THRESHOLD', 10000))
+
+
+def _forget_identity(exc):
+    # g outlives the request when an app context was already pushed (tests,
+    # CLI commands); the next request must load its own identity
+    g.pop('identity', None)
+
+
+def init_app(app):
+    app.teardown_request(_forget_identity)
+
+    app.config.setdefault('SESSION_BACKEND', 'cookie')
+    app.config.setdefault('SESSION_TTL', 7 * 24 * 3600)
+    app.config.setdefault('SESSION_KEY_PREFIX', 'session:')
+    app.config.setdefault('SESSION_USE_SIGNER', True)
+
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    elif backend == 'kv':
+        app.session_interface = KeyValueSessionInterface(
+            _kv_store(app),
+            app.config['SESSION_KEY_PREFIX'],
+            app.config['SESSION_TTL'],
+            use_signer=app.config['SESSION_USE_SIGNER']
+        )
+    elif backend == 'filesystem':
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'filesystem'
+        Session(app)
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND {backend!r}')
+
+
+def session_from_cookie(app, cookie_value):
+    """Decode a session cookie outside a Flask request (e.g. from the ASGI app)."""
+    interface = app.session_interface
+    if isinstance(interface, KeyValueSessionInterface):
+        return interface.load(app, cookie_value) or {}
+    if isinstance(interface, SecureCookieSessionInterface) and cookie_value:
+        serializer = interface.get_signing_serializer(app)
+        try:
+            return serializer.loads(cookie_value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return {}
+    return {}
+
+
+def identity_query(user_id):
+    """The columns identity_from_row() needs for ``user_id``."""
+    return (
+        select(User.id, User.username, User.is_retailer, User.is_admin, User.session_generation,
+               Retailer.id.label('retailer_id'), Retailer.approved)
+        .outerjoin(Retailer, Retailer.user_id == User.id)
+        .where(User.id == user_id)
+    )
+
+
+def identity_from_row(row, generation):
+    """The identity for an identity_query() row, or {} when the session is no longer valid."""
+    if row is None or row.session_generation != generation:
+        return {}
+    if row.is_retailer and not row.approved:
+        # As at login: unapproved and rejected retailers are signed out
+        return {}
+    return {
+        'user_id': row.id,
+        'username': row.username,
+        'is_retailer': bool(row.is_retailer),
+        'is_admin': bool(row.is_admin),
+        'retailer_id': row.retailer_id if row.approved else None,
+    }
+
+
+def load_identity(data):
+    """The identity for decoded session ``data``, read from the database."""
+    user_id = data.get('user_id')
+    if not user_id:
+        return {}
+    # Always the primary, even in @read_only handlers, so a revocation is
+    # never hidden by replica lag
+    row = db.session.execute(identity_query(user_id), bind_arguments={'bind': db.engine}).first()
+    return identity_from_row(row, data.get('generation'))
+
+
+def current_identity():
+    """The signed-in user for this request, loaded on first use."""
+    if 'identity' not in g:
+        g.identity = load_identity(session)
+        if not g.identity and session.get('user_id'):
+            # Revoked, deleted or no longer approved: drop the stale session
+            session.clear()
+    return g.identity
+
+
+# user_id, username, is_retailer, is_admin and retailer_id of the signed-in
+# user, or empty. Handlers authorise from this, never from the session
+identity = LocalProxy(current_identity)
+
+
+def login_user(session, user):
+    # A stored session gets a new id at login, so an id planted in the
+    # browser beforehand is never authenticated (session fixation).
+    if isinstance(session, KeyValueSession):
+        session.regenerate()
+    session['user_id'] = user.id
+    session['generation'] = user.session_generation
+    g.pop('identity', None)
+
+
+def logout_user(session):
+    user_id = session.get('user_id')
+    if user_id:
+        # Copies of the cookie kept elsewhere stop working too
+        db.session.execute(
+            update(User).where(User.id == user_id).values(session_generation=User.session_generation + 1)
+        )
+        db.session.commit()
+    for key in SESSION_IDENTITY_KEYS:
+        session.pop(key, None)
+    g.pop('identity', None)
+    if isinstance(session, KeyValueSession):
+        session.regenerate()
@@ -0,0 +1,355 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import click
+import numpy as np
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import Session
+
+from .compare import total_cost
+from .facets import conditions
+from .models import db, CollectionVersion, Product
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_query
+from .serializers import product_rows
+
+logger = logging.getLogger(__name__)
+
+# Columnar snapshot of the catalog's numbers for sorts no index can answer.
+#
+# /products?sort=cost_benefit and ?sort=marginal_benefit order by ratios of
+# several columns, so SQL would compute and sort the ratio for every row
+# matching the filters. The snapshot keeps id, price, delivery cost,
+# estimated value, marginal benefit, category, retailer and payment mode as
+# NumPy arrays, one .npy file per column alongside the two ratios, and ranks
+# a page with vectorized masks and a partial sort. Only that page's rows are
+# then read from the database.
+#
+# The files are memory-mapped read-only, so every worker on the host shares
+# one copy through the page cache. Each snapshot records the 'products'
+# collection version it was built from (app/conditional.py), together with
+# that version's timestamp so a re-created database never matches an old
+# snapshot. A snapshot is only used while it is current. Otherwise the request falls back to SQL
+# and a rebuild starts in the background. Product commits start one too, but
+# no sooner than CATALOG_SNAPSHOT_MIN_INTERVAL seconds after the last one was
+# published, so a burst of commits costs one rebuild rather than one each.
+# gunicorn's when_ready hook builds the first one in the preloaded master.
+
+COLUMNS = ('id', 'price', 'delivery_cost', 'estimated_value', 'marginal_benefit',
+           'category_id', 'retailer_id', 'payment_mode', 'cost_benefit', 'marginal_benefit_ratio')
+# sort name: (benefit column, snapshot column holding the ratio)
+RATIO_SORTS = {
+    'cost_benefit': (Product.estimated_value, 'cost_benefit'),
+    'marginal_benefit': (Product.marginal_benefit, 'marginal_benefit_ratio'),
+}
+POINTER = 'CURRENT'
+
+
+def version_label(version, updated_at):
+    return f"{version}@{updated_at.isoformat() if updated_at else ''}"
+
+
+def _products_version(connection):
+    row = connection.execute(
+        select(CollectionVersion.version, CollectionVersion.updated_at).where(CollectionVersion.name == 'products')
+    ).first()
+    return version_label(*row) if row else version_label(0, None)
+
+
+def ratio(sort):
+    """SQL for a RATIO_SORTS sort, computed like Product.calculate_cost_benefit()."""
+    total = total_cost()
+    return case((total > 0, func.coalesce(RATIO_SORTS[sort][0], 0) / total), else_=0.0)
+
+
+def ratio_page_query(sort, filters, limit, cursor=None):
+    """The SQL fallback: product_rows() plus a trailing ``sort_score``, keyset-paged."""
+    score = ratio(sort).label('sort_score')
+    query = product_rows().add_columns(score).where(*conditions(filters))
+    return keyset_query(query, [score, Product.id], limit, cursor=cursor), [score, Product.id]
+
+
+def _cursor_values(cursor):
+    score, product_id = decode_cursor(cursor, [Product.price, Product.id])
+    numbers = (int, float)
+    if isinstance(score, bool) or isinstance(product_id, bool) \
+            or not isinstance(score, numbers) or not isinstance(product_id, int):
+        raise InvalidCursor(cursor)
+    return score, product_id
+
+
+class Snapshot:
+    """One mapped generation: read-only column arrays plus the version they came from."""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.version = meta['version']
+        self.payment_modes = meta['payment_modes']
+        self.columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def mask(self, filters):
+        """Vectorized equivalent of facets.conditions(filters); None when nothing is filtered."""
+        columns, masks = self.columns, []
+        for name in ('category_id', 'retailer_id'):
+            if name in filters:
+                masks.append(np.isin(columns[name], filters[name]))
+        if 'payment_mode' in filters:
+            codes = [code for code, mode in enumerate(self.payment_modes) if mode in filters['payment_mode']]
+            masks.append(np.isin(columns['payment_mode'], codes))
+        if 'min_price' in filters:
+            masks.append(columns['price'] >= filters['min_price'])
+        if 'max_price' in filters:
+            masks.append(columns['price'] <= filters['max_price'])
+        if 'max_total' in filters:
+            masks.append(columns['price'] + columns['delivery_cost'] <= filters['max_total'])
+        if 'free_delivery' in filters:
+            free = columns['delivery_cost'] == 0
+            masks.append(free if filters['free_delivery'] else ~free)
+        return np.logical_and.reduce(masks) if masks else None
+
+    def rank(self, sort, filters, limit, cursor=None):
+        """Product ids of one page ordered by (score, id) descending, and the next cursor."""
+        scores, ids = self.columns[RATIO_SORTS[sort][1]], self.columns['id']
+        keep = self.mask(filters)
+        if cursor:
+            after_score, after_id = _cursor_values(cursor)
+            after = (scores < after_score) | ((scores == after_score) & (ids < after_id))
+            keep = after if keep is None else keep & after
+        candidates = np.flatnonzero(keep) if keep is not None else np.arange(len(ids))
+
+        wanted = limit + 1
+        if len(candidates) > wanted:
+            # Everything scoring at least the wanted-th best, ties included
+            kth = np.partition(scores[candidates], len(candidates) - wanted)[len(candidates) - wanted]
+            candidates = candidates[scores[candidates] >= kth]
+        order = np.lexsort((-ids[candidates], -scores[candidates]))[:wanted]
+        page = candidates[order]
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            next_cursor = encode_cursor([float(scores[last]), int(ids[last])])
+        return ids[page].tolist(), next_cursor
+
+
+def _arrays(rows, payment_modes):
+    codes = {mode: code for code, mode in enumerate(payment_modes)}
+    data = [tuple(row[:-1]) for row in rows]
+    numbers = np.array(data, dtype=np.float64).reshape(-1, 7)
+    # NULL costs and benefits count as 0, as in Product.calculate_cost_benefit()
+    numbers = np.nan_to_num(numbers, nan=0.0)
+    total = numbers[:, 1] + numbers[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost_benefit = np.where(total > 0, numbers[:, 3] / total, 0.0)
+        marginal_benefit_ratio = np.where(total > 0, numbers[:, 4] / total, 0.0)
+    return {
+        'id': numbers[:, 0].astype(np.int64),
+        'price': numbers[:, 1],
+        'delivery_cost': numbers[:, 2],
+        'estimated_value': numbers[:, 3],
+        'marginal_benefit': numbers[:, 4],
+        'category_id': numbers[:, 5].astype(np.int64),
+        'retailer_id': numbers[:, 6].astype(np.int64),
+        'payment_mode': np.array([codes.get(row[-1], -1) for row in rows], dtype=np.int32),
+        'cost_benefit': cost_benefit,
+        'marginal_benefit_ratio': marginal_benefit_ratio,
+    }
+
+
+class CatalogSnapshot:
+    def __init__(self, directory=None):
+        self.app = None
+        self.enabled = True
+        self.directory = directory
+        self.min_interval = 0
+        self.builds = 0
+        self._snapshot = None
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # A mapping made before fork stays valid and shared; the builder
+            # thread does not survive
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        app.config.setdefault('CATALOG_SNAPSHOT_ENABLED', True)
+        app.config.setdefault('CATALOG_SNAPSHOT_DIR', None)
+        app.config.setdefault('CATALOG_SNAPSHOT_MIN_INTERVAL', 30)
+        self.app = app
+        self.enabled = app.config['CATALOG_SNAPSHOT_ENABLED']
+        self.min_interval = app.config['CATALOG_SNAPSHOT_MIN_INTERVAL']
+        self.directory = app.config['CATALOG_SNAPSHOT_DIR'] or os.path.join(
+            tempfile.gettempdir(),
+            'buygenius-catalog-' + hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8')).hexdigest()[:12]
+        )
+        app.extensions['catalog_snapshot'] = self
+
+    # Building
+
+    def build(self, connection):
+        """Write a new generation from ``connection`` and publish it; returns its version."""
+        os.makedirs(self.directory, exist_ok=True)
+        # The version is read first: rows committed in between only make the
+        # snapshot newer than its label, and the next check rebuilds it
+        version = _products_version(connection)
+        rows = connection.execute(
+            select(Product.id, Product.price, Product.delivery_cost, Product.estimated_value,
+                   Product.marginal_benefit, Product.category_id, Product.retailer_id, Product.payment_mode)
+            .order_by(Product.id)
+        ).all()
+        payment_modes = sorted({row[-1] for row in rows if row[-1] is not None})
+
+        generation = f'g{uuid.uuid4().hex}'
+        path = os.path.join(self.directory, generation)
+        os.makedirs(path)
+        for name, values in _arrays(rows, payment_modes).items():
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        meta = {'generation': generation, 'version': version, 'rows': len(rows), 'payment_modes': payment_modes}
+        previous = self._read_pointer()
+        pointer = os.path.join(self.directory, POINTER)
+        with open(pointer + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(pointer + '.tmp', pointer)
+        self._prune(keep={generation, previous and previous['generation']})
+        self.builds += 1
+        return version
+
+    def _prune(self, keep):
+        # Processes that already mapped a removed generation keep reading it
+        for name in os.listdir(self.directory):
+            if name.startswith('g') and name not in keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def build_now(self, force=False):
+        """Build under the cross-process lock unless another process already is or the snapshot is current."""
+        if not self.enabled or self.app is None:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'build.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            with self.app.app_context():
+                with db.engine.connect() as connection:
+                    if not force:
+                        meta = self._read_pointer()
+                        if meta is not None and meta['version'] == _products_version(connection):
+                            return False
+                    started = time.perf_counter()
+                    version = self.build(connection)
+            logger.info('catalog snapshot %s built in %.2fs', version, time.perf_counter() - started)
+            return True
+
+    def refresh_async(self):
+        """Rebuild in a background thread; calls during the wait or a build cause one more build after it."""
+        if not self.enabled or self.app is None:
+            return
+        self._wanted.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='catalog-snapshot', daemon=True)
+                self._thread.start()
+
+    def _published_at(self):
+        try:
+            return os.path.getmtime(os.path.join(self.directory, POINTER))
+        except OSError:
+            return None
+
+    def _run(self):
+        while self._wanted.is_set():
+            # Any process's build counts, so the pointer's mtime is the clock.
+            # Commits arriving while this thread waits fold into one build
+            published_at = self._published_at()
+            if published_at is not None:
+                wait = published_at + self.min_interval - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            self._wanted.clear()
+            try:
+                self.build_now()
+            except Exception:
+                logger.exception('catalog snapshot build failed')
+
+    # Reading
+
+    def _read_pointer(self):
+        try:
+            with open(os.path.join(self.directory, POINTER)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def current(self, version, updated_at):
+        """The snapshot for this version of 'products', or None (and a rebuild starts) if there is none yet."""
+        if not self.enabled or self.app is None:
+            return None
+        version = version_label(version, updated_at)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        meta = self._read_pointer()
+        if meta is not None and meta['version'] == version:
+            try:
+                snapshot = Snapshot(os.path.join(self.directory, meta['generation']), meta)
+            except OSError:
+                snapshot = None
+            if snapshot is not None:
+                self._snapshot = snapshot
+                return snapshot
+        self.refresh_async()
+        return None
+
+
+catalog = CatalogSnapshot()
+
+
+def ordered_rows(rows, ids):
+    """``rows`` from product_rows() put in the order of ``ids``."""
+    by_id = {row.id: row for row in rows}
+    return [by_id[product_id] for product_id in ids if product_id in by_id]
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_product_changes(sess, flush_context):
+    if any(isinstance(obj, Product) for obj in list(sess.new) + list(sess.dirty) + list(sess.deleted)):
+        sess.info['catalog_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _rebuild_after_commit(sess):
+    if sess.info.pop('catalog_changed', False):
+        catalog.refresh_async()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_uncommitted(sess):
+    sess.info.pop('catalog_changed', None)
+
+
+def init_app(app):
+    catalog.init_app(app)
+
+    @app.cli.command('catalog-snapshot')
+    def catalog_snapshot():
+        """Rebuild the memory-mapped catalog snapshot."""
+        if catalog.build_now(force=True):
+            click.echo(f'Catalog snapshot written to {catalog.directory}.')
+        else:
+            click.echo('Catalog snapshot is disabled or being built by another process.')
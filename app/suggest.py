@@ -0,0 +1,310 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from .models import db, Category, Product, UserHistory
+
+logger = logging.getLogger(__name__)
+
+# Autocomplete over product names, category names and popular search terms.
+#
+# The index is sorted lists of (key, entry) pairs, where key is a normalized
+# phrase. Every product and category name is also keyed from each of its
+# later words, so "gal" finds "Samsung Galaxy S23". A prefix lookup is a few
+# bisects plus a short walk from each, and results are memoized per prefix
+# until the next change. Product and category commits
+# in this process update the index in place. Other processes pick them up
+# when their copy is refreshed every SUGGEST_REFRESH_INTERVAL seconds.
+#
+# Under gunicorn the index is built once in the preloaded master and the
+# workers inherit it at fork. A process without one builds it in the
+# background and answers with no suggestions until it is ready, so no
+# request ever waits on loading the whole catalog.
+
+PRODUCT_WEIGHT = 1.0
+CATEGORY_WEIGHT = 5.0
+HIGH = '\U0010ffff'
+
+
+def words(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def normalize_prefix(text):
+    return ' '.join(words(text))
+
+
+def _keys(text):
+    parts = words(text)
+    return {' '.join(parts[i:]) for i in range(len(parts))}
+
+
+class SuggestIndex:
+    def __init__(self, refresh_interval=300, cache_size=4096, min_term_count=2):
+        self.app = None
+        self.refresh_interval = refresh_interval
+        self.cache_size = cache_size
+        self.min_term_count = min_term_count
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Keep the index built in the parent; only the locks and the
+            # refresh thread's flag don't carry over
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.RLock()
+        self._refreshing = False
+
+    def _reset(self):
+        self._lock = threading.RLock()
+        # Products all carry the same weight, so their keys are kept apart:
+        # the first k in key order are as good as any, and a lookup never has
+        # to rank a slice that may cover most of the catalog. Categories and
+        # popular terms are few and are ranked by weight.
+        self._leading = []
+        self._inner = []
+        self._weighted = []
+        self._entries = {}
+        self._cache = OrderedDict()
+        self._built_at = None
+        self._refreshing = False
+
+    def init_app(self, app):
+        app.config.setdefault('SUGGEST_REFRESH_INTERVAL', 300)
+        app.config.setdefault('SUGGEST_CACHE_SIZE', 4096)
+        app.config.setdefault('SUGGEST_MIN_TERM_COUNT', 2)
+        self.app = app
+        self.refresh_interval = app.config['SUGGEST_REFRESH_INTERVAL']
+        self.cache_size = app.config['SUGGEST_CACHE_SIZE']
+        self.min_term_count = app.config['SUGGEST_MIN_TERM_COUNT']
+        app.extensions['suggest'] = self
+
+    # Building
+
+    def _load(self):
+        entries = {}
+        for product_id, name in db.session.execute(select(Product.id, Product.name)):
+            entries[('product', product_id)] = (name, PRODUCT_WEIGHT)
+        for category_id, name in db.session.execute(select(Category.id, Category.name)):
+            entries[('category', category_id)] = (name, CATEGORY_WEIGHT)
+
+        # Popular searches, weighted by how often they were made
+        term = func.lower(func.trim(UserHistory.search_term))
+        rows = db.session.execute(
+            select(term, func.count())
+            .where(UserHistory.search_term.isnot(None))
+            .group_by(term)
+            .having(func.count() >= self.min_term_count)
+            .order_by(func.count().desc())
+            .limit(5000)
+        )
+        for text, count in rows:
+            key = normalize_prefix(text)
+            if key:
+                entries[('term', key)] = (text, float(count))
+        return entries
+
+    def _bucket(self, entry, key, text):
+        if entry[0] != 'product':
+            return self._weighted
+        return self._leading if key == normalize_prefix(text) else self._inner
+
+    def _build(self, entries):
+        leading, inner, weighted = [], [], []
+        for entry, (text, _) in entries.items():
+            lead = normalize_prefix(text)
+            for key in _keys(text):
+                if entry[0] != 'product':
+                    weighted.append((key, entry))
+                elif key == lead:
+                    leading.append((key, entry))
+                else:
+                    inner.append((key, entry))
+        for keys in (leading, inner, weighted):
+            keys.sort()
+        with self._lock:
+            self._leading, self._inner, self._weighted = leading, inner, weighted
+            self._entries = entries
+            self._cache.clear()
+            self._built_at = time.monotonic()
+
+    def rebuild(self):
+        self._build(self._load())
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self.app.app_context():
+                    self.rebuild()
+            except Exception:
+                logger.exception('suggest index refresh failed')
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='suggest-refresh', daemon=True).start()
+
+    def build_now(self):
+        """Build synchronously, e.g. in the gunicorn master before the workers fork."""
+        if self.app is None:
+            return
+        with self.app.app_context():
+            self.rebuild()
+
+    def ensure_fresh(self):
+        """Start a background build if the index is missing or stale; returns whether it is ready."""
+        if self._built_at is None or time.monotonic() - self._built_at > self.refresh_interval:
+            self._refresh_in_background()
+        return self._built_at is not None
+
+    # Incremental updates
+
+    def _remove(self, entry):
+        old = self._entries.pop(entry, None)
+        if old is None:
+            return
+        for key in _keys(old[0]):
+            keys = self._bucket(entry, key, old[0])
+            i = bisect_left(keys, (key, entry))
+            if i < len(keys) and keys[i] == (key, entry):
+                del keys[i]
+
+    def _add(self, entry, text, weight):
+        self._entries[entry] = (text, weight)
+        for key in _keys(text):
+            insort(self._bucket(entry, key, text), (key, entry))
+
+    def apply(self, changes):
+        """Apply committed (entry, text_or_None, weight) changes."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for entry, text, weight in changes:
+                self._remove(entry)
+                if text:
+                    self._add(entry, text, weight)
+            self._cache.clear()
+
+    # Querying
+
+    @staticmethod
+    def _slice(keys, prefix):
+        return bisect_left(keys, (prefix,)), bisect_left(keys, (prefix + HIGH,))
+
+    def _lookup(self, prefix, limit):
+        # Categories and terms by weight, names that start with the prefix
+        # ahead of ones matched on a later word
+        lo, hi = self._slice(self._weighted, prefix)
+        matched = {}
+        for key, entry in self._weighted[lo:hi]:
+            leading = key == normalize_prefix(self._entries[entry][0])
+            matched[entry] = matched.get(entry, False) or leading
+        ranked = heapq.nlargest(
+            limit * 2, matched, key=lambda entry: (self._entries[entry][1], matched[entry])
+        )
+        # Then products, which all weigh less than any category or term
+        for keys in (self._leading, self._inner):
+            lo, hi = self._slice(keys, prefix)
+            ranked.extend(entry for _, entry in keys[lo:min(hi, lo + limit * 2)])
+        return ranked
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            return []
+        cache_key = (prefix, limit)
+        with self._lock:
+            hit = self._cache.get(cache_key)
+            if hit is not None:
+                self._cache.move_to_end(cache_key)
+                return hit
+
+            results, seen = [], set()
+            for entry in self._lookup(prefix, limit):
+                text = self._entries[entry][0]
+                if text.lower() in seen:
+                    continue
+                seen.add(text.lower())
+                kind, ident = entry
+                results.append((text, kind, ident if kind != 'term' else None))
+                if len(results) == limit:
+                    break
+
+            self._cache[cache_key] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return results
+
+    def stats(self):
+        with self._lock:
+            keys = len(self._leading) + len(self._inner) + len(self._weighted)
+            return {'keys': keys, 'entries': len(self._entries), 'cached_prefixes': len(self._cache)}
+
+
+index = SuggestIndex()
+
+
+# Product and category names are collected at flush and applied only once
+# the transaction commits.
+
+def _queue(target, text):
+    sess = object_session(target)
+    if sess is None:
+        return
+    if isinstance(target, Product):
+        change = (('product', target.id), text, PRODUCT_WEIGHT)
+    else:
+        change = (('category', target.id), text, CATEGORY_WEIGHT)
+    sess.info.setdefault('suggest_changes', []).append(change)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Category, 'after_insert')
+def _queue_insert(mapper, connection, target):
+    _queue(target, target.name)
+
+
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Category, 'after_update')
+def _queue_update(mapper, connection, target):
+    if inspect(target).attrs.name.history.has_changes():
+        _queue(target, target.name)
+
+
+@event.listens_for(Product, 'after_delete')
+@event.listens_for(Category, 'after_delete')
+def _queue_delete(mapper, connection, target):
+    _queue(target, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(sess):
+    changes = sess.info.pop('suggest_changes', None)
+    if changes:
+        index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_uncommitted(sess):
+    sess.info.pop('suggest_changes', None)
+
+
+def add_products(rows):
+    """Index ``(id, name)`` pairs written without the ORM (bulk import)."""
+    index.apply([(('product', product_id), name, PRODUCT_WEIGHT) for product_id, name in rows])
+
+
+def init_app(app):
+    index.init_app(app)
@@ -0,0 +1,201 @@
+"""Concurrent read throughput: sync gunicorn workers against the async ASGI read path.
+
+    python benchmarks/bench_asgi.py --duration 10 --clients 32
+
+Every scenario runs 4 worker processes and serves the same mix of catalog,
+product, category, search and check_session GETs:
+
+- "sync" is 4 sync gunicorn workers, one request in flight per worker.
+- "gthread" is the gunicorn.conf.py defaults.
+- "asgi" is uvicorn serving app.asgi:app, where those GETs run on async
+  SQLAlchemy sessions.
+
+The response cache is off so every request reaches the database. By default
+the data is a throwaway SQLite database filled by app/datagen.py. Pass
+--database-url to use an existing, seeded database such as Postgres, where
+query latency is network-bound and the async path has the most to gain.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKERS = '4'
+SCENARIOS = [
+    ('sync: gunicorn, 4 sync workers',
+     [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+     {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': WORKERS}),
+    ('gthread: gunicorn, 4 workers x 8 threads',
+     [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+     {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': WORKERS}),
+    ('asgi: uvicorn app.asgi:app, 4 workers',
+     [sys.executable, '-m', 'uvicorn', 'app.asgi:app', '--workers', WORKERS, '--no-access-log', '--port', '{port}'],
+     {}),
+]
+SEARCH_TERMS = ['samsung', 'galaxy', 'hp laptop', 'sony', 'nike sneakers', 'blender', 'iphone', 'lenovo']
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(database_url, products):
+    """Seed a fresh database when ``products`` is set; returns a shopper's email and the highest product id."""
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import func, select
+    from app import create_app
+    from app.datagen import DataGenerator
+    from app.models import db, Product, User
+
+    app = create_app()
+    with app.app_context():
+        if products:
+            db.create_all()
+            generator = DataGenerator(db.engine, seed=1, password='bench-password', log=lambda line: None)
+            generator.run(users=50, retailers=20, products=products, messages=0, wishlists=0, history=0, feedback=0)
+        email = db.session.scalar(select(User.email).where(User.is_retailer.is_(False)).limit(1))
+        product_count = db.session.scalar(select(func.max(Product.id)))
+    return email, product_count
+
+
+def _request(port, path, cookie=None, method='GET', body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Cookie': cookie} if cookie else {}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, resp.getheader('Set-Cookie')
+    finally:
+        conn.close()
+
+
+def _wait_until_up(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            _request(port, '/categories')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def _paths(rng, product_count):
+    while True:
+        roll = rng.random()
+        if roll < 0.35:
+            yield 'products', f"/products?limit=20&sort={rng.choice(['newest', 'value'])}"
+        elif roll < 0.55:
+            yield 'product', f'/products/{rng.randint(1, product_count)}'
+        elif roll < 0.65:
+            yield 'categories', '/categories'
+        elif roll < 0.9:
+            yield 'search', '/search/' + rng.choice(SEARCH_TERMS).replace(' ', '%20')
+        else:
+            yield 'check_session', '/check_session'
+
+
+def run_scenario(command, env, args, email, product_count):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [part.format(port=port) for part in command],
+        cwd=ROOT,
+        env={**os.environ, **env, 'PORT': str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_until_up(port, proc)
+        status, set_cookie = _request(port, '/login', method='POST',
+                                      body={'email': email, 'password': 'bench-password'})
+        cookie = set_cookie.split(';', 1)[0] if status == 200 and set_cookie else None
+
+        latencies, errors = {}, {}
+        lock = threading.Lock()
+        stop_at = time.time() + args.duration
+
+        def client(index):
+            rng = random.Random(index)
+            paths = _paths(rng, product_count)
+            while time.time() < stop_at:
+                kind, path = next(paths)
+                start = time.perf_counter()
+                # 404s are expected for searches without a match
+                status, _ = _request(port, path, cookie)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if status in (200, 204, 404):
+                        latencies.setdefault(kind, []).append(elapsed)
+                    else:
+                        errors[kind] = errors.get(kind, 0) + 1
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def _p(samples, q):
+    if not samples:
+        return float('nan')
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--database-url', help='an existing, seeded database to run against instead')
+    args = parser.parse_args()
+
+    # Login is not what is measured; keep bcrypt cheap
+    os.environ['BCRYPT_ROUNDS'] = '4'
+    if args.database_url:
+        database_url = args.database_url
+        email, product_count = prepare(database_url, products=0)
+    else:
+        workdir = tempfile.mkdtemp(prefix='bench_asgi_')
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        email, product_count = prepare(database_url, args.products)
+
+    base_env = {'DATABASE_URL': database_url, 'CACHE_TYPE': 'null'}
+    print(f'{args.clients} clients for {args.duration:.0f}s against {product_count} products')
+    for label, command, env in SCENARIOS:
+        latencies, errors = run_scenario(command, {**base_env, **env}, args, email, product_count)
+        total = sum(len(samples) for samples in latencies.values())
+        every = [sample for samples in latencies.values() for sample in samples]
+        print(f'{label}: {total / args.duration:.1f} req/s   p50 {_p(every, 50) * 1000:.1f} ms   '
+              f'p95 {_p(every, 95) * 1000:.1f} ms   errors {sum(errors.values())}')
+        for kind in sorted(latencies):
+            samples = latencies[kind]
+            print(f'  {kind:<14} {len(samples) / args.duration:8.1f} req/s   '
+                  f'p50 {_p(samples, 50) * 1000:7.1f} ms   p95 {_p(samples, 95) * 1000:7.1f} ms   '
+                  f'errors {errors.get(kind, 0)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Mixed login/catalog throughput under gunicorn, before and after the hashing pool.
+
+    python benchmarks/bench_login_mix.py --duration 10 --logins 8 --readers 8
+
+"before" runs 4 sync workers with bcrypt inline (PASSWORD_HASH_WORKERS=0);
+"after" runs the gunicorn.conf.py defaults (gthread) with the hashing pool.
+Both use a throwaway SQLite database.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = [
+    ('before: sync, inline bcrypt', {'GUNICORN_WORKER_CLASS': 'sync', 'PASSWORD_HASH_WORKERS': '0'}),
+    ('after: gthread, hashing pool', {'GUNICORN_WORKER_CLASS': 'gthread', 'PASSWORD_HASH_WORKERS': '2'}),
+]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed(database_url, users, products, rounds):
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app
+    from app.hashing import hasher
+    from app.models import db, Category, Product, Retailer, User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        hasher.rounds = rounds
+        password_hash = hasher.hash('bench-password')
+        owner = User(username='retailer', email='retailer@example.com', password_hash=password_hash, is_retailer=True)
+        category = Category(name='Electronics')
+        db.session.add_all([owner, category])
+        db.session.flush()
+        retailer = Retailer(name='Bench Retailer', user_id=owner.id, approved=True)
+        db.session.add(retailer)
+        db.session.flush()
+        db.session.add_all([
+            User(username=f'user{i}', email=f'user{i}@example.com', password_hash=password_hash)
+            for i in range(users)
+        ])
+        db.session.add_all([
+            Product(name=f'Product {i}', price=100 + i, delivery_cost=50, retailer_id=retailer.id,
+                    category_id=category.id, estimated_value=150 + i, marginal_benefit=0.1)
+            for i in range(products)
+        ])
+        db.session.commit()
+
+
+def _request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def _wait_until_up(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            _request(port, 'GET', '/')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run_scenario(env, args):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+        cwd=ROOT,
+        env={**os.environ, **env, 'PORT': str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_until_up(port, proc)
+        latencies = {'login': [], 'catalog': []}
+        errors = {'login': 0, 'catalog': 0}
+        lock = threading.Lock()
+        stop_at = time.time() + args.duration
+
+        def client(kind, index):
+            n = 0
+            while time.time() < stop_at:
+                start = time.perf_counter()
+                if kind == 'login':
+                    user = (index * 1000 + n) % args.users
+                    status = _request(port, 'POST', '/login',
+                                      {'email': f'user{user}@example.com', 'password': 'bench-password'})
+                else:
+                    status = _request(port, 'GET', '/products?limit=20')
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if status == 200:
+                        latencies[kind].append(elapsed)
+                    else:
+                        errors[kind] += 1
+                n += 1
+
+        threads = [threading.Thread(target=client, args=('login', i)) for i in range(args.logins)]
+        threads += [threading.Thread(target=client, args=('catalog', i)) for i in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def _p(samples, q):
+    if not samples:
+        return float('nan')
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--logins', type=int, default=8, help='concurrent login clients')
+    parser.add_argument('--readers', type=int, default=8, help='concurrent catalog clients')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_login_mix_')
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    seed(database_url, args.users, args.products, args.rounds)
+
+    base_env = {
+        'DATABASE_URL': database_url,
+        'BCRYPT_ROUNDS': str(args.rounds),
+        'CACHE_TYPE': 'null',
+    }
+    print(f'{args.logins} login + {args.readers} catalog clients for {args.duration:.0f}s, bcrypt cost {args.rounds}')
+    for label, env in SCENARIOS:
+        latencies, errors = run_scenario({**base_env, **env}, args)
+        print(label)
+        for kind in ('login', 'catalog'):
+            samples = latencies[kind]
+            print(f'  {kind:<8} {len(samples) / args.duration:8.1f} req/s   '
+                  f'p50 {_p(samples, 50) * 1000:7.1f} ms   p95 {_p(samples, 95) * 1000:7.1f} ms   '
+                  f'errors {errors[kind]}')
+
+
+if __name__ == '__main__':
+    main()
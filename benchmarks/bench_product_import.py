@@ -0,0 +1,99 @@
+"""Compare one POST /products per item with the streaming /products/import.
+
+    python benchmarks/bench_product_import.py --products 5000
+
+Runs in-process through the Flask test client against a throwaway SQLite
+database, so it never touches DATABASE_URL.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _payload(i, category_id):
+    return {
+        'name': f'Imported product {i}',
+        'price': 100 + i,
+        'description': f'Bulk imported product number {i}',
+        'delivery_cost': i % 7 * 50,
+        'payment_mode': 'Cash/Card/M-Pesa',
+        'category_id': category_id,
+        'image_url': f'https://example.com/{i}.jpg',
+    }
+
+
+def _csv_body(items):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(items[0]))
+    writer.writeheader()
+    writer.writerows(items)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_product_import_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    os.environ.setdefault('CACHE_TYPE', 'simple')
+
+    from app import create_app
+    from app.models import db, Category, Product, Retailer, User
+
+    app = create_app()
+    app.config['IMPORT_CHUNK_SIZE'] = args.chunk_size
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Electronics')
+        owner = User(username='bench', email='bench@example.com', is_retailer=True)
+        owner.password = 'bench-password'
+        db.session.add_all([category, owner])
+        db.session.flush()
+        db.session.add(Retailer(name='Bench Retailer', user_id=owner.id, approved=True))
+        db.session.commit()
+        category_id = category.id
+
+    client = app.test_client()
+    client.post('/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+    items = [_payload(i, category_id) for i in range(args.products)]
+
+    start = time.perf_counter()
+    for item in items:
+        client.post('/products', json=item)
+    single = time.perf_counter() - start
+
+    runs = [
+        ('ndjson', 'application/x-ndjson', '\n'.join(json.dumps(item) for item in items)),
+        ('csv', 'text/csv', _csv_body(items)),
+    ]
+    results = []
+    for label, content_type, body in runs:
+        start = time.perf_counter()
+        resp = client.post('/products/import', data=body, content_type=content_type)
+        elapsed = time.perf_counter() - start
+        assert resp.get_json()['inserted'] == args.products, resp.get_json()
+        results.append((label, elapsed))
+
+    with app.app_context():
+        assert Product.query.count() == args.products * (1 + len(runs))
+
+    print(f'{args.products} products, import chunk size {args.chunk_size}')
+    print(f'  POST /products x{args.products:<6} {single * 1000:9.1f} ms  {args.products / single:9.0f} rows/s')
+    for label, elapsed in results:
+        print(f'  /products/import {label:<7} {elapsed * 1000:9.1f} ms  {args.products / elapsed:9.0f} rows/s'
+              f'  ({single / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compare the to_dict + stdlib json path with the msgspec serializers.
+
+    python benchmarks/bench_serialization.py --products 5000 --repeat 20
+
+Runs against a throwaway SQLite database, so it never touches DATABASE_URL.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_serialization_')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app
+    from app.models import db, Category, Product, Retailer, User
+    from app.serializers import ProductOut, dumps, product_rows, products_from_rows
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Electronics')
+        owner = User(username='bench', email='bench@example.com', password_hash='x', is_retailer=True)
+        db.session.add_all([category, owner])
+        db.session.flush()
+        retailer = Retailer(name='Bench Retailer', user_id=owner.id, whatsapp_number='+254700000000', approved=True)
+        db.session.add(retailer)
+        db.session.flush()
+        db.session.add_all([
+            Product(
+                name=f'Product {i}',
+                price=100 + i,
+                description=f'Benchmark product number {i}',
+                delivery_cost=i % 7 * 50,
+                payment_mode='Cash/Card/M-Pesa',
+                retailer_id=retailer.id,
+                category_id=category.id,
+                estimated_value=120 + i,
+                marginal_benefit=0.1,
+                image_url=f'https://example.com/images/{i}.jpg'
+            )
+            for i in range(args.products)
+        ])
+        db.session.commit()
+
+        def to_dict_path():
+            db.session.expunge_all()
+            products = Product.query.all()
+            data = []
+            for product in products:
+                product_data = product.to_dict()
+                product_data['retailer_whatsapp'] = product.retailer.whatsapp_number if product.retailer else None
+                data.append(product_data)
+            return json.dumps(data)
+
+        def struct_path():
+            db.session.expunge_all()
+            products = Product.query.all()
+            return dumps([ProductOut.from_model(product) for product in products])
+
+        def row_path():
+            return dumps(products_from_rows(db.session.execute(product_rows()).all()))
+
+        results = [
+            ('ORM + to_dict + json.dumps', _timed(to_dict_path, args.repeat)),
+            ('ORM + structs + msgspec', _timed(struct_path, args.repeat)),
+            ('rows + structs + msgspec', _timed(row_path, args.repeat)),
+        ]
+
+    baseline = statistics.median(results[0][1])
+    print(f'{args.products} products, {args.repeat} runs each')
+    for label, samples in results:
+        median = statistics.median(samples)
+        print(f'  {label:<28} median {median * 1000:8.1f} ms   best {min(samples) * 1000:8.1f} ms   {baseline / median:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
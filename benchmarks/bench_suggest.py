@@ -0,0 +1,66 @@
+"""Latency of /suggest lookups against a synthetic catalog.
+
+    python benchmarks/bench_suggest.py --products 100000 --queries 20000
+
+Builds the prefix index in memory from generated names (no database) and
+times lookups for random 1-6 character prefixes, with and without the
+per-prefix result cache.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BRANDS = ['Samsung', 'Apple', 'Tecno', 'Infinix', 'Oppo', 'Xiaomi', 'Nokia', 'HP', 'Dell', 'Lenovo', 'Sony', 'LG']
+ITEMS = ['Galaxy', 'iPhone', 'Spark', 'Hot', 'Reno', 'Redmi', 'Laptop', 'Monitor', 'Headphones', 'Television', 'Fridge', 'Blender']
+
+
+def _timed(index, prefixes, clear_cache):
+    samples = []
+    for prefix in prefixes:
+        if clear_cache:
+            index._cache.clear()
+        start = time.perf_counter()
+        index.suggest(prefix)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    from app.suggest import CATEGORY_WEIGHT, PRODUCT_WEIGHT, SuggestIndex
+
+    rng = random.Random(42)
+    entries = {
+        ('product', i): (f'{rng.choice(BRANDS)} {rng.choice(ITEMS)} {rng.randint(1, 999)} {rng.choice(["Pro", "Lite", "Max", ""])}'.strip(), PRODUCT_WEIGHT)
+        for i in range(args.products)
+    }
+    entries.update({('category', i): (name, CATEGORY_WEIGHT) for i, name in enumerate(['Electronics', 'Phones', 'Laptops'])})
+
+    index = SuggestIndex()
+    start = time.perf_counter()
+    index._build(entries)
+    print(f'built {index.stats()["keys"]} keys for {args.products} products in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    names = [text for text, _ in entries.values()]
+    prefixes = []
+    for _ in range(args.queries):
+        word = rng.choice(rng.choice(names).split())
+        prefixes.append(word[:rng.randint(1, min(6, len(word)))])
+
+    for label, clear_cache in (('uncached', True), ('cached', False)):
+        samples = sorted(_timed(index, prefixes, clear_cache))
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        print(f'  {label:<9} p50 {statistics.median(samples) * 1e6:8.1f} us   p99 {p99 * 1e6:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
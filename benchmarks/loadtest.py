@@ -0,0 +1,513 @@
+"""Load test the API with realistic request mixes and compare against a baseline.
+
+    python benchmarks/loadtest.py --size small --transport client
+    python benchmarks/loadtest.py --size medium --transport gunicorn --clients 16
+    python benchmarks/loadtest.py --size small --save-baseline
+
+Seeds a throwaway SQLite database with users, retailers, products,
+conversations, wishlists and search history. Then it drives the app with
+shopper and retailer clients: catalog browsing, search and suggest,
+comparison, login, wishlist edits, dashboards and inboxes.
+
+There are two transports. ``client`` runs in-process through the Flask test
+client. ``gunicorn`` starts gunicorn.conf.py on a local port. For each
+endpoint it reports throughput, p50/p95/p99 latency and SQL statements per
+request; the statement count is read from the Server-Timing header.
+
+Results are checked against benchmarks/baselines/<transport>-<size>.json
+when that file exists. The run exits 1 if an endpoint issues more queries
+per request than the baseline. It also exits 1 if p95 latency regresses by
+more than --tolerance. Query counts are comparable on any machine; record
+latency baselines on the machine that runs the comparison.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines')
+sys.path.insert(0, ROOT)
+
+SIZES = {
+    'small': dict(users=200, retailers=10, products=2000, messages=2000, wishlists=1000, history=5000),
+    'medium': dict(users=2000, retailers=50, products=20000, messages=20000, wishlists=10000, history=50000),
+    'large': dict(users=20000, retailers=200, products=200000, messages=200000, wishlists=100000, history=500000),
+}
+PASSWORD = 'bench-password'
+BRANDS = ['Samsung', 'Apple', 'Tecno', 'Infinix', 'Oppo', 'Xiaomi', 'Nokia', 'HP', 'Dell', 'Lenovo', 'Sony', 'LG']
+ITEMS = ['Galaxy', 'iPhone', 'Spark', 'Hot', 'Reno', 'Redmi', 'Laptop', 'Monitor', 'Headphones', 'Television', 'Fridge', 'Blender']
+CATEGORIES = ['Electronics', 'Phones', 'Computers', 'Home & Kitchen', 'Fashion']
+MIN_SAMPLES = 30
+SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+# Dataset
+
+def _product_name(rng):
+    return f'{rng.choice(BRANDS)} {rng.choice(ITEMS)} {rng.randint(1, 60)}'
+
+
+def seed(database_url, sizes, rounds, rng):
+    """Fill a fresh database with Core bulk inserts, then rebuild derived state."""
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import insert
+
+    from app import create_app
+    from app.hashing import hasher
+    from app.models import (
+        db, Category, Conversation, Message, Product, Retailer, User, UserHistory, Wishlist
+    )
+    from app import analytics, search
+
+    app = create_app()
+    now = datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        hasher.rounds = rounds
+        # One hash shared by every account keeps seeding fast
+        password_hash = hasher.hash(PASSWORD)
+        with db.engine.begin() as conn:
+            conn.execute(insert(Category), [{'id': i + 1, 'name': name} for i, name in enumerate(CATEGORIES)])
+            conn.execute(insert(User), [
+                {'id': i + 1, 'username': f'user{i}', 'email': f'user{i}@example.com',
+                 'password_hash': password_hash, 'is_retailer': False, 'is_admin': False,
+                 'created_at': now - timedelta(minutes=i)}
+                for i in range(sizes['users'])
+            ])
+            first_owner = sizes['users'] + 1
+            conn.execute(insert(User), [
+                {'id': first_owner + i, 'username': f'retailer{i}', 'email': f'retailer{i}@example.com',
+                 'password_hash': password_hash, 'is_retailer': True, 'is_admin': False, 'created_at': now}
+                for i in range(sizes['retailers'])
+            ])
+            conn.execute(insert(Retailer), [
+                {'id': i + 1, 'name': f'Retailer {i}', 'user_id': first_owner + i,
+                 'whatsapp_number': f'+2547{i:08d}', 'approved': True}
+                for i in range(sizes['retailers'])
+            ])
+
+            products = []
+            for i in range(sizes['products']):
+                name = _product_name(rng)
+                price = rng.randint(500, 150000)
+                delivery = rng.choice([0, 200, 500, 1000])
+                value = price * rng.uniform(0.9, 1.3)
+                products.append({
+                    'id': i + 1, 'name': name, 'price': price, 'delivery_cost': delivery,
+                    'description': f'{name} sold by retailer {i % sizes["retailers"]}',
+                    'payment_mode': 'Cash/Card/M-Pesa', 'retailer_id': i % sizes['retailers'] + 1,
+                    'category_id': rng.randint(1, len(CATEGORIES)), 'estimated_value': value,
+                    'marginal_benefit': 0.1, 'image_url': f'https://example.com/{i}.jpg',
+                    'value_score': Product.compute_value_score(price, delivery, value, 0.1),
+                    'canonical_key': Product.compute_canonical_key(name),
+                    'created_at': now - timedelta(seconds=i), 'updated_at': now - timedelta(seconds=i),
+                })
+            conn.execute(insert(Product), products)
+
+            # Messages are threaded into shopper/retailer conversations
+            pairs = {}
+            messages = []
+            for i in range(sizes['messages']):
+                user_id = rng.randint(1, sizes['users'])
+                retailer_id = rng.randint(1, sizes['retailers'])
+                conversation_id = pairs.setdefault((user_id, retailer_id), len(pairs) + 1)
+                owner_id = first_owner + retailer_id - 1
+                sender, receiver = (user_id, owner_id) if i % 2 else (owner_id, user_id)
+                messages.append({
+                    'sender_id': sender, 'receiver_id': receiver, 'retailer_id': retailer_id,
+                    'conversation_id': conversation_id, 'content': f'Message {i}',
+                    'sent_at': now - timedelta(seconds=sizes['messages'] - i),
+                    'read_at': None if i % 3 == 0 else now,
+                })
+            conn.execute(insert(Conversation), [
+                {'id': conversation_id, 'user_id': user_id, 'retailer_id': retailer_id,
+                 'product_id': None, 'created_at': now, 'last_message_at': now}
+                for (user_id, retailer_id), conversation_id in pairs.items()
+            ])
+            if messages:
+                conn.execute(insert(Message), messages)
+
+            wishlist = {
+                (rng.randint(1, sizes['users']), rng.randint(1, sizes['products']))
+                for _ in range(sizes['wishlists'])
+            }
+            if wishlist:
+                conn.execute(insert(Wishlist), [
+                    {'user_id': user_id, 'product_id': product_id, 'added_at': now}
+                    for user_id, product_id in wishlist
+                ])
+            conn.execute(insert(UserHistory), [
+                {'user_id': rng.randint(1, sizes['users']), 'search_term': rng.choice(BRANDS + ITEMS).lower(),
+                 'searched_at': now - timedelta(seconds=i)}
+                for i in range(sizes['history'])
+            ])
+
+            search.rebuild_index(conn)
+            analytics.recount(conn)
+
+
+# Transports
+
+def _queries(headers):
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing') or '')
+    return int(match.group(1)) if match else None
+
+
+class ClientTransport:
+    """In-process Flask test client; one per virtual user."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        resp = self.client.open(path, method=method, json=body)
+        return resp.status_code, resp.get_data(), _queries(resp.headers)
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Keep-alive HTTP connection with a minimal cookie jar."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed an idle keep-alive connection
+                self.close()
+                if attempt:
+                    raise
+        for header in resp.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return resp.status, data, _queries(resp.headers)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# Workloads
+
+class VirtualUser:
+    def __init__(self, transport, rng, sizes, index, record):
+        self.transport = transport
+        self.rng = rng
+        self.sizes = sizes
+        self.index = index
+        self.record = record
+
+    def call(self, label, method, path, body=None, ok=(200, 201, 204)):
+        start = time.perf_counter()
+        status, data, queries = self.transport.request(method, path, body)
+        self.record(label, time.perf_counter() - start, queries, status in ok)
+        return status, data
+
+    def product_id(self):
+        return self.rng.randint(1, self.sizes['products'])
+
+    def browse(self):
+        status, data = self.call('GET /products', 'GET', '/products?limit=20')
+        cursor = json.loads(data).get('next_cursor') if status == 200 else None
+        if cursor and self.rng.random() < 0.5:
+            self.call('GET /products', 'GET', f'/products?limit=20&cursor={cursor}')
+
+    def product(self):
+        self.call('GET /products/<id>', 'GET', f'/products/{self.product_id()}')
+
+    def search(self):
+        term = self.rng.choice(BRANDS + ITEMS).lower()
+        self.call('GET /search/<query>', 'GET', f'/search/{term}?limit=20&record=true', ok=(200, 404))
+
+    def suggest(self):
+        word = self.rng.choice(BRANDS + ITEMS).lower()
+        self.call('GET /suggest', 'GET', f'/suggest?q={word[:self.rng.randint(1, 4)]}')
+
+    def compare(self):
+        self.call('GET /compare/<id>', 'GET', f'/compare/{self.product_id()}')
+
+    def wishlist(self):
+        status, data = self.call('POST /wishlist', 'POST', '/wishlist', {'product_id': self.product_id()}, ok=(201, 400))
+        if status == 201:
+            self.call('DELETE /wishlist/<id>', 'DELETE', f"/wishlist/{json.loads(data)['id']}")
+        self.call('GET /wishlist', 'GET', '/wishlist')
+
+
+class Shopper(VirtualUser):
+    def login(self):
+        user = self.rng.randint(0, self.sizes['users'] - 1)
+        self.call('POST /login', 'POST', '/login', {'email': f'user{user}@example.com', 'password': PASSWORD})
+
+    def dashboard(self):
+        self.call('GET /user_dashboard', 'GET', '/user_dashboard?limit=20')
+
+    def inbox(self):
+        self.call('GET /conversations', 'GET', '/conversations?limit=20')
+
+    def mix(self):
+        return [
+            (self.browse, 30), (self.product, 10), (self.search, 15), (self.suggest, 10), (self.compare, 5),
+            (self.wishlist, 10), (self.dashboard, 5), (self.inbox, 5), (self.login, 5),
+        ]
+
+
+class RetailerClient(VirtualUser):
+    def login(self):
+        retailer = self.index % self.sizes['retailers']
+        self.call('POST /login', 'POST', '/login', {'email': f'retailer{retailer}@example.com', 'password': PASSWORD})
+
+    def dashboard(self):
+        self.call('GET /retailer_dashboard', 'GET', '/retailer_dashboard?limit=20')
+
+    def messages(self):
+        self.call('GET /retailer_messages', 'GET', '/retailer_messages?limit=20')
+
+    def inbox(self):
+        self.call('GET /conversations', 'GET', '/conversations?limit=20')
+
+    def mix(self):
+        return [(self.dashboard, 30), (self.messages, 20), (self.inbox, 20), (self.browse, 20), (self.compare, 10)]
+
+
+def run(make_transport, args, sizes):
+    samples = defaultdict(list)
+    queries = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def record(label, elapsed, statement_count, ok):
+        with lock:
+            if not ok:
+                errors[label] += 1
+                return
+            samples[label].append(elapsed)
+            if statement_count is not None:
+                queries[label].append(statement_count)
+
+    def session(kind, index, actions):
+        # Every session has its own seeded RNG, so runs issue the same requests
+        rng = random.Random(args.seed * 1000 + index)
+        transport = make_transport()
+        user = kind(transport, rng, sizes, index, record)
+        try:
+            user.login()
+            mix, weights = zip(*user.mix())
+            for _ in range(actions):
+                rng.choices(mix, weights)[0]()
+        finally:
+            transport.close()
+
+    def client(index):
+        # Every fifth client then signs in again as a retailer
+        session(Shopper, index, args.requests)
+        if index % 5 == 0:
+            session(RetailerClient, index + args.clients, args.requests // 2)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return summarize(samples, queries, errors, elapsed)
+
+
+def _quantile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def summarize(samples, queries, errors, elapsed):
+    endpoints = {}
+    for label in sorted(set(samples) | set(errors)):
+        values = samples.get(label, [])
+        counts = queries.get(label, [])
+        endpoints[label] = {
+            'requests': len(values),
+            'errors': errors.get(label, 0),
+            'throughput': round(len(values) / elapsed, 2),
+            'p50_ms': round(_quantile(values, 50) * 1000, 3) if values else None,
+            'p95_ms': round(_quantile(values, 95) * 1000, 3) if values else None,
+            'p99_ms': round(_quantile(values, 99) * 1000, 3) if values else None,
+            'queries': round(statistics.mean(counts), 2) if counts else None,
+        }
+    total = sum(len(values) for values in samples.values())
+    return {'elapsed_s': round(elapsed, 2), 'throughput': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+# gunicorn
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run_gunicorn(env, args, sizes):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+        cwd=ROOT,
+        env={**os.environ, **env, 'PORT': str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_until_up(port, proc)
+        return run(lambda: HttpTransport(port), args, sizes)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+# Baselines
+
+def compare(result, baseline, tolerance):
+    """Regressions of ``result`` against ``baseline``, as printable lines."""
+    regressions = []
+    for label, current in result['endpoints'].items():
+        base = baseline['endpoints'].get(label)
+        if not base:
+            continue
+        if current['queries'] is not None and base['queries'] is not None and current['queries'] > base['queries'] + 0.5:
+            regressions.append(f"{label}: {current['queries']} queries per request, baseline {base['queries']}")
+        # Too few samples make p95 meaningless
+        if min(current['requests'], base['requests']) >= MIN_SAMPLES:
+            limit = base['p95_ms'] * (1 + tolerance) + 2
+            if current['p95_ms'] > limit:
+                regressions.append(f"{label}: p95 {current['p95_ms']:.1f} ms, baseline {base['p95_ms']:.1f} ms")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{label}: {current['errors']} errors, baseline {base['errors']}")
+    return regressions
+
+
+def report(result):
+    print(f"{'endpoint':<26}{'req':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+    for label, row in result['endpoints'].items():
+        cells = [row[key] for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries')]
+        p50, p95, p99, queries = ('-' if value is None else f'{value:.1f}' for value in cells)
+        print(f"{label:<26}{row['requests']:>7}{row['throughput']:>9.1f}{p50:>9}{p95:>9}{p99:>9}{queries:>9}{row['errors']:>8}")
+    print(f"total {result['throughput']:.1f} req/s over {result['elapsed_s']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--transport', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--clients', type=int,
+                        help='concurrent virtual users (default 1 in-process, where threads only add GIL noise; 8 for gunicorn)')
+    parser.add_argument('--requests', type=int, default=1000, help='actions per virtual user')
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost factor for the seeded accounts')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed p95 regression, as a fraction')
+    parser.add_argument('--baseline', help='baseline file (default benchmarks/baselines/<transport>-<size>.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='write this run as the new baseline')
+    parser.add_argument('--json', help='also write the results to this file')
+    for name in SIZES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    args = parser.parse_args()
+
+    if args.clients is None:
+        args.clients = 8 if args.transport == 'gunicorn' else 1
+    sizes = {name: getattr(args, name) or count for name, count in SIZES[args.size].items()}
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = {
+        'DATABASE_URL': database_url,
+        'BCRYPT_ROUNDS': str(args.rounds),
+        # No response cache by default, so every request's query count is
+        # deterministic; set CACHE_TYPE to measure with it
+        'CACHE_TYPE': os.environ.get('CACHE_TYPE', 'null'),
+        'SESSION_BACKEND': 'cookie',
+    }
+    os.environ.update(env)
+
+    start = time.perf_counter()
+    seed(database_url, sizes, args.rounds, random.Random(args.seed))
+    print(f"seeded {', '.join(f'{count} {name}' for name, count in sizes.items())} "
+          f'in {time.perf_counter() - start:.1f}s')
+    print(f'{args.clients} clients x {args.requests} actions over {args.transport}')
+
+    if args.transport == 'gunicorn':
+        result = run_gunicorn(env, args, sizes)
+    else:
+        from app import create_app
+        app = create_app()
+        result = run(lambda: ClientTransport(app), args, sizes)
+    result['config'] = {'size': args.size, 'transport': args.transport, 'clients': args.clients,
+                        'requests': args.requests, 'seed': args.seed, 'sizes': sizes}
+    report(result)
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(result, fh, indent=2)
+
+    path = args.baseline or os.path.join(BASELINES, f'{args.transport}-{args.size}.json')
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump(result, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print(f'baseline written to {os.path.relpath(path, ROOT)}')
+        return
+
+    if not os.path.exists(path):
+        print(f'no baseline at {os.path.relpath(path, ROOT)}; run with --save-baseline to record one')
+        return
+    with open(path) as fh:
+        regressions = compare(result, json.load(fh), args.tolerance)
+    if regressions:
+        print('REGRESSIONS against ' + os.path.relpath(path, ROOT))
+        for line in regressions:
+            print('  ' + line)
+        sys.exit(1)
+    print('no regressions against ' + os.path.relpath(path, ROOT))
+
+
+if __name__ == '__main__':
+    main()
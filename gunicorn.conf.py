@@ -0,0 +1,31 @@
+# gunicorn settings, used by the Procfile: gunicorn -c gunicorn.conf.py run:app
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Threaded workers: a request waiting on bcrypt (which releases the GIL) or on
+# the database no longer blocks the whole worker, so cheap catalog reads keep
+# flowing during a burst of logins. Set GUNICORN_WORKER_CLASS=sync to go back
+# to one request per worker, or gevent if it is installed.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# The app (and its engines) is built once in the master; app/database.py
+# drops the inherited connection pools in each worker after fork
+preload_app = True
+
+
+def when_ready(server):
+    # Build the catalog snapshot and the suggest index once, in the preloaded
+    # master; the workers map the same snapshot files and inherit the index
+    from app.snapshot import catalog
+    from app.suggest import index
+    catalog.build_now()
+    index.build_now()
+
+
+def worker_exit(server, worker):
+    # Write out search history still sitting in this worker's buffer
+    from app.history import history
+    history.flush()
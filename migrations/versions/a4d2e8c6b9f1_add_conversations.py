@@ -0,0 +1,82 @@
+"""Add conversations, message read state and message indexes
+
+Revision ID: a4d2e8c6b9f1
+Revises: f3c7a9e2d4b6
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d2e8c6b9f1'
+down_revision = 'f3c7a9e2d4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('retailer_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['retailer_id'], ['retailers.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'retailer_id', 'product_id', name='uq_conversations_participants')
+    )
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.create_index('ix_conversations_user_last_message', ['user_id', 'last_message_at', 'id'], unique=False)
+        batch_op.create_index('ix_conversations_retailer_last_message', ['retailer_id', 'last_message_at', 'id'], unique=False)
+
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('read_at', sa.DateTime(), nullable=True))
+        batch_op.create_foreign_key('fk_messages_conversation_id', 'conversations', ['conversation_id'], ['id'])
+
+    # Thread existing retailer messages: the shopper is whichever side is not
+    # the retailer's own user. History is treated as already read.
+    shopper = "CASE WHEN m.sender_id = r.user_id THEN m.receiver_id ELSE m.sender_id END"
+    op.execute(
+        "INSERT INTO conversations (user_id, retailer_id, product_id, created_at, last_message_at) "
+        f"SELECT {shopper}, m.retailer_id, m.product_id, min(m.sent_at), max(m.sent_at) "
+        "FROM messages m JOIN retailers r ON r.id = m.retailer_id "
+        f"GROUP BY {shopper}, m.retailer_id, m.product_id"
+    )
+    op.execute(
+        "UPDATE messages SET conversation_id = ("
+        "SELECT c.id FROM conversations c JOIN retailers r ON r.id = c.retailer_id "
+        "WHERE c.retailer_id = messages.retailer_id "
+        "AND (c.product_id = messages.product_id OR (c.product_id IS NULL AND messages.product_id IS NULL)) "
+        "AND c.user_id = CASE WHEN messages.sender_id = r.user_id THEN messages.receiver_id ELSE messages.sender_id END"
+        ") WHERE retailer_id IS NOT NULL"
+    )
+    op.execute("UPDATE messages SET read_at = sent_at")
+
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_sender_receiver_sent_at', ['sender_id', 'receiver_id', 'sent_at'], unique=False)
+        batch_op.create_index('ix_messages_receiver_sent_at', ['receiver_id', 'sent_at'], unique=False)
+        batch_op.create_index('ix_messages_retailer_sent_at', ['retailer_id', 'sent_at'], unique=False)
+        batch_op.create_index('ix_messages_conversation_sent_at', ['conversation_id', 'sent_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_conversation_sent_at')
+        batch_op.drop_index('ix_messages_retailer_sent_at')
+        batch_op.drop_index('ix_messages_receiver_sent_at')
+        batch_op.drop_index('ix_messages_sender_receiver_sent_at')
+        batch_op.drop_constraint('fk_messages_conversation_id', type_='foreignkey')
+        batch_op.drop_column('read_at')
+        batch_op.drop_column('conversation_id')
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversations_retailer_last_message')
+        batch_op.drop_index('ix_conversations_user_last_message')
+
+    op.drop_table('conversations')
@@ -0,0 +1,42 @@
+"""Add product full-text search index
+
+Revision ID: b7e3d1a4c920
+Revises: a1c4e2f9b7d3
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3d1a4c920'
+down_revision = 'a1c4e2f9b7d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_products_search ON products USING gin "
+            "(to_tsvector('simple'::regconfig, coalesce(name, '') || ' ' || coalesce(description, '')))"
+        )
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts "
+            "USING fts5(name, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            "INSERT INTO products_fts (rowid, name, description) "
+            "SELECT id, name, description FROM products"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_products_search")
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS products_fts")
@@ -0,0 +1,36 @@
+"""Add push_events for the Server-Sent Events channel
+
+Revision ID: b9e4c1f7a2d8
+Revises: a4d2e8c6b9f1
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e4c1f7a2d8'
+down_revision = 'a4d2e8c6b9f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('push_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('topic', sa.String(length=64), nullable=False),
+    sa.Column('kind', sa.String(length=32), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('push_events', schema=None) as batch_op:
+        batch_op.create_index('ix_push_events_topic_id', ['topic', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('push_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_push_events_topic_id')
+
+    op.drop_table('push_events')
@@ -0,0 +1,38 @@
+"""Add products.value_score for best-value ordering
+
+Revision ID: c2f8a6d5e1b4
+Revises: b7e3d1a4c920
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f8a6d5e1b4'
+down_revision = 'b7e3d1a4c920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('value_score', sa.Float(), nullable=False, server_default='0'))
+
+    # Same formula as Product.compute_value_score
+    op.execute(
+        "UPDATE products SET value_score = CASE "
+        "WHEN price + coalesce(delivery_cost, 0) > 0 "
+        "THEN (coalesce(estimated_value, 0) + coalesce(marginal_benefit, 0)) / (price + coalesce(delivery_cost, 0)) "
+        "ELSE 0 END"
+    )
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_value_score_id', ['value_score', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_value_score_id')
+        batch_op.drop_column('value_score')
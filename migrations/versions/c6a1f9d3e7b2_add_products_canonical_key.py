@@ -0,0 +1,46 @@
+"""Add products.canonical_key for cross-retailer price comparison
+
+Revision ID: c6a1f9d3e7b2
+Revises: b9e4c1f7a2d8
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a1f9d3e7b2'
+down_revision = 'b9e4c1f7a2d8'
+branch_labels = None
+depends_on = None
+
+
+def _canonical_key(name):
+    # Same normalization as Product.compute_canonical_key
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('canonical_key', sa.String(), nullable=False, server_default=''))
+
+    products = sa.table('products', sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('canonical_key', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(products.c.id, products.c.name)).all()
+    if rows:
+        bind.execute(
+            products.update().where(products.c.id == sa.bindparam('product_id')),
+            [{'product_id': product_id, 'canonical_key': _canonical_key(name)} for product_id, name in rows]
+        )
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_canonical_key_id', ['canonical_key', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_canonical_key_id')
+        batch_op.drop_column('canonical_key')
@@ -0,0 +1,36 @@
+"""Add collection_versions for conditional GETs
+
+Revision ID: d5a9c3e7f2b1
+Revises: c2f8a6d5e1b4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a9c3e7f2b1'
+down_revision = 'c2f8a6d5e1b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    collection_versions = op.create_table('collection_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.utcnow()
+    op.bulk_insert(collection_versions, [
+        {'name': name, 'version': 1, 'updated_at': now}
+        for name in ('products', 'retailers', 'categories', 'notifications', 'messages')
+    ])
+
+
+def downgrade():
+    op.drop_table('collection_versions')
@@ -0,0 +1,54 @@
+"""Index foreign keys and hot filters; one wishlist row per user and product
+
+Revision ID: d8f2b5a1c7e3
+Revises: c6a1f9d3e7b2
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f2b5a1c7e3'
+down_revision = 'c6a1f9d3e7b2'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('retailers', 'ix_retailers_user_id', ['user_id']),
+    ('products', 'ix_products_retailer_id_id', ['retailer_id', 'id']),
+    ('products', 'ix_products_category_id_id', ['category_id', 'id']),
+    ('feedback', 'ix_feedback_user_id', ['user_id']),
+    ('feedback', 'ix_feedback_product_id', ['product_id']),
+    ('user_history', 'ix_user_history_user_searched_at', ['user_id', 'searched_at']),
+    ('messages', 'ix_messages_sender_sent_at_id', ['sender_id', 'sent_at', 'id']),
+    ('messages', 'ix_messages_product_id', ['product_id']),
+    ('conversations', 'ix_conversations_product_id', ['product_id']),
+    ('wishlists', 'ix_wishlists_product_id', ['product_id']),
+    ('notifications', 'ix_notifications_retailer_id', ['retailer_id']),
+]
+
+
+def upgrade():
+    for table, name, columns in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(name, columns, unique=False)
+
+    # Keep the first of any duplicate wishlist entries
+    op.execute(
+        "DELETE FROM wishlists WHERE id NOT IN ("
+        "SELECT min(id) FROM wishlists GROUP BY user_id, product_id)"
+    )
+    with op.batch_alter_table('wishlists', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_wishlists_user_product', ['user_id', 'product_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('wishlists', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_wishlists_user_product', type_='unique')
+
+    for table, name, _ in reversed(INDEXES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(name)
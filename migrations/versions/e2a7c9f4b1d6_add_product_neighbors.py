@@ -0,0 +1,37 @@
+"""Add product_neighbors for item-to-item recommendations
+
+Revision ID: e2a7c9f4b1d6
+Revises: d8f2b5a1c7e3
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c9f4b1d6'
+down_revision = 'd8f2b5a1c7e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_neighbors',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('neighbor_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['neighbor_id'], ['products.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'rank')
+    )
+    with op.batch_alter_table('product_neighbors', schema=None) as batch_op:
+        batch_op.create_index('ix_product_neighbors_neighbor_id', ['neighbor_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_neighbors', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_neighbors_neighbor_id')
+
+    op.drop_table('product_neighbors')
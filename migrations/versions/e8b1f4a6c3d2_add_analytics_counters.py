@@ -0,0 +1,51 @@
+"""Add analytics_counters for the admin dashboard
+
+Revision ID: e8b1f4a6c3d2
+Revises: d5a9c3e7f2b1
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b1f4a6c3d2'
+down_revision = 'd5a9c3e7f2b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('analytics_counters',
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Same keys as app.analytics.recount()
+    op.execute("INSERT INTO analytics_counters (name, value) SELECT 'users', count(*) FROM users")
+    op.execute(
+        "INSERT INTO analytics_counters (name, value) "
+        "SELECT 'users.' || CASE WHEN is_admin THEN 'admin' WHEN is_retailer THEN 'retailer' ELSE 'shopper' END, count(*) "
+        "FROM users GROUP BY 1"
+    )
+    op.execute("INSERT INTO analytics_counters (name, value) SELECT 'retailers', count(*) FROM retailers")
+    op.execute(
+        "INSERT INTO analytics_counters (name, value) "
+        "SELECT CASE WHEN approved THEN 'retailers.approved' ELSE 'retailers.pending' END, count(*) "
+        "FROM retailers GROUP BY 1"
+    )
+    op.execute("INSERT INTO analytics_counters (name, value) SELECT 'products', count(*) FROM products")
+    op.execute(
+        "INSERT INTO analytics_counters (name, value) "
+        "SELECT 'products.category.' || category_id, count(*) FROM products GROUP BY category_id"
+    )
+    op.execute(
+        "INSERT INTO analytics_counters (name, value) "
+        "SELECT 'products.retailer.' || retailer_id, count(*) FROM products GROUP BY retailer_id"
+    )
+
+
+def downgrade():
+    op.drop_table('analytics_counters')
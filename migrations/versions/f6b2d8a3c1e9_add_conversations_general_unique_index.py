@@ -0,0 +1,58 @@
+"""Make general conversations unique per shopper and retailer
+
+Revision ID: f6b2d8a3c1e9
+Revises: e2a7c9f4b1d6
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b2d8a3c1e9'
+down_revision = 'e2a7c9f4b1d6'
+branch_labels = None
+depends_on = None
+
+# The oldest general conversation of each shopper and retailer pair
+KEEPER = """
+    SELECT min(k.id) FROM conversations k
+    WHERE k.user_id = c.user_id AND k.retailer_id = c.retailer_id AND k.product_id IS NULL
+"""
+
+
+def upgrade():
+    # Fold duplicates left by racing requests into the oldest thread first
+    op.execute(f"""
+        UPDATE messages SET conversation_id = (
+            SELECT ({KEEPER}) FROM conversations c WHERE c.id = messages.conversation_id
+        )
+        WHERE conversation_id IN (
+            SELECT c.id FROM conversations c WHERE c.product_id IS NULL AND c.id > ({KEEPER})
+        )
+    """)
+    op.execute("""
+        UPDATE conversations SET last_message_at = (
+            SELECT max(c.last_message_at) FROM conversations c
+            WHERE c.user_id = conversations.user_id AND c.retailer_id = conversations.retailer_id
+                AND c.product_id IS NULL
+        )
+        WHERE product_id IS NULL
+    """)
+    op.execute(f"""
+        DELETE FROM conversations WHERE id IN (
+            SELECT c.id FROM conversations c WHERE c.product_id IS NULL AND c.id > ({KEEPER})
+        )
+    """)
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.create_index(
+            'uq_conversations_general', ['user_id', 'retailer_id'], unique=True,
+            postgresql_where=sa.text('product_id IS NULL'), sqlite_where=sa.text('product_id IS NULL'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('uq_conversations_general')
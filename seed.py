@@ -1,115 +1,138 @@
+import argparse
+
+from sqlalchemy import insert
+
 from app import create_app, db
+from app.cache import cache
+from app.conditional import bump
+from app.datagen import DEFAULT_COUNTS, DataGenerator, sync_sequences
+from app.hashing import hasher
 from app.models import User, Retailer, Category, Product
-
-from datetime import datetime
+from app import analytics, search
 
 # Initialize the Flask app using the factory
 app = create_app()
 
-def seed_data():
+# The demo fixtures keep fixed ids (admin is user 1, vendorN is user N+1 and
+# retailer N, products follow the list below). They are written with bulk
+# inserts and one bcrypt hash per distinct password; `--products` and the
+# other counts add synthetic data on top (see app/datagen.py).
+
+VENDORS = [
+    {"name": "Naivas Supermarket", "whatsapp": "+254712345678"},
+    {"name": "Jumia Kenya", "whatsapp": "+254712345679"},
+    {"name": "Amazon Global", "whatsapp": "+15417543010"},
+    {"name": "Kilimall Kenya", "whatsapp": "+254712345680"},
+    {"name": "Souq UAE", "whatsapp": "+971501234567"}
+]
+
+# Retailers are indexes into VENDORS, categories into CATEGORIES
+CATEGORIES = ["Electronics", "Fashion", "Home & Kitchen"]
+PRODUCTS = [
+    {
+        "name": "Samsung Galaxy S23",
+        "category": 0,
+        "variants": [
+            {"price": 115000, "delivery": 500, "value": 125000, "marginal": 0.15, "retailer": 1},
+            {"price": 120000, "delivery": 0, "value": 130000, "marginal": 0.12, "retailer": 2},
+            {"price": 110000, "delivery": 1000, "value": 120000, "marginal": 0.10, "retailer": 3},
+            {"price": 125000, "delivery": 800, "value": 135000, "marginal": 0.08, "retailer": 4}
+        ]
+    },
+    {
+        "name": "HP EliteBook 840",
+        "category": 0,
+        "variants": [
+            {"price": 95000, "delivery": 1500, "value": 105000, "marginal": 0.12, "retailer": 0},
+            {"price": 89000, "delivery": 2000, "value": 98000, "marginal": 0.10, "retailer": 1},
+            {"price": 110000, "delivery": 0, "value": 120000, "marginal": 0.09, "retailer": 2}
+        ]
+    },
+    {
+        "name": "Levi's 501 Original Fit",
+        "category": 1,
+        "variants": [
+            {"price": 4500, "delivery": 300, "value": 5000, "marginal": 0.05, "retailer": 0},
+            {"price": 5000, "delivery": 0, "value": 5500, "marginal": 0.10, "retailer": 3},
+            {"price": 4800, "delivery": 500, "value": 5300, "marginal": 0.04, "retailer": 4}
+        ]
+    }
+]
+
+
+def _fixtures(conn):
+    conn.execute(insert(Category), [
+        {"id": i + 1, "name": name} for i, name in enumerate(CATEGORIES)
+    ])
+
+    # Create admin user and retailers (vendors)
+    vendor_hash = hasher.hash("vendor123")
+    conn.execute(insert(User), [
+        {"id": 1, "username": "admin", "email": "admin@buygenius.com",
+         "password_hash": hasher.hash("admin123"), "is_admin": True, "is_retailer": False},
+    ] + [
+        {"id": i + 2, "username": f"vendor{i+1}", "email": f"vendor{i+1}@example.com",
+         "password_hash": vendor_hash, "is_admin": False, "is_retailer": True}
+        for i in range(len(VENDORS))
+    ])
+    conn.execute(insert(Retailer), [
+        {"id": i + 1, "name": vendor["name"], "user_id": i + 2,
+         "whatsapp_number": vendor["whatsapp"], "approved": True}
+        for i, vendor in enumerate(VENDORS)
+    ])
+
+    # Create sample products
+    rows = []
+    for product_data in PRODUCTS:
+        for variant in product_data["variants"]:
+            rows.append({
+                "id": len(rows) + 1,
+                "name": product_data["name"],
+                "price": variant["price"],
+                "description": f"Brand new {product_data['name']} from {VENDORS[variant['retailer']]['name']}",
+                "delivery_cost": variant["delivery"],
+                "payment_mode": "Cash/Card/M-Pesa",
+                "retailer_id": variant["retailer"] + 1,
+                "category_id": product_data["category"] + 1,
+                "estimated_value": variant["value"],
+                "marginal_benefit": variant["marginal"],
+                "value_score": Product.compute_value_score(
+                    variant["price"], variant["delivery"], variant["value"], variant["marginal"]
+                ),
+                "canonical_key": Product.compute_canonical_key(product_data["name"]),
+                "image_url": f"https://example.com/images/{product_data['name'].replace(' ', '-').lower()}.jpg"
+            })
+    conn.execute(insert(Product), rows)
+
+
+def seed_data(seed=42, chunk_size=10000, **counts):
+    """Recreate the schema with the demo fixtures, plus synthetic rows for any non-zero ``counts``."""
     with app.app_context():
         # Clear existing data
         db.drop_all()
         db.create_all()
 
-        # Create categories
-        electronics = Category(name="Electronics")
-        fashion = Category(name="Fashion")
-        home = Category(name="Home & Kitchen")
-        db.session.add_all([electronics, fashion, home])
-        db.session.commit()
-
-        # Create admin user
-        admin = User(
-            username="admin",
-            email="admin@buygenius.com",
-            is_admin=True
-        )
-        admin.password = "admin123"
-        db.session.add(admin)
-        db.session.commit()
-
-        # Create retailers (vendors)
-        vendors = [
-            {"name": "Naivas Supermarket", "whatsapp": "+254712345678"},
-            {"name": "Jumia Kenya", "whatsapp": "+254712345679"},
-            {"name": "Amazon Global", "whatsapp": "+15417543010"},
-            {"name": "Kilimall Kenya", "whatsapp": "+254712345680"},
-            {"name": "Souq UAE", "whatsapp": "+971501234567"}
-        ]
+        with db.engine.begin() as conn:
+            _fixtures(conn)
+            sync_sequences(conn)
+            # Bulk inserts skip the ORM hooks that maintain derived state
+            search.rebuild_index(conn)
+            analytics.recount(conn)
+            bump(conn, 'products', 'retailers', 'categories')
 
-        retailers = []
-        for i, vendor in enumerate(vendors):
-            user = User(
-                username=f"vendor{i+1}",
-                email=f"vendor{i+1}@example.com",
-                is_retailer=True
-            )
-            user.password = "vendor123"
-            db.session.add(user)
-            db.session.flush()
-            
-            retailer = Retailer(
-                name=vendor["name"],
-                user_id=user.id,
-                whatsapp_number=vendor["whatsapp"],
-                approved=True
-            )
-            db.session.add(retailer)
-            retailers.append(retailer)
-        
-        db.session.commit()
-
-        # Create sample products
-        products_data = [
-            {
-                "name": "Samsung Galaxy S23",
-                "category": electronics,
-                "variants": [
-                    {"price": 115000, "delivery": 500, "value": 125000, "marginal": 0.15, "retailer": retailers[1]},
-                    {"price": 120000, "delivery": 0, "value": 130000, "marginal": 0.12, "retailer": retailers[2]},
-                    {"price": 110000, "delivery": 1000, "value": 120000, "marginal": 0.10, "retailer": retailers[3]},
-                    {"price": 125000, "delivery": 800, "value": 135000, "marginal": 0.08, "retailer": retailers[4]}
-                ]
-            },
-            {
-                "name": "HP EliteBook 840",
-                "category": electronics,
-                "variants": [
-                    {"price": 95000, "delivery": 1500, "value": 105000, "marginal": 0.12, "retailer": retailers[0]},
-                    {"price": 89000, "delivery": 2000, "value": 98000, "marginal": 0.10, "retailer": retailers[1]},
-                    {"price": 110000, "delivery": 0, "value": 120000, "marginal": 0.09, "retailer": retailers[2]}
-                ]
-            },
-            {
-                "name": "Levi's 501 Original Fit",
-                "category": fashion,
-                "variants": [
-                    {"price": 4500, "delivery": 300, "value": 5000, "marginal": 0.05, "retailer": retailers[0]},
-                    {"price": 5000, "delivery": 0, "value": 5500, "marginal": 0.10, "retailer": retailers[3]},
-                    {"price": 4800, "delivery": 500, "value": 5300, "marginal": 0.04, "retailer": retailers[4]}
-                ]
-            }
-        ]
+        if any(counts.values()):
+            generator = DataGenerator(db.engine, seed=seed, chunk_size=chunk_size, password="password")
+            generator.run(**{name: counts.get(name, 0) for name in DEFAULT_COUNTS})
 
-        for product_data in products_data:
-            for variant in product_data["variants"]:
-                product = Product(
-                    name=product_data["name"],
-                    price=variant["price"],
-                    description=f"Brand new {product_data['name']} from {variant['retailer'].name}",
-                    delivery_cost=variant["delivery"],
-                    payment_mode="Cash/Card/M-Pesa",
-                    retailer_id=variant["retailer"].id,
-                    category_id=product_data["category"].id,
-                    estimated_value=variant["value"],
-                    marginal_benefit=variant["marginal"],
-                    image_url=f"https://example.com/images/{product_data['name'].replace(' ', '-').lower()}.jpg"
-                )
-                db.session.add(product)
-        
-        db.session.commit()
+        cache.invalidate('products', 'categories', 'retailers')
         print("✅ Database seeded successfully!")
 
+
 if __name__ == "__main__":
-    seed_data()
+    parser = argparse.ArgumentParser(description="Reset the database to the demo fixtures, optionally with synthetic data.")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for synthetic data")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows per transaction")
+    for name in DEFAULT_COUNTS:
+        parser.add_argument(f"--{name}", type=int, default=0, help=f"synthetic {name} to add (e.g. {DEFAULT_COUNTS[name]})")
+    args = vars(parser.parse_args())
+    seed_data(**args)
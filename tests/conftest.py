@@ -0,0 +1,106 @@
+"""Shared fixtures: an app on a throwaway database, seeded rows and logins.
+
+Every app runs on its own SQLite file with the response cache, password
+hashing pool and recommendation refresher turned off; tests turn on what
+they exercise through ``make_app(**config)``. Set TEST_DATABASE_URL to run
+on Postgres instead (its tables are dropped and recreated).
+"""
+import os
+
+import pytest
+
+from app import create_app
+from app.config import Config
+from app.history import history
+from app.models import db, Category, Product, Retailer, User
+
+TEST_CONFIG = {
+    'TESTING': True,
+    'CACHE_TYPE': 'null',
+    'SESSION_BACKEND': 'cookie',
+    'REPLICA_DATABASE_URL': None,
+    'BCRYPT_ROUNDS': 4,
+    'PASSWORD_HASH_WORKERS': 0,
+    'RECOMMEND_ENABLED': False,
+    'CATALOG_SNAPSHOT_ENABLED': False,
+}
+
+PASSWORD = 'correct horse'
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """Build an app from Config plus ``overrides``, with its tables created."""
+    apps = []
+
+    def make(**overrides):
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': os.getenv('TEST_DATABASE_URL') or f"sqlite:///{tmp_path / 'test.db'}",
+            'CATALOG_SNAPSHOT_DIR': str(tmp_path / 'snapshot'),
+            **TEST_CONFIG,
+            **overrides,
+        }
+        for key, value in settings.items():
+            monkeypatch.setattr(Config, key, value, raising=False)
+        app = create_app()
+        with app.app_context():
+            if not apps:
+                db.drop_all(bind_key=None)
+            db.create_all(bind_key=None)
+        apps.append(app)
+        return app
+
+    yield make
+
+    # Searches queued by this test go to its own database, and its dedupe
+    # window doesn't carry over to the next test
+    history.flush()
+    history._reset()
+    for app in reversed(apps):
+        with app.app_context():
+            db.session.remove()
+            if app is apps[0]:
+                db.drop_all(bind_key=None)
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def catalog(app):
+    """A shopper, an approved retailer and three products; returns their ids."""
+    shopper = User(username='shopper', email='shopper@example.com', password=PASSWORD)
+    owner = User(username='store', email='store@example.com', password=PASSWORD, is_retailer=True)
+    retailer = Retailer(name='Store', user=owner, approved=True)
+    category = Category(name='Phones')
+    products = [
+        Product(name=name, price=price, delivery_cost=5, estimated_value=value, marginal_benefit=value / 2,
+                payment_mode='card', retailer=retailer, category=category)
+        for name, price, value in [('Galaxy S23', 800, 900), ('Pixel 8', 600, 750), ('Moto G', 200, 260)]
+    ]
+    db.session.add_all([shopper, owner, retailer, category, *products])
+    db.session.commit()
+    return {
+        'shopper': shopper.id,
+        'owner': owner.id,
+        'retailer': retailer.id,
+        'category': category.id,
+        'products': [product.id for product in products],
+    }
+
+
+def login(client, email, password=PASSWORD):
+    resp = client.post('/login', json={'email': email, 'password': password})
+    assert resp.status_code == 200, resp.get_json()
+    return resp
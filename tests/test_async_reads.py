@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+import pytest
+from starlette.applications import Starlette
+
+from app.async_db import async_db
+from app.async_reads import AsyncReads
+from app.cache import cache
+
+
+def call(app, paths, cookie=None):
+    """GET ``paths`` from the async handlers in one event loop; [(status, headers, body)]."""
+    asgi = Starlette(routes=AsyncReads(app).routes())
+    cookie_name = app.session_interface.get_cookie_name(app)
+
+    async def get(path):
+        path, _, query = path.partition('?')
+        headers = [(b'cookie', f'{cookie_name}={cookie}'.encode())] if cookie else []
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': headers, 'client': ('test', 1), 'server': ('test', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi(scope, receive, send)
+        start = messages[0]
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, body
+
+    async def run():
+        try:
+            return [await get(path) for path in paths]
+        finally:
+            await async_db.dispose()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('path', ['/products', '/products?sort=value&limit=2', '/categories', '/search/galaxy'])
+def test_async_bodies_match_flask(client, catalog, path):
+    flask = client.get(path)
+    [(status, headers, body)] = call(client.application, [path])
+    assert (status, body) == (flask.status_code, flask.data)
+    assert headers.get('etag') == flask.headers.get('ETag')
+
+
+def test_check_session_without_a_session_matches_flask(client):
+    flask = client.get('/check_session')
+    [(status, headers, body)] = call(client.application, ['/check_session'])
+    assert (status, body) == (flask.status_code, flask.data) == (204, b'')
+    assert headers['content-type'] == flask.headers['Content-Type'] == 'application/json'
+
+
+def test_cache_calls_leave_the_event_loop(make_app, catalog, monkeypatch):
+    app = make_app(CACHE_TYPE='simple')
+    threads = []
+    for name in ('key_for', 'get', 'set'):
+        method = getattr(cache, name)
+
+        def spy(*args, method=method, **kwargs):
+            threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+        monkeypatch.setattr(cache, name, spy)
+
+    with app.app_context():
+        responses = call(app, ['/categories', '/categories'])
+    assert [headers['x-cache'] for _, headers, _ in responses] == ['MISS', 'HIT']
+    assert len(threads) == 5
+    assert threading.main_thread() not in threads
@@ -0,0 +1,104 @@
+import shutil
+import time
+
+import pytest
+
+from app.cache import LRUCache, cache
+from app.models import db, Category
+
+
+@pytest.fixture
+def cached_app(make_app):
+    app = make_app(CACHE_TYPE='simple')
+    with app.app_context():
+        db.session.add(Category(name='Phones'))
+        db.session.commit()
+        yield app
+
+
+def names(resp):
+    return [category['name'] for category in resp.get_json()]
+
+
+def test_lru_counts_hits_and_misses():
+    lru = LRUCache(max_entries=4)
+    assert lru.get('a') is None
+    lru.set('a', b'1')
+    assert lru.get('a') == b'1'
+    assert (lru.hits, lru.misses) == (1, 1)
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_entries=2)
+    lru.set('a', b'1')
+    lru.set('b', b'2')
+    lru.get('a')
+    lru.set('c', b'3')
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == (b'1', b'3')
+    assert lru.evictions == 1
+
+
+def test_lru_expires_entries():
+    lru = LRUCache(default_timeout=60)
+    lru.set('a', b'1', timeout=0.01)
+    time.sleep(0.02)
+    assert lru.get('a') is None
+    assert lru.expirations == 1
+
+
+def test_second_read_is_a_hit(cached_app):
+    client = cached_app.test_client()
+    hits, misses = cache.hits, cache.misses
+    first, second = client.get('/categories'), client.get('/categories')
+    assert [first.headers['X-Cache'], second.headers['X-Cache']] == ['MISS', 'HIT']
+    assert first.data == second.data
+    assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+
+
+def test_write_invalidates_by_tag_version(cached_app):
+    client = cached_app.test_client()
+    client.get('/categories')
+
+    assert client.post('/categories', json={'name': 'Laptops'}).status_code == 201
+    resp = client.get('/categories')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert names(resp) == ['Phones', 'Laptops']
+    assert client.get('/categories').headers['X-Cache'] == 'HIT'
+
+
+def test_other_tags_stay_cached(cached_app):
+    client = cached_app.test_client()
+    client.get('/categories')
+    cache.invalidate('products')
+    assert client.get('/categories').headers['X-Cache'] == 'HIT'
+
+
+def test_lagging_replica_response_is_not_cached(make_app, tmp_path):
+    primary, replica = tmp_path / 'test.db', tmp_path / 'replica.db'
+    app = make_app(CACHE_TYPE='simple', REPLICA_DATABASE_URL=f'sqlite:///{replica}')
+    client = app.test_client()
+
+    def catch_up():
+        # The replica "applies" everything the primary has committed
+        db.engines['replica'].dispose()
+        shutil.copy(primary, replica)
+
+    with app.app_context():
+        db.session.add(Category(name='Phones'))
+        db.session.commit()
+        catch_up()
+
+        assert client.get('/categories').headers['X-Cache'] == 'MISS'
+        assert client.get('/categories').headers['X-Cache'] == 'HIT'
+
+        client.post('/categories', json={'name': 'Laptops'})
+        # Still the replica's old rows: served, but not stored under the new key
+        for _ in range(2):
+            resp = client.get('/categories')
+            assert (resp.headers['X-Cache'], names(resp)) == ('MISS', ['Phones'])
+
+        catch_up()
+        resp = client.get('/categories')
+        assert (resp.headers['X-Cache'], names(resp)) == ('MISS', ['Phones', 'Laptops'])
+        assert client.get('/categories').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,19 @@
+import pytest
+
+from test_async_reads import call
+
+
+@pytest.mark.parametrize('value', ['nan', 'NaN', 'inf', '-inf', 'Infinity', '1e999', '-1', 'ten'])
+@pytest.mark.parametrize('name', ['min_price', 'max_price', 'max_total'])
+def test_unusable_numbers_are_rejected(client, catalog, name, value):
+    path = f'/products?{name}={value}'
+    resp = client.get(path)
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': f'Invalid {name}'}
+    [(status, _, body)] = call(client.application, [path])
+    assert (status, body) == (resp.status_code, resp.data)
+
+
+def test_price_filters_apply(client, catalog):
+    resp = client.get('/products?min_price=500&max_total=700')
+    assert [product['name'] for product in resp.get_json()['products']] == ['Pixel 8']
@@ -0,0 +1,29 @@
+from app.history import history
+from app.models import UserHistory
+from conftest import login
+
+
+def test_post_returns_201_with_the_row_shape(client, catalog):
+    login(client, 'shopper@example.com')
+    resp = client.post('/search_history', json={'search_term': ' galaxy s23 '})
+    assert resp.status_code == 201
+    body = resp.get_json()
+    assert body.keys() == {'id', 'user_id', 'search_term', 'searched_at'}
+    assert (body['id'], body['user_id'], body['search_term']) == (None, catalog['shopper'], 'galaxy s23')
+
+
+def test_get_lists_searches_still_queued(client, catalog):
+    login(client, 'shopper@example.com')
+    client.post('/search_history', json={'search_term': 'pixel'})
+    assert history.has_pending(catalog['shopper'])
+
+    assert [row['search_term'] for row in client.get('/search_history').get_json()] == ['pixel']
+    assert not history.has_pending(catalog['shopper'])
+
+
+def test_repeats_inside_the_window_are_written_once(client, catalog):
+    login(client, 'shopper@example.com')
+    for term in ['Pixel', 'pixel ', 'PIXEL']:
+        assert client.post('/search_history', json={'search_term': term}).status_code == 201
+    history.flush()
+    assert UserHistory.query.filter_by(user_id=catalog['shopper']).count() == 1
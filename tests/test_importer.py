@@ -0,0 +1,92 @@
+import pytest
+
+from app.importer import ImportTooLargeError, checked_csv
+from app.models import Product
+from conftest import login
+
+CSV = 'text/csv'
+NDJSON = 'application/x-ndjson'
+
+
+@pytest.fixture
+def retailer(client, catalog):
+    login(client, 'store@example.com')
+    return client
+
+
+def upload(client, body, content_type):
+    return client.post('/products/import', data=body.encode('utf-8') if isinstance(body, str) else body,
+                       content_type=content_type)
+
+
+def test_csv_import_reports_bad_rows_and_inserts_the_rest(retailer):
+    body = (
+        'name,price,category,delivery_cost\n'
+        'Nokia 3310,40,Phones,\n'
+        ',10,Phones,\n'
+        'iPhone 15,-1,Phones,\n'
+        'Fairphone 5,700,Tablets,\n'
+        'Nothing Phone,500,phones,4.5\n'
+    )
+    resp = upload(retailer, body, CSV)
+    assert resp.status_code == 201
+    assert resp.get_json() == {
+        'received': 5, 'inserted': 2, 'failed': 3, 'truncated': False,
+        'errors': [
+            {'row': 3, 'error': {'name': 'Required'}},
+            {'row': 4, 'error': {'price': 'Must be a non-negative number'}},
+            {'row': 5, 'error': {'category': 'Unknown category'}},
+        ],
+    }
+    assert Product.query.filter(Product.name.in_(['Nokia 3310', 'Nothing Phone'])).count() == 2
+
+
+def test_ndjson_import_reports_bad_lines(retailer, catalog):
+    body = (
+        f'{{"name": "Nokia 3310", "price": 40, "category_id": {catalog["category"]}}}\n'
+        'not json\n'
+        '\n'
+        '[1, 2]\n'
+    ).encode('utf-8') + b'{"name": "\xff"}\n'
+    resp = upload(retailer, body, NDJSON)
+    assert resp.status_code == 201
+    assert resp.get_json()['errors'] == [
+        {'row': 2, 'error': 'Invalid JSON'},
+        {'row': 4, 'error': 'Expected a JSON object'},
+        {'row': 5, 'error': 'Invalid UTF-8'},
+    ]
+
+
+def test_nothing_inserted_is_400(retailer):
+    resp = upload(retailer, 'name,price,category\n,10,Phones\n', CSV)
+    assert resp.status_code == 400
+    assert resp.get_json()['inserted'] == 0
+
+
+def test_csv_that_is_not_utf8_is_refused(retailer):
+    resp = upload(retailer, b'name,price,category\nCaf\xe9,10,Phones\n', CSV)
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'Line 2 is not valid UTF-8'}
+    assert Product.query.count() == 3
+
+
+def test_csv_over_the_byte_limit_is_413(catalog, client):
+    client.application.config['IMPORT_MAX_BYTES'] = 64
+    login(client, 'store@example.com')
+    resp = upload(client, 'name,price,category\n' + 'Nokia 3310,40,Phones\n' * 10, CSV)
+    assert resp.status_code == 413
+    assert Product.query.count() == 3
+
+
+def test_checked_csv_stops_at_the_byte_limit():
+    read = []
+
+    def stream():
+        yield b'name,price\n'
+        for _ in range(1000):
+            read.append(1)
+            yield b'x,1\n'
+
+    with pytest.raises(ImportTooLargeError):
+        checked_csv(stream(), max_bytes=100)
+    assert len(read) < 30
@@ -0,0 +1,13 @@
+def test_streamed_responses_are_not_buffered(client, catalog):
+    resp = client.get('/products/export?format=ndjson')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert 'Content-Length' not in resp.headers
+    assert 'Server-Timing' in resp.headers
+    assert len(resp.get_data().splitlines()) == 3
+
+
+def test_json_responses_are_sized(client, catalog):
+    resp = client.get('/categories')
+    assert resp.headers['Content-Length'] == str(len(resp.data))
+    assert 'total;dur=' in resp.headers['Server-Timing']
@@ -0,0 +1,93 @@
+import asyncio
+from collections import deque
+
+from app import push
+from app.models import db, PushEvent
+from conftest import login
+
+
+def event(id, topic='user:1'):
+    return push.Event(id, topic, 'message', f'{{"id": {id}}}')
+
+
+def add_events(*ids, topic='user:1'):
+    for id in ids:
+        db.session.add(PushEvent(id=id, topic=topic, kind='message', payload=f'{{"id": {id}}}'))
+    db.session.commit()
+
+
+def sent_ids(chunks):
+    return [int(chunk.split(b'\n')[0][4:]) for chunk in chunks if chunk.startswith(b'id: ')]
+
+
+def test_slow_subscriber_gets_its_queued_events_before_the_stream_ends():
+    sub = push.ThreadSubscription(['user:1'], maxsize=2)
+    assert sub.offer(event(1)) and sub.offer(event(2))
+    assert not sub.offer(event(3))
+    sub.close()
+
+    assert sent_ids(push._sync_stream(sub, [], 0, heartbeat=0.01)) == [1, 2]
+
+
+def test_slow_async_subscriber_gets_its_queued_events_too():
+    async def run():
+        sub = push.AsyncSubscription(['user:1'], maxsize=2)
+        for id in (1, 2, 3):
+            sub._put(event(id))
+        assert sub.closed
+        return [chunk async for chunk in push.async_stream(sub, [], None, heartbeat=0.01)]
+
+    assert sent_ids(asyncio.run(run())) == [1, 2]
+
+
+def test_last_event_id_replays_what_was_missed(app):
+    add_events(1, 2, 3)
+    add_events(4, topic='user:2')
+
+    assert push.replay(['user:1'], None, 100) == []
+    assert [ev.id for ev in push.replay(['user:1'], 1, 100)] == [2, 3]
+    assert [ev.id for ev in push.replay(['user:1'], 1, 1)] == [2]
+
+
+def test_stream_skips_live_events_already_replayed_or_older():
+    sub = push.ThreadSubscription(['user:1'], maxsize=10)
+    backlog = [event(5), event(6)]
+    for id in (4, 6, 7):
+        sub.offer(event(id))
+    sub.close()
+
+    assert sent_ids(push._sync_stream(sub, backlog, 4, heartbeat=0.01)) == [5, 6, 7]
+
+
+def test_poller_delivers_late_commits_inside_the_reorder_window_once(app, monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(push.broker, '_dispatch', lambda ev: dispatched.append(ev.id))
+    delivered = deque(maxlen=400)
+
+    add_events(10, 11)
+    with db.engine.connect() as conn:
+        high = push.broker._poll(conn, 0, delivered)
+    # Id 5 was handed out earlier but committed after 10 and 11
+    add_events(5)
+    with db.engine.connect() as conn:
+        high = push.broker._poll(conn, high, delivered)
+        assert push.broker._poll(conn, high, delivered) == 11
+
+    assert dispatched == [10, 11, 5]
+
+
+def test_thread_streams_are_capped_per_process(client, catalog):
+    client.application.config['PUSH_MAX_THREAD_STREAMS'] = 1
+    login(client, 'shopper@example.com')
+
+    first = client.get('/events')
+    assert first.status_code == 200
+    busy = client.get('/events')
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == '30'
+
+    # Closing a stream frees its slot
+    first.close()
+    again = client.get('/events')
+    assert again.status_code == 200
+    again.close()
@@ -0,0 +1,20 @@
+"""Query-plan regression test: the `flask check-query-plans` check under pytest.
+
+Every hot query from app.query_plans is EXPLAINed against a small generated
+database and must not read a whole table. Runs on a throwaway SQLite file;
+set TEST_DATABASE_URL to check the plans on Postgres instead (that database
+is dropped and recreated).
+"""
+from app.datagen import DataGenerator
+from app.models import db
+from app.query_plans import check, hot_queries
+
+
+def test_hot_queries_use_indexes(app):
+    generator = DataGenerator(db.engine, seed=7, chunk_size=1000, log=lambda *args: None)
+    generator.run(users=200, retailers=5, products=2000, messages=1000, wishlists=300, history=500, feedback=200)
+
+    # The connection rolls back on close, taking check()'s SET LOCAL with it
+    with db.engine.connect() as connection:
+        failures = check(connection)
+    assert failures == {}, f'full table scans in {len(failures)} of {len(hot_queries())} hot queries'
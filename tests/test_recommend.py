@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import select
+
+from app import recommend
+from app.models import db, Feedback, Message, ProductNeighbor, User, Wishlist
+from app.recommend import recommender
+
+
+@pytest.fixture
+def app(make_app):
+    # The background refresher never fires by itself; tests call refresh()
+    app = make_app(RECOMMEND_ENABLED=True, RECOMMEND_REFRESH_INTERVAL=3600)
+    with app.app_context():
+        yield app
+    recommender._reset()
+
+
+def neighbors():
+    rows = db.session.execute(
+        select(ProductNeighbor.product_id, ProductNeighbor.neighbor_id, ProductNeighbor.score)
+        .order_by(ProductNeighbor.product_id, ProductNeighbor.rank)
+    ).all()
+    return [(product_id, neighbor_id, round(score, 6)) for product_id, neighbor_id, score in rows]
+
+
+def rebuilt():
+    with db.engine.begin() as connection:
+        recommend.rebuild(connection, recommender.neighbors)
+    return neighbors()
+
+
+def test_committed_signals_refresh_neighbors(client, catalog):
+    galaxy, pixel, moto = catalog['products']
+    shopper, owner = catalog['shopper'], catalog['owner']
+
+    db.session.add_all([Wishlist(user_id=shopper, product_id=galaxy), Wishlist(user_id=shopper, product_id=pixel)])
+    db.session.commit()
+    assert recommender.stats()['dirty_products'] == 2
+    assert recommender.refresh() > 0
+    similar = client.get(f'/products/{galaxy}/similar').get_json()['similar']
+    assert [row['product']['id'] for row in similar] == [pixel]
+
+    other = User(username='other', email='other@example.com', password='secret')
+    db.session.add(other)
+    db.session.flush()
+    db.session.add_all([
+        Message(sender_id=other.id, receiver_id=owner, product_id=pixel, content='Still available?'),
+        Feedback(user_id=other.id, product_id=moto, comment='Fine'),
+    ])
+    db.session.commit()
+    recommender.refresh()
+    refreshed = neighbors()
+    assert (pixel, moto) in [(product_id, neighbor_id) for product_id, neighbor_id, _ in refreshed]
+    assert refreshed == rebuilt()
+
+
+def test_rolled_back_signals_are_ignored(catalog):
+    db.session.add(Wishlist(user_id=catalog['shopper'], product_id=catalog['products'][0]))
+    db.session.flush()
+    db.session.rollback()
+    assert recommender.stats()['dirty_products'] == 0
+    assert recommender.refresh() == 0
+    assert neighbors() == []
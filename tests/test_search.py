@@ -0,0 +1,19 @@
+from app.models import db, Product
+
+
+def test_search_lists_matches_best_value_first(client, catalog):
+    cheap = db.session.get(Product, catalog['products'][2])
+    cheap.name = 'Moto G Galaxy case'
+    db.session.commit()
+
+    resp = client.get('/search/galaxy')
+    assert resp.status_code == 200
+    results = resp.get_json()['products']
+    matches = Product.query.filter(Product.name.contains('Galaxy')).all()
+    best_first = sorted(matches, key=lambda product: (product.value_score, product.id), reverse=True)
+    assert [result['product_id'] for result in results] == [product.id for product in best_first]
+    assert [result.get('recommended', False) for result in results] == [True, False]
+
+
+def test_search_without_matches_is_404(client, catalog):
+    assert client.get('/search/iphone').status_code == 404
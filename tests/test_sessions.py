@@ -0,0 +1,67 @@
+import pytest
+
+from app.models import db, Retailer, User
+from app.sessions import session_from_cookie
+from conftest import login
+from test_async_reads import call
+
+
+def cookie(client):
+    return client.get_cookie(client.application.config['SESSION_COOKIE_NAME']).value
+
+
+def test_cookie_holds_only_the_user_and_generation(client, catalog):
+    login(client, 'shopper@example.com')
+    assert session_from_cookie(client.application, cookie(client)) == {'user_id': catalog['shopper'], 'generation': 0}
+    assert client.get('/check_session').get_json() == {
+        'id': catalog['shopper'], 'username': 'shopper', 'is_retailer': False, 'is_admin': False
+    }
+
+
+def test_demoted_admin_loses_access_at_once(client, catalog):
+    db.session.get(User, catalog['shopper']).is_admin = True
+    db.session.commit()
+    login(client, 'shopper@example.com')
+    assert client.get('/cache_stats').status_code == 200
+
+    db.session.get(User, catalog['shopper']).is_admin = False
+    db.session.commit()
+    assert client.get('/cache_stats').status_code == 403
+
+
+def test_deleted_user_is_signed_out(client, catalog):
+    login(client, 'shopper@example.com')
+    db.session.delete(db.session.get(User, catalog['shopper']))
+    db.session.commit()
+
+    assert client.get('/wishlist').status_code == 401
+    assert client.get_cookie(client.application.config['SESSION_COOKIE_NAME']) is None
+
+
+def test_rejected_retailer_is_signed_out(client, catalog):
+    login(client, 'store@example.com')
+    assert client.get('/retailer_dashboard').status_code == 200
+
+    db.session.delete(db.session.get(Retailer, catalog['retailer']))
+    db.session.commit()
+    assert client.get('/retailer_dashboard').status_code == 401
+
+
+@pytest.mark.parametrize('backend', ['cookie', 'kv'])
+def test_logout_revokes_copies_of_the_cookie(make_app, backend):
+    app = make_app(SESSION_BACKEND=backend)
+    with app.app_context():
+        db.session.add(User(username='shopper', email='shopper@example.com', password='correct horse'))
+        db.session.commit()
+        client, thief = app.test_client(), app.test_client()
+        login(client, 'shopper@example.com')
+        stolen = cookie(client)
+        thief.set_cookie(app.config['SESSION_COOKIE_NAME'], stolen)
+        assert thief.get('/check_session').status_code == 200
+
+        assert client.delete('/logout').status_code == 204
+        assert thief.get('/check_session').status_code == 204
+        assert thief.get('/wishlist').status_code == 401
+        # The async /check_session reads the same generation
+        [(status, _, _)] = call(app, ['/check_session'], cookie=stolen)
+        assert status == 204
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from app import snapshot
+from app.conditional import current_version
+from app.models import db, Category, Product
+from app.pagination import keyset_result
+from app.snapshot import catalog
+
+
+@pytest.fixture
+def products(make_app, catalog):
+    # Shares a category with the fixture's phones; equal ratios test the id tiebreak
+    category = db.session.get(Category, catalog['category'])
+    retailer_id = catalog['retailer']
+    db.session.add_all([
+        Product(name=f'Case {n}', price=price, delivery_cost=delivery, estimated_value=value,
+                marginal_benefit=benefit, payment_mode=mode, retailer_id=retailer_id, category=category)
+        for n, (price, delivery, value, benefit, mode) in enumerate([
+            (10, 0, 20, 5, 'card'), (20, 0, 40, 10, 'cash'), (15, 5, 40, 10, 'card'),
+            (0, 0, 30, 3, 'card'), (50, 10, None, 12, 'cash'), (30, 0, 10, None, 'paypal'),
+        ])
+    ])
+    db.session.commit()
+    return catalog
+
+
+def sql_pages(sort, filters, limit):
+    ids, cursor = [], None
+    while True:
+        statement, columns = snapshot.ratio_page_query(sort, filters, limit, cursor)
+        rows, cursor = keyset_result(db.session.execute(statement).all(), columns, limit)
+        ids.extend(row.id for row in rows)
+        if cursor is None:
+            return ids
+
+
+def snapshot_pages(current, sort, filters, limit):
+    ids, cursor = [], None
+    while True:
+        page, cursor = current.rank(sort, filters, limit, cursor)
+        ids.extend(page)
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize('sort', sorted(snapshot.RATIO_SORTS))
+@pytest.mark.parametrize('filters', [{}, {'payment_mode': ['card']}, {'max_total': 100}, {'free_delivery': True}])
+def test_snapshot_ranks_like_sql(make_app, products, sort, filters):
+    make_app(CATALOG_SNAPSHOT_ENABLED=True)
+    assert catalog.build_now(force=True)
+    current = catalog.current(*current_version('products'))
+    assert current is not None
+
+    for limit in (1, 2, 50):
+        assert snapshot_pages(current, sort, filters, limit) == sql_pages(sort, filters, limit)
+
+
+def test_product_commits_rebuild_at_most_once_per_interval(make_app, products):
+    make_app(CATALOG_SNAPSHOT_ENABLED=True, CATALOG_SNAPSHOT_MIN_INTERVAL=0.5)
+    catalog.build_now(force=True)
+    builds = catalog.builds
+
+    for price in (11, 12, 13):
+        db.session.get(Product, products['products'][0]).price = price
+        db.session.commit()
+    time.sleep(0.2)
+    assert catalog.builds == builds
+    assert catalog.current(*current_version('products')) is None
+
+    catalog._thread.join(timeout=5)
+    assert catalog.builds == builds + 1
+    assert catalog.current(*current_version('products')) is not None
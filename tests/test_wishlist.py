@@ -0,0 +1,26 @@
+from conftest import login
+
+
+def test_add_missing_product_is_404_and_saves_nothing(client, catalog):
+    login(client, 'shopper@example.com')
+
+    resp = client.post('/wishlist', json={'product_id': 999})
+    assert resp.status_code == 404
+    assert resp.get_json() == {'error': 'Product not found'}
+
+    assert client.get('/wishlist').get_json() == []
+    assert client.get('/user_dashboard').status_code == 200
+
+
+def test_add_duplicate_product_is_400(client, catalog):
+    login(client, 'shopper@example.com')
+    product_id = catalog['products'][0]
+
+    resp = client.post('/wishlist', json={'product_id': product_id})
+    assert resp.status_code == 201
+    assert resp.get_json()['product']['id'] == product_id
+
+    resp = client.post('/wishlist', json={'product_id': product_id})
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'Product is already in the wishlist'}
+    assert len(client.get('/wishlist').get_json()) == 1